@@ -44,6 +44,8 @@ const AuthContext = createContext<AuthContextValue>({ token: null, serverUrl: ''
 
 const Stack = createNativeStackNavigator();
 
+const TRIPS_PAGE_SIZE = 50;
+
 const useAuth = () => useContext(AuthContext);
 
 const API = {
@@ -437,24 +439,52 @@ const RecorderScreen: React.FC<RecorderScreenProps> = ({ navigation }) => {
 const HistoryScreen: React.FC<HistoryScreenProps> = ({ navigation }) => {
   const auth = useAuth();
   const [trips, setTrips] = useState<TripSummary[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
+  const fetchPage = useCallback(
+    async (cursor: string | null) => {
+      const query = `limit=${TRIPS_PAGE_SIZE}${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''}`;
+      const res = await API.request(`/trips?${query}`, {}, auth);
+      const payload = await res.json();
+      return { trips: (payload.trips ?? []) as TripSummary[], nextCursor: (payload.next_cursor ?? null) as string | null };
+    },
+    [auth],
+  );
+
   const loadTrips = useCallback(async () => {
     if (!auth.token) {
       return;
     }
     try {
       setLoading(true);
-      const res = await API.request('/trips', {}, auth);
-      const payload = await res.json();
-      setTrips(payload.trips ?? []);
+      const page = await fetchPage(null);
+      setTrips(page.trips);
+      setNextCursor(page.nextCursor);
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Failed to load trips');
     } finally {
       setLoading(false);
     }
-  }, [auth]);
+  }, [auth, fetchPage]);
+
+  const loadMoreTrips = useCallback(async () => {
+    if (!nextCursor || loadingMore) {
+      return;
+    }
+    try {
+      setLoadingMore(true);
+      const page = await fetchPage(nextCursor);
+      setTrips((current) => [...current, ...page.trips]);
+      setNextCursor(page.nextCursor);
+    } catch (err) {
+      setError(err instanceof Error ? err.message : 'Failed to load trips');
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [fetchPage, loadingMore, nextCursor]);
 
   useEffect(() => {
     const unsubscribe = navigation.addListener('focus', () => {
@@ -492,6 +522,11 @@ const HistoryScreen: React.FC<HistoryScreenProps> = ({ navigation }) => {
             </Card>
           ))
         )}
+        {!loading && nextCursor ? (
+          <Button mode="outlined" onPress={loadMoreTrips} loading={loadingMore} disabled={loadingMore}>
+            Load more
+          </Button>
+        ) : null}
       </ScrollView>
       <Snackbar visible={!!error} onDismiss={() => setError(null)}>{error}</Snackbar>
     </SafeAreaView>
@@ -1,10 +1,14 @@
 import datetime as dt
+import threading
+import time
 import uuid
-from typing import Annotated
+from collections import OrderedDict
+from typing import Annotated, Optional
 
 import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy import event
 from sqlmodel import Session, select
 
 from .config import settings
@@ -32,11 +36,62 @@ def create_access_token(*, subject: uuid.UUID, email: str, role: UserRole) -> st
     return jwt.encode(payload, settings.jwt_secret, algorithm=settings.jwt_algorithm)
 
 
+class UserCache:
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[uuid.UUID, tuple[float, User]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: uuid.UUID) -> Optional[User]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return user
+
+    def put(self, user: User) -> None:
+        if self.ttl_seconds <= 0 or self.max_entries <= 0:
+            return
+        snapshot = User(id=user.id, email=user.email, name=user.name, role=user.role, created_at=user.created_at)
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl_seconds, snapshot)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: uuid.UUID) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache(settings.user_cache_max_entries, settings.user_cache_ttl_seconds)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target: User) -> None:
+    user_cache.invalidate(target.id)
+
+
 def _get_user_by_id(session: Session, user_id: uuid.UUID) -> User:
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
     statement = select(User).where(User.id == user_id)
     user = session.exec(statement).first()
     if not user:
         raise AuthError("User not found")
+    user_cache.put(user)
     return user
 
 
@@ -0,0 +1,56 @@
+import argparse
+import dataclasses
+import json
+
+from sqlmodel import Session
+
+from . import database
+from .config import settings
+from .services.gps import rebuild_tracks
+from .services.storage import migrate_to_cas
+from .services.sweeper import sweep
+
+
+def _migrate_storage(args: argparse.Namespace) -> None:
+    database.init_db()
+    with Session(database.engine) as session:
+        migrated = migrate_to_cas(session)
+    print(f"Migrated {migrated} stored files to content-addressed storage")
+
+
+def _rebuild_tracks(args: argparse.Namespace) -> None:
+    database.init_db()
+    with Session(database.engine) as session:
+        rebuilt = rebuild_tracks(session)
+    print(f"Rebuilt GPS tracks, stats and spatial index for {rebuilt} segments")
+
+
+def _sweep_storage(args: argparse.Namespace) -> None:
+    database.init_db()
+    if args.expiry_seconds is not None:
+        settings.upload_expiry_seconds = args.expiry_seconds
+    report = sweep(dry_run=args.dry_run)
+    print(json.dumps(dataclasses.asdict(report), indent=2))
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="bike-recorder-admin", description="BikeRecorder maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate-storage", help="Move legacy segment files into the SHA-256 blob store")
+    migrate.set_defaults(handler=_migrate_storage)
+    rebuild = commands.add_parser(
+        "rebuild-tracks", help="Re-ingest GPS sidecars into tracks, stats and the spatial index"
+    )
+    rebuild.set_defaults(handler=_rebuild_tracks)
+    sweeper = commands.add_parser(
+        "sweep-storage", help="Expire idle uploads, delete orphaned files and recompute per-user usage"
+    )
+    sweeper.add_argument("--dry-run", action="store_true", help="Report what would be deleted without deleting it")
+    sweeper.add_argument("--expiry-seconds", type=float, help="Override BIKE_RECORDER_UPLOAD_EXPIRY_SECONDS")
+    sweeper.set_defaults(handler=_sweep_storage)
+    args = parser.parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
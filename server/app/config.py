@@ -8,12 +8,68 @@ class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_prefix="BIKE_RECORDER_", env_file=".env", env_file_encoding="utf-8")
 
     database_url: str = "sqlite:///" + str(Path(__file__).resolve().parents[1] / "bike_recorder.db")
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout_seconds: float = 30.0
+    db_pool_recycle_seconds: int = 1800
+    db_pool_pre_ping: bool = True
+    db_statement_timeout_ms: Optional[int] = None
+    sqlite_journal_mode: str = "WAL"
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_mmap_size_bytes: int = 256 * 1024 * 1024
     storage_dir: Path = Path(__file__).resolve().parents[1] / "storage"
+    storage_backend: str = "filesystem"
+    s3_bucket: Optional[str] = None
+    s3_prefix: str = ""
+    s3_endpoint_url: Optional[str] = None
+    s3_region: Optional[str] = None
+    s3_access_key_id: Optional[str] = None
+    s3_secret_access_key: Optional[str] = None
+    s3_min_part_bytes: int = 5 * 1024 * 1024
     jwt_secret: str = "dev-secret-change-me"
     jwt_algorithm: str = "HS256"
     access_token_ttl_minutes: int = 60
+    user_cache_ttl_seconds: float = 30.0
+    user_cache_max_entries: int = 4096
     allow_registration: bool = True
     caddy_proxy_origin: Optional[str] = None
+    download_accel_redirect_prefix: Optional[str] = None
+    response_compression_min_bytes: Optional[int] = 1024
+    response_gzip_level: int = 5
+    response_brotli_quality: int = 4
+    upload_buffer_bytes: int = 1024 * 1024
+    upload_durable_offsets: bool = True
+    upload_checkpoint_bytes: int = 64 * 1024 * 1024
+    upload_checkpoint_interval_seconds: float = 30.0
+    upload_expiry_seconds: float = 7 * 24 * 3600
+    orphan_grace_seconds: float = 3600.0
+    sweeper_interval_seconds: Optional[float] = None
+    io_threads: int = 8
+    metadata_max_bytes: int = 512 * 1024 * 1024
+    gps_gap_seconds: float = 5.0
+    gps_max_accuracy_m: float = 25.0
+    gps_moving_speed_mps: float = 0.5
+    gps_max_speed_mps: float = 30.0
+    gps_smoothing_window_seconds: float = 10.0
+    gps_climb_threshold_m: float = 3.0
+    spatial_cell_degrees: float = 0.01
+    search_max_scanned_trips: int = 2000
+    mp4_max_moov_bytes: int = 256 * 1024 * 1024
+    ffmpeg_binary: str = "ffmpeg"
+    thumbnail_interval_seconds: float = 10.0
+    thumbnail_max_frames: int = 120
+    thumbnail_width: int = 240
+    thumbnail_sprite_columns: int = 10
+    thumbnail_timeout_seconds: float = 300.0
+    loop_lag_interval_seconds: float = 0.5
+    metrics_enabled: bool = True
+    worker_processes: int = 2
+    worker_poll_interval_seconds: float = 1.0
+    job_max_attempts: int = 5
+    job_backoff_seconds: float = 10.0
+    job_backoff_max_seconds: float = 3600.0
+    job_lease_seconds: float = 600.0
 
 
 settings = Settings()
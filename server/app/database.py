@@ -1,20 +1,107 @@
+from sqlalchemy import Enum, event, inspect, literal, text
+from sqlalchemy.engine import Connection, Engine, make_url
 from sqlmodel import SQLModel, create_engine, Session
 
 from .config import settings
 
 
-def get_engine():
+def _is_sqlite_memory(database: str | None) -> bool:
+    return not database or database == ":memory:" or "mode=memory" in database
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+    cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size_bytes)}")
+    cursor.close()
+
+
+def get_engine() -> Engine:
+    url = make_url(settings.database_url)
+    if url.get_backend_name() == "sqlite":
+        connect_args = {"check_same_thread": False, "timeout": settings.sqlite_busy_timeout_ms / 1000}
+        if _is_sqlite_memory(url.database):
+            return create_engine(url, connect_args=connect_args)
+        engine = create_engine(
+            url,
+            connect_args=connect_args,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout_seconds,
+            pool_pre_ping=settings.db_pool_pre_ping,
+        )
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+        return engine
     connect_args = {}
-    if settings.database_url.startswith("sqlite"):  # pragma: no branch - simple guard
-        connect_args = {"check_same_thread": False}
-    return create_engine(settings.database_url, connect_args=connect_args)
+    if url.get_backend_name() == "postgresql":
+        connect_args["application_name"] = "bike-recorder"
+        if settings.db_statement_timeout_ms:
+            connect_args["options"] = f"-c statement_timeout={int(settings.db_statement_timeout_ms)}"
+    return create_engine(
+        url,
+        connect_args=connect_args,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout_seconds,
+        pool_recycle=settings.db_pool_recycle_seconds,
+        pool_pre_ping=settings.db_pool_pre_ping,
+        pool_use_lifo=True,
+    )
 
 
 engine = get_engine()
 
 
+def _column_ddl(connection: Connection, column) -> str:
+    quote = connection.dialect.identifier_preparer.quote
+    ddl = f"{quote(column.name)} {column.type.compile(dialect=connection.dialect)}"
+    if not column.nullable:
+        # Existing rows take the model's scalar default.
+        if column.default is None or not column.default.is_scalar:
+            raise RuntimeError(f"Cannot add required column {column.table.name}.{column.name} without a default")
+        default = literal(column.default.arg, column.type).compile(
+            dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+        )
+        ddl += f" NOT NULL DEFAULT {default}"
+    foreign_keys = list(column.foreign_keys)
+    if len(foreign_keys) == 1:
+        target = foreign_keys[0].column
+        ddl += f" REFERENCES {quote(target.table.name)} ({quote(target.name)})"
+    return ddl
+
+
+def _add_enum_values(connection: Connection, column) -> None:
+    # Native PostgreSQL enums need new members added to the type; other backends store enums as plain strings.
+    if connection.dialect.name != "postgresql" or not isinstance(column.type, Enum) or not column.type.native_enum:
+        return
+    for value in column.type.enums:
+        connection.execute(text(f"ALTER TYPE {column.type.name} ADD VALUE IF NOT EXISTS '{value}'"))
+
+
+def upgrade_schema(connection: Connection) -> list[str]:
+    # create_all only creates missing tables, so columns and indexes added to existing tables since a database was
+    # created are added here, before anything (such as migrate_to_cas) queries them.
+    inspector = inspect(connection)
+    added = []
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                table_name = connection.dialect.identifier_preparer.format_table(table)
+                connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {_column_ddl(connection, column)}"))
+                added.append(f"{table.name}.{column.name}")
+            _add_enum_values(connection, column)
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+    return added
+
+
 def init_db() -> None:
     SQLModel.metadata.create_all(engine)
+    with engine.begin() as connection:
+        upgrade_schema(connection)
 
 
 def get_session():
@@ -26,4 +113,5 @@ def reset_engine(database_url: str | None = None) -> None:
     global engine
     if database_url:
         settings.database_url = database_url
+    engine.dispose()
     engine = get_engine()
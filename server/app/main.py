@@ -1,13 +1,35 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
+from .config import settings
 from .database import init_db
-from .routers import auth, devices, files, segments, trips, uploads, users
+from .routers import auth, devices, files, jobs, segments, trips, uploads, users
+from .services.monitoring import REGISTRY, LoopLagMonitor, MetricsMiddleware, instrument_sessions
+from .services.sweeper import PeriodicSweeper
 
 
 def create_app() -> FastAPI:
     init_db()
-    app = FastAPI(title="BikeRecorder API", version="0.1.0")
+    instrument_sessions()
+    loop_lag = LoopLagMonitor(settings.loop_lag_interval_seconds)
+    sweeper = PeriodicSweeper(settings.sweeper_interval_seconds) if settings.sweeper_interval_seconds else None
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        loop_lag.start()
+        if sweeper is not None:
+            sweeper.start()
+        yield
+        if sweeper is not None:
+            await sweeper.stop()
+        await loop_lag.stop()
+
+    app = FastAPI(title="BikeRecorder API", version="0.1.0", lifespan=lifespan)
+    app.state.loop_lag = loop_lag
+    app.state.sweeper = sweeper
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
@@ -15,14 +37,26 @@ def create_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    if settings.metrics_enabled:
+        app.add_middleware(MetricsMiddleware)
 
     @app.get("/healthz")
     def healthz() -> dict[str, str]:
         return {"status": "ok"}
 
     @app.get("/readyz")
-    def readyz() -> dict[str, str]:
-        return {"status": "ready"}
+    def readyz() -> dict[str, str | float]:
+        return {
+            "status": "ready",
+            "event_loop_lag_ms": round(loop_lag.last_lag * 1000, 3),
+            "event_loop_lag_max_ms": round(loop_lag.max_lag * 1000, 3),
+        }
+
+    if settings.metrics_enabled:
+
+        @app.get("/metrics", include_in_schema=False)
+        def metrics() -> PlainTextResponse:
+            return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
     app.include_router(auth.router)
     app.include_router(users.router)
@@ -31,6 +65,7 @@ def create_app() -> FastAPI:
     app.include_router(segments.router)
     app.include_router(uploads.router)
     app.include_router(files.router)
+    app.include_router(jobs.router)
 
     return app
 
@@ -3,7 +3,7 @@ import uuid
 from enum import Enum
 from typing import Optional
 
-from sqlmodel import Field, Relationship, SQLModel
+from sqlmodel import Field, Index, Relationship, SQLModel
 
 
 class UserRole(str, Enum):
@@ -48,6 +48,8 @@ class TripStatus(str, Enum):
 
 
 class Trip(SQLModel, table=True):
+    __table_args__ = (Index("ix_trip_user_start_time", "user_id", "start_time_utc", "id"),)
+
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     user_id: uuid.UUID = Field(foreign_key="user.id")
     device_id: uuid.UUID = Field(foreign_key="device.id")
@@ -55,6 +57,11 @@ class Trip(SQLModel, table=True):
     end_time_utc: Optional[dt.datetime] = None
     duration_s: Optional[int] = None
     distance_m: Optional[float] = None
+    moving_time_s: Optional[float] = None
+    max_speed_mps: Optional[float] = None
+    avg_speed_mps: Optional[float] = None
+    elevation_gain_m: Optional[float] = None
+    stats_updated_at: Optional[dt.datetime] = None
     status: TripStatus = Field(default=TripStatus.RECORDING)
     created_at: dt.datetime = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc))
 
@@ -64,7 +71,7 @@ class Trip(SQLModel, table=True):
 
 class Segment(SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
-    trip_id: uuid.UUID = Field(foreign_key="trip.id")
+    trip_id: uuid.UUID = Field(foreign_key="trip.id", index=True)
     index: int = Field(default=0)
     video_codec: Optional[str] = None
     audio_codec: Optional[str] = None
@@ -74,6 +81,13 @@ class Segment(SQLModel, table=True):
     file_size_bytes: Optional[int] = None
     duration_s: Optional[float] = None
     sha256: Optional[str] = None
+    media_created_utc: Optional[dt.datetime] = None
+    metadata_tracks: Optional[str] = None
+    media_error: Optional[str] = None
+    media_probed_at: Optional[dt.datetime] = None
+    thumbnail_interval_s: Optional[float] = None
+    thumbnail_count: Optional[int] = None
+    thumbnail_columns: Optional[int] = None
     created_at: dt.datetime = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc))
     completed_at: Optional[dt.datetime] = None
 
@@ -86,6 +100,7 @@ class FileType(str, Enum):
     GPS_GPX = "gps_gpx"
     GPS_JSONL = "gps_jsonl"
     THUMBNAIL_JPEG = "thumbnail_jpg"
+    THUMBNAIL_SPRITE = "thumbnail_sprite"
     METADATA_JSON = "metadata_json"
 
 
@@ -93,7 +108,8 @@ class StoredFile(SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     segment_id: uuid.UUID = Field(foreign_key="segment.id")
     type: FileType
-    storage_uri: str
+    storage_uri: str = Field(index=True)
+    filename: Optional[str] = None
     sha256: Optional[str] = None
     bytes: int = 0
     created_at: dt.datetime = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc))
@@ -101,6 +117,48 @@ class StoredFile(SQLModel, table=True):
     segment: Segment = Relationship(back_populates="files")
 
 
+class ReleasedBlob(SQLModel, table=True):
+    storage_uri: str = Field(primary_key=True)
+    released_at: dt.datetime = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc), index=True)
+
+
+class LocationTrack(SQLModel, table=True):
+    segment_id: uuid.UUID = Field(foreign_key="segment.id", primary_key=True)
+    source_type: FileType
+    source_sha256: Optional[str] = None
+    sample_count: int = 0
+    skipped_count: int = 0
+    start_time_utc: Optional[dt.datetime] = None
+    end_time_utc: Optional[dt.datetime] = None
+    min_lat: Optional[float] = None
+    max_lat: Optional[float] = None
+    min_lon: Optional[float] = None
+    max_lon: Optional[float] = None
+    sample_rate_hz: Optional[float] = None
+    gap_count: int = 0
+    max_gap_s: Optional[float] = None
+    distance_m: float = 0.0
+    moving_time_s: float = 0.0
+    max_speed_mps: Optional[float] = None
+    avg_speed_mps: Optional[float] = None
+    elevation_gain_m: float = 0.0
+    updated_at: dt.datetime = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc))
+
+
+class TrackCell(SQLModel, table=True):
+    __table_args__ = (Index("ix_trackcell_user_cell", "user_id", "cell_y", "cell_x"),)
+
+    segment_id: uuid.UUID = Field(foreign_key="segment.id", primary_key=True)
+    cell_x: int = Field(primary_key=True)
+    cell_y: int = Field(primary_key=True)
+    trip_id: uuid.UUID = Field(foreign_key="trip.id")
+    user_id: uuid.UUID = Field(foreign_key="user.id")
+    start_time_utc: dt.datetime
+    end_time_utc: dt.datetime
+    first_index: Optional[int] = None
+    last_index: Optional[int] = None
+
+
 class UploadStatus(str, Enum):
     PENDING = "pending"
     RECEIVING = "receiving"
@@ -108,18 +166,94 @@ class UploadStatus(str, Enum):
     FAILED = "failed"
 
 
+class UploadConcat(str, Enum):
+    PARTIAL = "partial"
+    FINAL = "final"
+
+
+class UploadBatchStatus(str, Enum):
+    OPEN = "open"
+    COMPLETE = "complete"
+    FAILED = "failed"
+
+
+class UploadBatch(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    trip_id: uuid.UUID = Field(foreign_key="trip.id", index=True)
+    status: UploadBatchStatus = Field(default=UploadBatchStatus.OPEN)
+    total_bytes: int
+    completed_bytes: int = 0
+    file_count: int
+    completed_files: int = 0
+    complete_trip: bool = True
+    created_at: dt.datetime = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc))
+    updated_at: dt.datetime = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc))
+    completed_at: Optional[dt.datetime] = None
+
+
 class UploadSession(SQLModel, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     trip_id: uuid.UUID = Field(foreign_key="trip.id")
     segment_id: uuid.UUID = Field(foreign_key="segment.id")
+    batch_id: Optional[uuid.UUID] = Field(default=None, foreign_key="uploadbatch.id", index=True)
+    concat: Optional[UploadConcat] = None
+    final_id: Optional[uuid.UUID] = Field(default=None, foreign_key="uploadsession.id", index=True)
+    part_index: Optional[int] = None
     filename: str
     file_type: FileType
     sha256: str
     upload_length: int
     offset: int = 0
+    sha256_state: Optional[bytes] = None
+    storage_handle: Optional[str] = None
     status: UploadStatus = Field(default=UploadStatus.PENDING)
     created_at: dt.datetime = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc))
     updated_at: dt.datetime = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc))
 
     trip: Trip = Relationship()
     segment: Segment = Relationship()
+
+
+class UserUsage(SQLModel, table=True):
+    user_id: uuid.UUID = Field(foreign_key="user.id", primary_key=True)
+    stored_files: int = 0
+    stored_bytes: int = 0
+    pending_uploads: int = 0
+    pending_upload_bytes: int = 0
+    updated_at: dt.datetime = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc))
+    reconciled_at: Optional[dt.datetime] = None
+
+
+class JobKind(str, Enum):
+    VERIFY_CHECKSUM = "verify_checksum"
+    INGEST_GPS = "ingest_gps"
+    EXTRACT_METADATA = "extract_metadata"
+    GENERATE_THUMBNAILS = "generate_thumbnails"
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class Job(SQLModel, table=True):
+    __table_args__ = (Index("ix_job_status_run_after", "status", "run_after"),)
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    kind: JobKind
+    idempotency_key: str = Field(unique=True)
+    payload: str = "{}"
+    user_id: Optional[uuid.UUID] = Field(default=None, foreign_key="user.id")
+    segment_id: Optional[uuid.UUID] = Field(default=None, foreign_key="segment.id", index=True)
+    status: JobStatus = Field(default=JobStatus.QUEUED)
+    attempts: int = 0
+    max_attempts: int = 5
+    run_after: dt.datetime = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc))
+    locked_by: Optional[str] = None
+    locked_until: Optional[dt.datetime] = None
+    last_error: Optional[str] = None
+    created_at: dt.datetime = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc))
+    updated_at: dt.datetime = Field(default_factory=lambda: dt.datetime.now(dt.timezone.utc))
+    finished_at: Optional[dt.datetime] = None
@@ -0,0 +1,257 @@
+import functools
+import gzip
+import os
+import secrets
+from pathlib import Path
+from typing import Any, Mapping, Optional
+from urllib.parse import quote
+
+import orjson
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+from starlette.datastructures import Headers
+from starlette.responses import RedirectResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from .config import settings
+from .models import StoredFile
+from .services.storage import get_storage, run_io
+
+try:  # pragma: no cover - optional dependency
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+MAX_RANGES = 16
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_range_header(value: str, size: int) -> Optional[list[tuple[int, int]]]:
+    # Returns inclusive (start, end) pairs, or None when the header should be ignored.
+    unit, _, spec = value.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    ranges: list[tuple[int, int]] = []
+    for part in spec.split(","):
+        first, sep, last = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if start > end and last:
+                    return None
+            else:
+                suffix = int(last)
+                if suffix == 0:
+                    continue
+                start = max(size - suffix, 0)
+                end = size - 1
+        except ValueError:
+            return None
+        if start < 0:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+    if not ranges:
+        raise RangeNotSatisfiable(value)
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return [(merged[0][0], merged[-1][1])]
+    return merged
+
+
+def etag_matches(header: Optional[str], etag: Optional[str]) -> bool:
+    if not header or not etag:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+class RangeFileResponse(Response):
+    def __init__(
+        self,
+        path: Path,
+        size: int,
+        media_type: str,
+        etag: Optional[str] = None,
+        ranges: Optional[list[tuple[int, int]]] = None,
+        headers: Optional[Mapping[str, str]] = None,
+    ):
+        self.path = path
+        self.size = size
+        self.media_type = media_type
+        self.background = None
+        self.body = b""
+        self._parts: list[tuple[bytes, int, int]] = []
+        self._trailer = b""
+        merged_headers = {"accept-ranges": "bytes", **(headers or {})}
+        if etag:
+            merged_headers["etag"] = etag
+        if not ranges:
+            self.status_code = 200
+            self._parts = [(b"", 0, size)]
+            content_type = media_type
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.status_code = 206
+            self._parts = [(b"", start, end - start + 1)]
+            merged_headers["content-range"] = f"bytes {start}-{end}/{size}"
+            content_type = media_type
+        else:
+            boundary = secrets.token_hex(16)
+            self.status_code = 206
+            for start, end in ranges:
+                prefix = (
+                    f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                )
+                self._parts.append(((b"\r\n" if self._parts else b"") + prefix.encode(), start, end - start + 1))
+            self._trailer = f"\r\n--{boundary}--\r\n".encode()
+            content_type = f"multipart/byteranges; boundary={boundary}"
+        length = sum(len(prefix) + count for prefix, _, count in self._parts) + len(self._trailer)
+        merged_headers["content-length"] = str(length)
+        merged_headers["content-type"] = content_type
+        self.init_headers(merged_headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        extensions = scope.get("extensions") or {}
+        if self.status_code == 200 and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+        fp = await run_io(open, self.path, "rb")
+        try:
+            for prefix, start, count in self._parts:
+                if prefix:
+                    await send({"type": "http.response.body", "body": prefix, "more_body": True})
+                if "http.response.zerocopy" in extensions:
+                    await send(
+                        {
+                            "type": "http.response.zerocopy",
+                            "file": fp,
+                            "offset": start,
+                            "count": count,
+                            "more_body": True,
+                        }
+                    )
+                    continue
+                position = start
+                remaining = count
+                while remaining:
+                    chunk = await run_io(os.pread, fp.fileno(), min(READ_CHUNK_BYTES, remaining), position)
+                    if not chunk:
+                        raise RuntimeError(f"File at path {self.path} was truncated.")
+                    position += len(chunk)
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            fp.close()
+        await send({"type": "http.response.body", "body": self._trailer, "more_body": False})
+
+
+def file_response(
+    request_headers: Headers,
+    path: Path,
+    size: int,
+    media_type: str,
+    etag: Optional[str] = None,
+    headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    base_headers = {"accept-ranges": "bytes", **(headers or {})}
+    if etag:
+        base_headers["etag"] = etag
+    if etag_matches(request_headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=base_headers)
+    ranges = None
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    if range_header and (if_range is None or (etag is not None and if_range.strip() == etag)):
+        try:
+            ranges = parse_range_header(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**base_headers, "content-range": f"bytes */{size}"})
+    return RangeFileResponse(path, size, media_type, etag=etag, ranges=ranges, headers=headers)
+
+
+def stored_file_response(
+    request_headers: Headers,
+    stored_file: StoredFile,
+    media_type: str,
+    redirect_seconds: int,
+    headers: Optional[Mapping[str, str]] = None,
+) -> Response:
+    storage = get_storage()
+    file_path = storage.local_path(stored_file.storage_uri)
+    if file_path is None:
+        url = storage.presign(stored_file.storage_uri, redirect_seconds, stored_file.filename)
+        return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+    try:
+        size = file_path.stat().st_size
+    except FileNotFoundError as exc:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="File missing from storage") from exc
+    etag = f'"{stored_file.sha256}"' if stored_file.sha256 else None
+    response_headers = dict(headers or {})
+    if stored_file.filename:
+        response_headers["content-disposition"] = f"inline; filename*=UTF-8''{quote(stored_file.filename)}"
+    if settings.download_accel_redirect_prefix:
+        prefix = settings.download_accel_redirect_prefix.rstrip("/")
+        response_headers["x-accel-redirect"] = f"{prefix}/{stored_file.storage_uri}"
+        if etag:
+            response_headers["etag"] = etag
+        return Response(media_type=media_type, headers=response_headers)
+    return file_response(request_headers, file_path, size, media_type, etag=etag, headers=response_headers)
+
+
+@functools.cache
+def _schema_fields(schema: type[BaseModel]) -> tuple[str, ...]:
+    return tuple(schema.model_fields)
+
+
+def orm_dict(schema: type[BaseModel], obj: Any) -> dict[str, Any]:
+    # Rows loaded from the database are already typed, so the schema only names the fields to copy.
+    # Loaded column values are read from the instance dict; expired ones go through the ORM.
+    state = obj.__dict__
+    return {name: state[name] if name in state else getattr(obj, name) for name in _schema_fields(schema)}
+
+
+def _accepted_encodings(accept_encoding: Optional[str]) -> set[str]:
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.partition(";")
+        quality = params.strip().removeprefix("q=")
+        if token.strip() and quality not in ("0", "0.0", "0.00", "0.000"):
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+def json_response(request_headers: Headers, content: Any, status_code: int = 200) -> Response:
+    body = orjson.dumps(content, option=orjson.OPT_UTC_Z)
+    headers = {}
+    threshold = settings.response_compression_min_bytes
+    if threshold is not None and len(body) >= threshold:
+        headers["vary"] = "Accept-Encoding"
+        accepted = _accepted_encodings(request_headers.get("accept-encoding"))
+        if brotli is not None and "br" in accepted:
+            body = brotli.compress(body, quality=settings.response_brotli_quality)
+            headers["content-encoding"] = "br"
+        elif "gzip" in accepted:
+            body = gzip.compress(body, compresslevel=settings.response_gzip_level, mtime=0)
+            headers["content-encoding"] = "gzip"
+    return Response(body, status_code=status_code, media_type="application/json", headers=headers)
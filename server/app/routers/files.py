@@ -1,18 +1,40 @@
 import uuid
-
-from fastapi import APIRouter, Depends, HTTPException, Response, status
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from sqlmodel import Session
 
 from ..auth import CurrentUser
-from ..config import settings
 from ..database import get_session
-from ..models import Segment, StoredFile, Trip, UserRole
+from ..models import FileType, Segment, StoredFile, Trip, UserRole
+from ..responses import stored_file_response
 from ..schemas import DownloadToken, StoredFileRead
 from ..security import create_download_token, verify_download_token
 
 router = APIRouter(prefix="/files", tags=["files"])
 
+DOWNLOAD_REDIRECT_SECONDS = 600
+
+MEDIA_TYPES = {
+    FileType.VIDEO_MP4: "video/mp4",
+    FileType.GPS_GPX: "application/gpx+xml",
+    FileType.GPS_JSONL: "application/x-ndjson",
+    FileType.THUMBNAIL_JPEG: "image/jpeg",
+    FileType.THUMBNAIL_SPRITE: "image/jpeg",
+    FileType.METADATA_JSON: "application/json",
+}
+
+
+@router.api_route("/download", methods=["GET", "HEAD"])
+def download_file(token: str, request: Request, session: Session = Depends(get_session)) -> Response:
+    try:
+        file_id = verify_download_token(token)
+    except Exception as exc:  # pragma: no cover - defensive
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid token") from exc
+    stored_file = session.get(StoredFile, file_id)
+    if not stored_file:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="File not found")
+    media_type = MEDIA_TYPES.get(stored_file.type, "application/octet-stream")
+    return stored_file_response(request.headers, stored_file, media_type, DOWNLOAD_REDIRECT_SECONDS)
+
 
 @router.get("/{file_id}", response_model=StoredFileRead)
 def get_file_metadata(
@@ -55,18 +77,3 @@ def get_download_token(
         raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Forbidden")
     token, expires_at = create_download_token(file_id)
     return DownloadToken(token=token, expires_at=expires_at)
-
-
-@router.get("/download")
-def download_file(token: str, session: Session = Depends(get_session)) -> Response:
-    try:
-        file_id = verify_download_token(token)
-    except Exception as exc:  # pragma: no cover - defensive
-        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid token") from exc
-    stored_file = session.get(StoredFile, file_id)
-    if not stored_file:
-        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="File not found")
-    file_path = settings.storage_dir / stored_file.storage_uri
-    if not file_path.exists():
-        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="File missing from storage")
-    return FileResponse(file_path)
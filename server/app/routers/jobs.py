@@ -0,0 +1,52 @@
+import uuid
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlmodel import Session, select
+
+from ..auth import CurrentUser
+from ..database import get_session
+from ..models import Job, UserRole
+from ..schemas import JobRead
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+
+def _job_read(job: Job) -> JobRead:
+    return JobRead(
+        id=job.id,
+        kind=job.kind,
+        status=job.status,
+        segment_id=job.segment_id,
+        attempts=job.attempts,
+        max_attempts=job.max_attempts,
+        run_after=job.run_after,
+        last_error=job.last_error,
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+    )
+
+
+@router.get("", response_model=list[JobRead])
+def list_jobs(
+    current_user: CurrentUser,
+    session: Session = Depends(get_session),
+    segment_id: uuid.UUID = Query(),
+) -> list[JobRead]:
+    statement = select(Job).where(Job.segment_id == segment_id).order_by(Job.created_at)
+    if current_user.role != UserRole.ADMIN:
+        statement = statement.where(Job.user_id == current_user.id)
+    return [_job_read(job) for job in session.exec(statement).all()]
+
+
+@router.get("/{job_id}", response_model=JobRead)
+def get_job(
+    job_id: uuid.UUID,
+    current_user: CurrentUser,
+    session: Session = Depends(get_session),
+) -> JobRead:
+    job = session.get(Job, job_id)
+    if not job:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Job not found")
+    if job.user_id != current_user.id and current_user.role != UserRole.ADMIN:
+        raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Forbidden")
+    return _job_read(job)
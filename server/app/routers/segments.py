@@ -1,25 +1,40 @@
+import datetime as dt
+import math
 import uuid
+from pathlib import Path
 
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlmodel import Session
+import numpy as np
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from sqlmodel import Session, select
+from starlette.requests import ClientDisconnect
 
 from ..auth import CurrentUser
-from ..config import settings
 from ..database import get_session
-from ..models import FileType, Segment, StoredFile, Trip, UserRole
-from ..schemas import SegmentMetadataRequest, StoredFileRead
-from ..services.storage import compute_sha256
+from ..responses import stored_file_response
+from ..models import FileType, LocationTrack, Segment, StoredFile, Trip, UserRole
+from ..schemas import (
+    LocationTrackRead,
+    PositionRead,
+    PositionsRequest,
+    PositionsResponse,
+    SegmentMetadataRequest,
+    StoredFileRead,
+)
+from ..services.alignment import build_alignment, load_alignment, lookup_positions, video_epoch
+from ..services.gps import GPS_FILE_TYPES
+from ..services.jobs import enqueue_gps_ingest
+from ..services.sidecar import SIDECAR_MEDIA_TYPES, SidecarDecodeError, SidecarWriter, UnsupportedEncoding
+from ..services.storage import ChunkTooLarge, compute_sha256, get_temp_path, run_io, store_and_attach
 
 router = APIRouter(prefix="/segments", tags=["segments"])
 
+SPRITE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+SPRITE_REDIRECT_SECONDS = 3600
 
-@router.post("/{segment_id}/metadata", response_model=StoredFileRead, status_code=status.HTTP_201_CREATED)
-def attach_metadata(
-    segment_id: uuid.UUID,
-    payload: SegmentMetadataRequest,
-    current_user: CurrentUser,
-    session: Session = Depends(get_session),
-) -> StoredFileRead:
+
+def _get_owned_segment(session: Session, segment_id: uuid.UUID, current_user: CurrentUser) -> Segment:
     segment = session.get(Segment, segment_id)
     if not segment:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Segment not found")
@@ -28,24 +43,49 @@ def attach_metadata(
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Trip not found")
     if trip.user_id != current_user.id and current_user.role != UserRole.ADMIN:
         raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Forbidden")
+    return segment
+
+
+def _write_metadata(content: str) -> tuple[Path, str]:
+    path = get_temp_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+    return path, compute_sha256(path)
+
+
+def _save_metadata(
+    session: Session,
+    segment: Segment,
+    file_type: FileType,
+    path: Path,
+    sha: str,
+    filename: str,
+) -> StoredFile:
+    stored = store_and_attach(session, segment.id, file_type, path, sha, filename)
+    session.commit()
+    session.refresh(stored)
+    return stored
+
+
+@router.post("/{segment_id}/metadata", response_model=StoredFileRead, status_code=status.HTTP_201_CREATED)
+async def attach_metadata(
+    segment_id: uuid.UUID,
+    payload: SegmentMetadataRequest,
+    current_user: CurrentUser,
+    session: Session = Depends(get_session),
+) -> StoredFileRead:
+    segment = await run_io(_get_owned_segment, session, segment_id, current_user)
     if payload.type not in {FileType.GPS_GPX, FileType.GPS_JSONL, FileType.METADATA_JSON}:
         raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Unsupported metadata type")
     filename = payload.filename or f"metadata_{payload.type.value}.txt"
-    dest_dir = settings.storage_dir / "segments" / str(segment.id)
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    dest_path = dest_dir / filename
-    dest_path.write_text(payload.content)
-    sha = compute_sha256(dest_path)
-    stored = StoredFile(
-        segment_id=segment.id,
-        type=payload.type,
-        storage_uri=str(dest_path.relative_to(settings.storage_dir)),
-        sha256=sha,
-        bytes=dest_path.stat().st_size,
-    )
-    session.add(stored)
-    session.commit()
-    session.refresh(stored)
+    path, sha = await run_io(_write_metadata, payload.content)
+    stored = await run_io(_save_metadata, session, segment, payload.type, path, sha, filename)
+    if payload.type in GPS_FILE_TYPES:
+        await run_io(enqueue_gps_ingest, session, stored, current_user.id)
+    return _stored_file_read(stored)
+
+
+def _stored_file_read(stored: StoredFile) -> StoredFileRead:
     return StoredFileRead(
         id=stored.id,
         type=stored.type,
@@ -53,3 +93,144 @@ def attach_metadata(
         bytes=stored.bytes,
         storage_uri=stored.storage_uri,
     )
+
+
+@router.put("/{segment_id}/metadata", response_model=StoredFileRead, status_code=status.HTTP_201_CREATED)
+async def stream_metadata(
+    segment_id: uuid.UUID,
+    request: Request,
+    current_user: CurrentUser,
+    session: Session = Depends(get_session),
+    filename: Optional[str] = None,
+    validate: bool = False,
+    content_type: str = Header(alias="Content-Type"),
+    content_encoding: Optional[str] = Header(default=None, alias="Content-Encoding"),
+) -> StoredFileRead:
+    segment = await run_io(_get_owned_segment, session, segment_id, current_user)
+    file_type = SIDECAR_MEDIA_TYPES.get(content_type.split(";", 1)[0].strip().lower())
+    if file_type is None:
+        raise HTTPException(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail="Unsupported metadata content type")
+    path = get_temp_path()
+    try:
+        sink = await run_io(SidecarWriter, path, file_type, content_encoding, validate)
+    except UnsupportedEncoding as exc:
+        raise HTTPException(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(exc)) from exc
+    try:
+        # Decoding, validation and hashing run per body chunk on the I/O pool, so
+        # memory stays bounded by the write buffer whatever the sidecar's size.
+        async for data in request.stream():
+            await run_io(sink.write, data)
+        sha, _ = await run_io(sink.close)
+    except ChunkTooLarge as exc:
+        await run_io(sink.abort)
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Metadata body is too large") from exc
+    except SidecarDecodeError as exc:
+        await run_io(sink.abort)
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+    except ClientDisconnect as exc:
+        await run_io(sink.abort)
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Client disconnected") from exc
+    except Exception:
+        await run_io(sink.abort)
+        raise
+    if sink.validator.error_count:
+        await run_io(sink.abort)
+        raise HTTPException(
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={
+                "message": f"{sink.validator.error_count} invalid records out of {sink.validator.records}",
+                "errors": sink.validator.errors,
+            },
+        )
+    filename = filename or f"metadata_{file_type.value}.txt"
+    stored = await run_io(_save_metadata, session, segment, file_type, path, sha, filename)
+    if file_type in GPS_FILE_TYPES:
+        await run_io(enqueue_gps_ingest, session, stored, current_user.id)
+    return _stored_file_read(stored)
+
+
+@router.get("/{segment_id}/track", response_model=LocationTrackRead)
+def get_track_summary(
+    segment_id: uuid.UUID,
+    current_user: CurrentUser,
+    session: Session = Depends(get_session),
+) -> LocationTrackRead:
+    segment = _get_owned_segment(session, segment_id, current_user)
+    location_track = session.get(LocationTrack, segment.id)
+    if not location_track:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="No GPS track ingested for this segment")
+    return LocationTrackRead.model_validate(location_track, from_attributes=True)
+
+
+def _alignment_index(session: Session, segment: Segment) -> np.ndarray:
+    index = load_alignment(segment.id)
+    if index is None:
+        index = build_alignment(session, segment.id)
+    if index is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="No GPS track aligned with this segment")
+    return index
+
+
+def _optional(value: float) -> float | None:
+    return None if math.isnan(value) else value
+
+
+@router.get("/{segment_id}/position", response_model=PositionRead)
+def get_position(
+    segment_id: uuid.UUID,
+    current_user: CurrentUser,
+    session: Session = Depends(get_session),
+    t: float = Query(ge=0),
+) -> PositionRead:
+    segment = _get_owned_segment(session, segment_id, current_user)
+    positions = lookup_positions(_alignment_index(session, segment), np.array([t]))
+    if math.isnan(positions["lat"][0]):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="No GPS fix at this video time")
+    epoch = video_epoch(segment, session.get(LocationTrack, segment.id))
+    return PositionRead(
+        t=t,
+        ts_utc=dt.datetime.fromtimestamp(epoch + t, dt.timezone.utc),
+        lat=float(positions["lat"][0]),
+        lon=float(positions["lon"][0]),
+        alt=_optional(float(positions["alt"][0])),
+        spd=_optional(float(positions["spd"][0])),
+        brg=_optional(float(positions["brg"][0])),
+    )
+
+
+@router.post("/{segment_id}/positions", response_model=PositionsResponse)
+def get_positions(
+    segment_id: uuid.UUID,
+    payload: PositionsRequest,
+    current_user: CurrentUser,
+    session: Session = Depends(get_session),
+) -> PositionsResponse:
+    segment = _get_owned_segment(session, segment_id, current_user)
+    positions = lookup_positions(_alignment_index(session, segment), np.array(payload.t, dtype=np.float64))
+    columns = {name: [_optional(value) for value in values.tolist()] for name, values in positions.items()}
+    return PositionsResponse(t=payload.t, **columns)
+
+
+@router.api_route("/{segment_id}/sprite", methods=["GET", "HEAD"])
+def get_sprite(
+    segment_id: uuid.UUID,
+    request: Request,
+    current_user: CurrentUser,
+    session: Session = Depends(get_session),
+) -> Response:
+    segment = _get_owned_segment(session, segment_id, current_user)
+    statement = select(StoredFile).where(
+        StoredFile.segment_id == segment.id,
+        StoredFile.type == FileType.THUMBNAIL_SPRITE,
+    )
+    sprite = session.exec(statement.order_by(StoredFile.created_at.desc())).first()
+    if not sprite or not segment.thumbnail_count:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="No thumbnails generated for this segment")
+    # The sprite is content-addressed, so a given ETag never changes and clients may cache it forever.
+    headers = {
+        "cache-control": SPRITE_CACHE_CONTROL,
+        "x-sprite-columns": str(segment.thumbnail_columns),
+        "x-sprite-frames": str(segment.thumbnail_count),
+        "x-sprite-interval-seconds": f"{segment.thumbnail_interval_s:g}",
+    }
+    return stored_file_response(request.headers, sprite, "image/jpeg", SPRITE_REDIRECT_SECONDS, headers)
@@ -1,22 +1,35 @@
+import base64
 import datetime as dt
 import uuid
+from collections import defaultdict
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlmodel import Session, select
+from typing import Any
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlmodel import Session, and_, func, or_, select
+from sqlmodel.sql.expression import SelectOfScalar
 
 from ..auth import CurrentUser
+from ..config import settings
 from ..database import get_session
-from ..models import Device, Segment, Trip, TripStatus, UserRole
+from ..models import Device, Segment, TrackCell, Trip, TripStatus, UserRole
+from ..responses import json_response, orm_dict
 from ..schemas import (
     SegmentCreateRequest,
     SegmentRead,
     SegmentCompleteRequest,
+    SegmentPolyline,
     TripCreateRequest,
     TripDetail,
     TripRead,
+    TripSearchResponse,
+    TripTrackResponse,
     TripUpdateRequest,
     TripsResponse,
 )
+from ..services.gps import load_track
+from ..services.polyline import POLYLINE_ZOOMS, level_for_zoom, read_polyline, write_pyramid
+from ..services.spatial import area_condition, area_mask, fixes_in_cells
 
 router = APIRouter(prefix="/trips", tags=["trips"])
 
@@ -26,6 +39,22 @@ def _ensure_trip_access(trip: Trip, current_user: CurrentUser) -> None:
         raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Forbidden")
 
 
+def _trip_read(trip: Trip) -> TripRead:
+    return TripRead(
+        id=trip.id,
+        device_id=trip.device_id,
+        start_time_utc=trip.start_time_utc,
+        end_time_utc=trip.end_time_utc,
+        duration_s=trip.duration_s,
+        distance_m=trip.distance_m,
+        moving_time_s=trip.moving_time_s,
+        max_speed_mps=trip.max_speed_mps,
+        avg_speed_mps=trip.avg_speed_mps,
+        elevation_gain_m=trip.elevation_gain_m,
+        status=trip.status,
+    )
+
+
 @router.post("", response_model=TripRead, status_code=status.HTTP_201_CREATED)
 def create_trip(
     payload: TripCreateRequest,
@@ -44,90 +73,244 @@ def create_trip(
     session.add(trip)
     session.commit()
     session.refresh(trip)
-    return TripRead(
-        id=trip.id,
-        device_id=trip.device_id,
-        start_time_utc=trip.start_time_utc,
-        end_time_utc=trip.end_time_utc,
-        duration_s=trip.duration_s,
-        distance_m=trip.distance_m,
-        status=trip.status,
+    return _trip_read(trip)
+
+
+def _segment_read(segment: Segment) -> SegmentRead:
+    return SegmentRead(
+        id=segment.id,
+        trip_id=segment.trip_id,
+        index=segment.index,
+        file_size_bytes=segment.file_size_bytes,
+        duration_s=segment.duration_s,
+        sha256=segment.sha256,
+        video_codec=segment.video_codec,
+        audio_codec=segment.audio_codec,
+        width=segment.width,
+        height=segment.height,
+        fps=segment.fps,
+        media_error=segment.media_error,
+        thumbnail_interval_s=segment.thumbnail_interval_s,
+        thumbnail_count=segment.thumbnail_count,
+        thumbnail_columns=segment.thumbnail_columns,
+        created_at=segment.created_at,
     )
 
 
+def _trip_detail(trip: Trip, segments: list[Segment] | None) -> dict[str, Any]:
+    # Read endpoints serialize ORM rows straight to JSON; TripDetail stays the documented response model.
+    detail = orm_dict(TripRead, trip)
+    detail["segments"] = [orm_dict(SegmentRead, segment) for segment in segments] if segments is not None else None
+    return detail
+
+
+def _encode_cursor(trip: Trip) -> str:
+    raw = f"{trip.start_time_utc.isoformat()}|{trip.id.hex}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[dt.datetime, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        start_time, trip_id = raw.split("|")
+        return dt.datetime.fromisoformat(start_time), uuid.UUID(trip_id)
+    except ValueError as exc:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from exc
+
+
+def _after_cursor(statement: SelectOfScalar[Trip], cursor: str | None) -> SelectOfScalar[Trip]:
+    if not cursor:
+        return statement
+    start_time, trip_id = _decode_cursor(cursor)
+    return statement.where(
+        or_(
+            Trip.start_time_utc < start_time,
+            and_(Trip.start_time_utc == start_time, Trip.id < trip_id),
+        )
+    )
+
+
+def _owner_id(current_user: CurrentUser, user_id: uuid.UUID | None) -> uuid.UUID:
+    if user_id and current_user.role == UserRole.ADMIN:
+        return user_id
+    return current_user.id
+
+
 @router.get("", response_model=TripsResponse)
 def list_trips(
+    request: Request,
     current_user: CurrentUser,
     session: Session = Depends(get_session),
     user_id: uuid.UUID | None = Query(default=None),
-) -> TripsResponse:
-    statement = select(Trip).order_by(Trip.start_time_utc.desc())
-    if user_id and current_user.role == UserRole.ADMIN:
-        statement = statement.where(Trip.user_id == user_id)
-    else:
-        statement = statement.where(Trip.user_id == current_user.id)
+    cursor: str | None = Query(default=None),
+    limit: int = Query(default=50, ge=1, le=500),
+    include_segments: bool = Query(default=True),
+) -> Response:
+    statement = (
+        select(Trip)
+        .where(Trip.user_id == _owner_id(current_user, user_id))
+        .order_by(Trip.start_time_utc.desc(), Trip.id.desc())
+        .limit(limit + 1)
+    )
+    statement = _after_cursor(statement, cursor)
     trips = session.exec(statement).all()
-    result = []
-    for trip in trips:
-        segments = session.exec(select(Segment).where(Segment.trip_id == trip.id).order_by(Segment.index)).all()
-        result.append(
-            TripDetail(
-                id=trip.id,
-                device_id=trip.device_id,
-                start_time_utc=trip.start_time_utc,
-                end_time_utc=trip.end_time_utc,
-                duration_s=trip.duration_s,
-                distance_m=trip.distance_m,
-                status=trip.status,
-                segments=[
-                    SegmentRead(
-                        id=segment.id,
-                        trip_id=segment.trip_id,
-                        index=segment.index,
-                        file_size_bytes=segment.file_size_bytes,
-                        duration_s=segment.duration_s,
-                        sha256=segment.sha256,
-                        created_at=segment.created_at,
-                    )
-                    for segment in segments
-                ],
-            )
+    next_cursor = _encode_cursor(trips[limit - 1]) if len(trips) > limit else None
+    trips = trips[:limit]
+    if not include_segments:
+        content = {"trips": [_trip_detail(trip, None) for trip in trips], "next_cursor": next_cursor}
+        return json_response(request.headers, content)
+    segments_by_trip: dict[uuid.UUID, list[Segment]] = defaultdict(list)
+    if trips:
+        segments = session.exec(
+            select(Segment)
+            .where(Segment.trip_id.in_([trip.id for trip in trips]))
+            .order_by(Segment.trip_id, Segment.index)
+        ).all()
+        for segment in segments:
+            segments_by_trip[segment.trip_id].append(segment)
+    content = {"trips": [_trip_detail(trip, segments_by_trip[trip.id]) for trip in trips], "next_cursor": next_cursor}
+    return json_response(request.headers, content)
+
+
+@router.get("/search", response_model=TripSearchResponse)
+def search_trips(
+    request: Request,
+    current_user: CurrentUser,
+    session: Session = Depends(get_session),
+    min_lat: float | None = Query(default=None, ge=-90, le=90),
+    min_lon: float | None = Query(default=None, ge=-180, le=180),
+    max_lat: float | None = Query(default=None, ge=-90, le=90),
+    max_lon: float | None = Query(default=None, ge=-180, le=180),
+    lat: float | None = Query(default=None, ge=-90, le=90),
+    lon: float | None = Query(default=None, ge=-180, le=180),
+    radius_m: float | None = Query(default=None, gt=0, le=1_000_000),
+    user_id: uuid.UUID | None = Query(default=None),
+    cursor: str | None = Query(default=None),
+    limit: int = Query(default=50, ge=1, le=500),
+) -> Response:
+    bbox = (min_lat, min_lon, max_lat, max_lon)
+    circle = (lat, lon, radius_m)
+    if all(value is not None for value in bbox) and all(value is None for value in circle):
+        if min_lat > max_lat:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="min_lat must not exceed max_lat")
+        area = {"bbox": bbox}
+    elif all(value is not None for value in circle) and all(value is None for value in bbox):
+        area = {"center": (lat, lon), "radius_m": radius_m}
+    else:
+        raise HTTPException(
+            status.HTTP_400_BAD_REQUEST,
+            detail="Pass either min_lat, min_lon, max_lat and max_lon or lat, lon and radius_m",
         )
-    return TripsResponse(trips=result)
+    owner_id = _owner_id(current_user, user_id)
+    cells = area_condition(**area)
+    matching = select(TrackCell.trip_id).where(TrackCell.user_id == owner_id, cells)
+    statement = (
+        select(Trip)
+        .where(Trip.user_id == owner_id, Trip.id.in_(matching))
+        .order_by(Trip.start_time_utc.desc(), Trip.id.desc())
+        .limit(limit + 1)
+    )
+    # The grid cells only pick candidates; their fixes are then checked against the exact area. Candidates that
+    # turn out to be outside it are dropped, and further batches are read until the page is full or
+    # search_max_scanned_trips candidates have been checked. A page cut short that way still has a next_cursor.
+    hits: list[tuple[Trip, list[dict[str, Any]]]] = []
+    after = cursor
+    scanned = 0
+    next_cursor = None
+    while True:
+        candidates = session.exec(_after_cursor(statement, after)).all()
+        scanned += len(candidates)
+        ranges_by_trip = _exact_ranges(session, owner_id, candidates, cells, area)
+        hits.extend((trip, ranges_by_trip[trip.id]) for trip in candidates if ranges_by_trip.get(trip.id))
+        if len(hits) > limit:
+            next_cursor = _encode_cursor(hits[limit - 1][0])
+            break
+        if len(candidates) <= limit:
+            break
+        after = _encode_cursor(candidates[-1])
+        if scanned >= settings.search_max_scanned_trips:
+            next_cursor = after
+            break
+    trips = [{**orm_dict(TripRead, trip), "segments": ranges} for trip, ranges in hits[:limit]]
+    return json_response(request.headers, {"trips": trips, "next_cursor": next_cursor})
+
+
+def _exact_ranges(
+    session: Session, owner_id: uuid.UUID, trips: list[Trip], cells: Any, area: dict[str, Any]
+) -> dict[uuid.UUID, list[dict[str, Any]]]:
+    ranges_by_trip: dict[uuid.UUID, list[dict[str, Any]]] = defaultdict(list)
+    if not trips:
+        return ranges_by_trip
+    rows = session.exec(
+        select(
+            TrackCell.trip_id,
+            TrackCell.segment_id,
+            TrackCell.cell_x,
+            TrackCell.cell_y,
+            TrackCell.first_index,
+            TrackCell.last_index,
+        ).where(TrackCell.user_id == owner_id, TrackCell.trip_id.in_([trip.id for trip in trips]), cells)
+    ).all()
+    cells_by_segment: dict[tuple[uuid.UUID, uuid.UUID], list[tuple[int, int, Any, Any]]] = defaultdict(list)
+    for trip_id, segment_id, x, y, first, last in rows:
+        cells_by_segment[trip_id, segment_id].append((x, y, first, last))
+    for (trip_id, segment_id), segment_cells in cells_by_segment.items():
+        track = load_track(segment_id)
+        if track is None:
+            continue
+        fixes = track[fixes_in_cells(track, segment_cells)]
+        inside = fixes["ts"][area_mask(fixes, **area)]
+        if len(inside):
+            ranges_by_trip[trip_id].append(
+                {
+                    "segment_id": segment_id,
+                    "start_time_utc": dt.datetime.fromtimestamp(float(inside.min()), dt.timezone.utc),
+                    "end_time_utc": dt.datetime.fromtimestamp(float(inside.max()), dt.timezone.utc),
+                }
+            )
+    for ranges in ranges_by_trip.values():
+        ranges.sort(key=lambda hit: hit["start_time_utc"])
+    return ranges_by_trip
 
 
 @router.get("/{trip_id}", response_model=TripDetail)
 def get_trip(
     trip_id: uuid.UUID,
+    request: Request,
     current_user: CurrentUser,
     session: Session = Depends(get_session),
-) -> TripDetail:
+) -> Response:
     trip = session.get(Trip, trip_id)
     if not trip:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Trip not found")
     _ensure_trip_access(trip, current_user)
     segments = session.exec(select(Segment).where(Segment.trip_id == trip.id).order_by(Segment.index)).all()
-    return TripDetail(
-        id=trip.id,
-        device_id=trip.device_id,
-        start_time_utc=trip.start_time_utc,
-        end_time_utc=trip.end_time_utc,
-        duration_s=trip.duration_s,
-        distance_m=trip.distance_m,
-        status=trip.status,
-        segments=[
-            SegmentRead(
-                id=segment.id,
-                trip_id=segment.trip_id,
-                index=segment.index,
-                file_size_bytes=segment.file_size_bytes,
-                duration_s=segment.duration_s,
-                sha256=segment.sha256,
-                created_at=segment.created_at,
-            )
-            for segment in segments
-        ],
-    )
+    return json_response(request.headers, _trip_detail(trip, list(segments)))
+
+
+@router.get("/{trip_id}/track", response_model=TripTrackResponse)
+def get_trip_track(
+    trip_id: uuid.UUID,
+    current_user: CurrentUser,
+    session: Session = Depends(get_session),
+    zoom: int = Query(default=POLYLINE_ZOOMS[-1], ge=0, le=22),
+) -> TripTrackResponse:
+    trip = session.get(Trip, trip_id)
+    if not trip:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Trip not found")
+    _ensure_trip_access(trip, current_user)
+    level = level_for_zoom(zoom)
+    polylines = []
+    for segment in session.exec(select(Segment).where(Segment.trip_id == trip.id).order_by(Segment.index)).all():
+        encoded = read_polyline(segment.id, zoom)
+        if encoded is None:
+            # Tracks ingested before the pyramid existed are simplified once on first request.
+            track = load_track(segment.id)
+            if track is None:
+                continue
+            encoded = write_pyramid(segment.id, track)[level]
+        polylines.append(SegmentPolyline(segment_id=segment.id, index=segment.index, polyline=encoded))
+    return TripTrackResponse(trip_id=trip.id, zoom=level, segments=polylines)
 
 
 @router.patch("/{trip_id}", response_model=TripRead)
@@ -143,24 +326,17 @@ def update_trip(
     _ensure_trip_access(trip, current_user)
     if payload.end_time_utc:
         trip.end_time_utc = payload.end_time_utc
-    if payload.duration_s is not None:
+    # Once GPS sidecars have been ingested the server-computed values win.
+    if payload.duration_s is not None and trip.stats_updated_at is None:
         trip.duration_s = payload.duration_s
-    if payload.distance_m is not None:
+    if payload.distance_m is not None and trip.stats_updated_at is None:
         trip.distance_m = payload.distance_m
     if payload.status is not None:
         trip.status = payload.status
     session.add(trip)
     session.commit()
     session.refresh(trip)
-    return TripRead(
-        id=trip.id,
-        device_id=trip.device_id,
-        start_time_utc=trip.start_time_utc,
-        end_time_utc=trip.end_time_utc,
-        duration_s=trip.duration_s,
-        distance_m=trip.distance_m,
-        status=trip.status,
-    )
+    return _trip_read(trip)
 
 
 @router.post("/{trip_id}/segments", response_model=SegmentRead, status_code=status.HTTP_201_CREATED)
@@ -191,15 +367,7 @@ def create_segment(
         trip.status = TripStatus.UPLOADING
         session.add(trip)
         session.commit()
-    return SegmentRead(
-        id=segment.id,
-        trip_id=segment.trip_id,
-        index=segment.index,
-        file_size_bytes=segment.file_size_bytes,
-        duration_s=segment.duration_s,
-        sha256=segment.sha256,
-        created_at=segment.created_at,
-    )
+    return _segment_read(segment)
 
 
 @router.patch("/{trip_id}/segments/{segment_id}", response_model=SegmentRead)
@@ -219,7 +387,7 @@ def finalize_segment(
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Segment not found")
     if payload.file_size_bytes is not None:
         segment.file_size_bytes = payload.file_size_bytes
-    if payload.duration_s is not None:
+    if payload.duration_s is not None and (segment.media_probed_at is None or segment.media_error):
         segment.duration_s = payload.duration_s
     if payload.sha256 is not None:
         segment.sha256 = payload.sha256
@@ -230,12 +398,4 @@ def finalize_segment(
     session.add(trip)
     session.commit()
     session.refresh(segment)
-    return SegmentRead(
-        id=segment.id,
-        trip_id=segment.trip_id,
-        index=segment.index,
-        file_size_bytes=segment.file_size_bytes,
-        duration_s=segment.duration_s,
-        sha256=segment.sha256,
-        created_at=segment.created_at,
-    )
+    return _segment_read(segment)
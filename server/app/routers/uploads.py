@@ -1,29 +1,68 @@
 import datetime as dt
+import functools
+import time
 import uuid
+from typing import Optional
 
 from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status
-from sqlmodel import Session
+from sqlalchemy import update
+from sqlmodel import Session, select
+from starlette.requests import ClientDisconnect
 
 from ..auth import CurrentUser
 from ..config import settings
 from ..database import get_session
-from ..models import FileType, Segment, StoredFile, Trip, UploadSession, UploadStatus
-from ..schemas import UploadCreateRequest, UploadRead
-from ..services.storage import finalize_upload, get_upload_path, write_chunk
+from ..models import (
+    FileType,
+    Segment,
+    StoredFile,
+    Trip,
+    TripStatus,
+    UploadBatch,
+    UploadBatchStatus,
+    UploadConcat,
+    UploadSession,
+    UploadStatus,
+)
+from ..schemas import BatchUploadRead, UploadBatchCreateRequest, UploadBatchRead, UploadCreateRequest, UploadRead
+from ..services.jobs import enqueue_checksum, enqueue_processing
+from ..services.hashing import ResumableSha256
+from ..services.monitoring import UPLOAD_RECEIVED_BYTES, UPLOAD_THROUGHPUT, UPLOADS_IN_PROGRESS
+from ..services.storage import (
+    ChunkTooLarge,
+    ChunkTooSmall,
+    append_journal,
+    attach_blob,
+    blob_uri,
+    claim_blob,
+    discard_journal,
+    get_storage,
+    read_journal,
+    read_sha256,
+    resume_sha256,
+    run_io,
+    staged_uri,
+)
 
 router = APIRouter(prefix="/uploads", tags=["uploads"])
 
+PARTS_UNAVAILABLE = "Partial uploads must be complete and not part of another final upload"
+
 
 @router.post("", response_model=UploadRead, status_code=status.HTTP_201_CREATED)
 def create_upload(
     payload: UploadCreateRequest,
     current_user: CurrentUser,
     session: Session = Depends(get_session),
+    upload_concat: Optional[str] = Header(default=None, alias="Upload-Concat"),
 ) -> UploadRead:
     trip = session.get(Trip, payload.trip_id)
     segment = session.get(Segment, payload.segment_id)
     if not trip or not segment or segment.trip_id != trip.id or trip.user_id != current_user.id:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Trip or segment not found")
+    concat, part_ids = _parse_concat(upload_concat)
+    if concat == UploadConcat.FINAL:
+        return _create_final(session, payload, part_ids)
     upload = UploadSession(
         trip_id=payload.trip_id,
         segment_id=payload.segment_id,
@@ -32,10 +71,130 @@ def create_upload(
         sha256=payload.sha256,
         upload_length=payload.upload_length,
         status=UploadStatus.PENDING,
+        concat=concat,
     )
+    # Partial uploads stay at a staging key, where they can be read and copied from once sealed.
+    sha256 = payload.sha256 if concat is None else None
+    upload.storage_handle = get_storage().begin_upload(str(upload.id), sha256)
+    session.add(upload)
+    session.commit()
+    session.refresh(upload)
+    return _upload_read(upload)
+
+
+def _parse_concat(value: Optional[str]) -> tuple[Optional[UploadConcat], list[uuid.UUID]]:
+    # tus Concatenation: "partial", or "final;<url> <url> ..." listing the partial uploads in order.
+    if value is None:
+        return None, []
+    kind, _, urls = value.strip().partition(";")
+    if kind == UploadConcat.PARTIAL.value and not urls:
+        return UploadConcat.PARTIAL, []
+    if kind == UploadConcat.FINAL.value:
+        try:
+            part_ids = [uuid.UUID(url.rstrip("/").rsplit("/", 1)[-1]) for url in urls.split()]
+        except ValueError:
+            part_ids = []
+        if part_ids and len(set(part_ids)) == len(part_ids):
+            return UploadConcat.FINAL, part_ids
+    raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="Invalid Upload-Concat header")
+
+
+def _assemble_final(upload: UploadSession, parts: list[UploadSession]) -> None:
+    storage = get_storage()
+    staged = [(str(part.id), part.storage_handle, part.upload_length) for part in parts]
+    storage.concat_uploads(str(upload.id), upload.storage_handle, staged)
+    storage.seal_upload(str(upload.id), upload.storage_handle, upload.upload_length)
+
+
+def _create_final(session: Session, payload: UploadCreateRequest, part_ids: list[uuid.UUID]) -> UploadRead:
+    found = {part.id: part for part in session.exec(select(UploadSession).where(UploadSession.id.in_(part_ids)))}
+    parts = [found.get(part_id) for part_id in part_ids]
+    if any(
+        part is None or part.segment_id != payload.segment_id or part.concat != UploadConcat.PARTIAL for part in parts
+    ):
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Partial upload not found")
+    if any(part.status != UploadStatus.COMPLETE or part.final_id is not None for part in parts):
+        raise HTTPException(status.HTTP_409_CONFLICT, detail=PARTS_UNAVAILABLE)
+    if sum(part.upload_length for part in parts) != payload.upload_length:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail="upload_length must be the sum of the partial uploads")
+    storage = get_storage()
+    upload = UploadSession(
+        trip_id=payload.trip_id,
+        segment_id=payload.segment_id,
+        filename=payload.filename,
+        file_type=payload.file_type,
+        sha256=payload.sha256,
+        upload_length=payload.upload_length,
+        status=UploadStatus.PENDING,
+        concat=UploadConcat.FINAL,
+    )
+    # The final stays at its staging key until the checksum job has verified the assembled bytes.
+    upload.storage_handle = storage.begin_upload(str(upload.id))
+    session.add(upload)
+    session.flush()
+    # Claimed with a conditional update so two concurrent finals cannot both consume the same parts.
+    claimed = session.exec(
+        update(UploadSession)
+        .where(UploadSession.id.in_(part_ids), UploadSession.final_id.is_(None))
+        .values(final_id=upload.id)
+        .execution_options(synchronize_session=False)
+    )
+    if claimed.rowcount != len(parts):
+        session.rollback()
+        storage.abort_upload(str(upload.id), upload.storage_handle)
+        raise HTTPException(status.HTTP_409_CONFLICT, detail=PARTS_UNAVAILABLE)
+    for index, part in enumerate(parts):
+        part.final_id = upload.id
+        part.part_index = index
+        session.add(part)
+    session.commit()
+    try:
+        _assemble_final(upload, parts)
+    except Exception as exc:
+        # Assembly only reads the parts, so whatever went wrong they can be listed in another final upload.
+        session.rollback()
+        _release_parts(session, upload)
+        session.delete(upload)
+        session.commit()
+        storage.abort_upload(str(upload.id), upload.storage_handle)
+        if isinstance(exc, ChunkTooSmall):
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=str(exc)) from exc
+        raise
+    stored_file = _stage_final(session, upload)
+    # The final upload is committed, so the parts' staged bytes are no longer needed.
+    for part in parts:
+        storage.abort_upload(str(part.id), part.storage_handle)
+    trip = session.get(Trip, upload.trip_id)
+    enqueue_checksum(session, stored_file, trip.user_id)
+    return _upload_read(upload)
+
+
+def _stage_final(session: Session, upload: UploadSession) -> StoredFile:
+    # Every part was checked against its own digest; the whole file's digest would mean reading all of it back,
+    # so the final completes now and the verify_checksum job checks it before moving it into the blob store.
+    uri = staged_uri(str(upload.id))
+    stored_file = attach_blob(
+        session, upload.segment_id, upload.file_type, uri, upload.sha256, upload.upload_length, upload.filename
+    )
+    upload.offset = upload.upload_length
+    upload.status = UploadStatus.COMPLETE
+    upload.updated_at = dt.datetime.now(dt.timezone.utc)
     session.add(upload)
     session.commit()
     session.refresh(upload)
+    return stored_file
+
+
+def _release_parts(session: Session, upload: UploadSession) -> None:
+    session.exec(
+        update(UploadSession)
+        .where(UploadSession.final_id == upload.id)
+        .values(final_id=None, part_index=None)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _upload_read(upload: UploadSession, offset: Optional[int] = None) -> UploadRead:
     return UploadRead(
         id=upload.id,
         trip_id=upload.trip_id,
@@ -44,23 +203,261 @@ def create_upload(
         file_type=upload.file_type,
         sha256=upload.sha256,
         upload_length=upload.upload_length,
-        offset=upload.offset,
+        offset=upload.offset if offset is None else offset,
         status=upload.status,
     )
 
 
+def _batch_read(batch: UploadBatch, uploads: Optional[list[BatchUploadRead]] = None) -> UploadBatchRead:
+    return UploadBatchRead(
+        id=batch.id,
+        trip_id=batch.trip_id,
+        status=batch.status,
+        total_bytes=batch.total_bytes,
+        completed_bytes=batch.completed_bytes,
+        file_count=batch.file_count,
+        completed_files=batch.completed_files,
+        created_at=batch.created_at,
+        completed_at=batch.completed_at,
+        uploads=uploads,
+    )
+
+
+def _batch_member(request: Request, upload: UploadSession, offset: Optional[int] = None) -> BatchUploadRead:
+    return BatchUploadRead(
+        **_upload_read(upload, offset).model_dump(),
+        upload_url=str(request.url_for("patch_upload", upload_id=upload.id)),
+    )
+
+
+@router.post("/batches", response_model=UploadBatchRead, status_code=status.HTTP_201_CREATED)
+def create_upload_batch(
+    payload: UploadBatchCreateRequest,
+    request: Request,
+    current_user: CurrentUser,
+    session: Session = Depends(get_session),
+) -> UploadBatchRead:
+    trip = session.get(Trip, payload.trip_id)
+    if not trip or trip.user_id != current_user.id:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Trip not found")
+    segment_ids = {file.segment_id for file in payload.files}
+    statement = select(Segment.id).where(Segment.trip_id == trip.id, Segment.id.in_(segment_ids))
+    if set(session.exec(statement).all()) != segment_ids:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Segment not found")
+    batch = UploadBatch(
+        trip_id=trip.id,
+        total_bytes=sum(file.upload_length for file in payload.files),
+        file_count=len(payload.files),
+        complete_trip=payload.complete_trip,
+    )
+    storage = get_storage()
+    uploads = []
+    for file in payload.files:
+        upload = UploadSession(
+            trip_id=trip.id,
+            segment_id=file.segment_id,
+            batch_id=batch.id,
+            filename=file.filename,
+            file_type=file.file_type,
+            sha256=file.sha256,
+            upload_length=file.upload_length,
+            status=UploadStatus.PENDING,
+        )
+        upload.storage_handle = storage.begin_upload(str(upload.id), file.sha256)
+        uploads.append(upload)
+    if trip.status == TripStatus.RECORDING:
+        trip.status = TripStatus.UPLOADING
+        session.add(trip)
+    # Built before the commit so returning N members does not reload N expired rows.
+    response = _batch_read(batch, [_batch_member(request, upload) for upload in uploads])
+    session.add(batch)
+    session.add_all(uploads)
+    session.commit()
+    return response
+
+
+@router.get("/batches/{batch_id}", response_model=UploadBatchRead)
+def get_upload_batch(
+    batch_id: uuid.UUID,
+    request: Request,
+    current_user: CurrentUser,
+    session: Session = Depends(get_session),
+    include_uploads: bool = False,
+) -> UploadBatchRead:
+    batch = session.get(UploadBatch, batch_id)
+    trip = session.get(Trip, batch.trip_id) if batch else None
+    if not trip or trip.user_id != current_user.id:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Upload batch not found")
+    if not include_uploads:
+        return _batch_read(batch)
+    statement = select(UploadSession).where(UploadSession.batch_id == batch.id)
+    uploads = session.exec(statement.order_by(UploadSession.created_at, UploadSession.id)).all()
+    members = [_batch_member(request, upload, _durable_progress(upload)[0]) for upload in uploads]
+    return _batch_read(batch, members)
+
+
+def _get_owned_upload(session: Session, upload_id: uuid.UUID, current_user: CurrentUser) -> UploadSession:
+    upload = session.get(UploadSession, upload_id)
+    if not upload or upload.trip.user_id != current_user.id:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    return upload
+
+
+def _as_utc(value: dt.datetime) -> dt.datetime:
+    return value if value.tzinfo else value.replace(tzinfo=dt.timezone.utc)
+
+
+def _durable_progress(upload: UploadSession) -> tuple[int, Optional[bytes]]:
+    record = read_journal(str(upload.id)) if settings.upload_durable_offsets else None
+    if record is None or record[0] <= upload.offset:
+        return upload.offset, upload.sha256_state
+    return record
+
+
+def _checkpoint_due(upload: UploadSession, offset: int) -> bool:
+    if offset - upload.offset >= settings.upload_checkpoint_bytes:
+        return True
+    elapsed = dt.datetime.now(dt.timezone.utc) - _as_utc(upload.updated_at)
+    return elapsed.total_seconds() >= settings.upload_checkpoint_interval_seconds
+
+
+def _advance_batch(session: Session, upload: UploadSession, received: int, finished: bool) -> None:
+    # Members of a batch add their progress to the one shared row in the same transaction as their own
+    # checkpoint; the increment is done in SQL so parallel members cannot lose each other's updates.
+    if upload.batch_id is None:
+        return
+    now = dt.datetime.now(dt.timezone.utc)
+    values = {"completed_bytes": UploadBatch.completed_bytes + received, "updated_at": now}
+    if finished:
+        values["completed_files"] = UploadBatch.completed_files + 1
+    completed_files, file_count, complete_trip = session.exec(
+        update(UploadBatch)
+        .where(UploadBatch.id == upload.batch_id)
+        .values(**values)
+        .returning(UploadBatch.completed_files, UploadBatch.file_count, UploadBatch.complete_trip)
+    ).one()
+    if not finished or completed_files < file_count:
+        return
+    session.exec(
+        update(UploadBatch)
+        .where(UploadBatch.id == upload.batch_id, UploadBatch.status == UploadBatchStatus.OPEN)
+        .values(status=UploadBatchStatus.COMPLETE, completed_at=now)
+    )
+    if complete_trip:
+        members = select(UploadSession.segment_id).where(UploadSession.batch_id == upload.batch_id)
+        session.exec(
+            update(Segment)
+            .where(Segment.id.in_(members), Segment.completed_at.is_(None))
+            .values(completed_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        trip = session.get(Trip, upload.trip_id)
+        trip.status = TripStatus.COMPLETE
+        session.add(trip)
+
+
+def _fail_batch(session: Session, upload: UploadSession) -> None:
+    if upload.batch_id is not None:
+        session.exec(
+            update(UploadBatch)
+            .where(UploadBatch.id == upload.batch_id, UploadBatch.status == UploadBatchStatus.OPEN)
+            .values(status=UploadBatchStatus.FAILED, updated_at=dt.datetime.now(dt.timezone.utc))
+        )
+
+
+def _save_progress(session: Session, upload: UploadSession, offset: int, state: Optional[bytes]) -> None:
+    if settings.upload_durable_offsets:
+        append_journal(str(upload.id), offset, state)
+        if offset >= upload.upload_length or not _checkpoint_due(upload, offset):
+            return
+    _advance_batch(session, upload, offset - upload.offset, finished=False)
+    upload.offset = offset
+    upload.sha256_state = state
+    upload.status = UploadStatus.RECEIVING
+    upload.updated_at = dt.datetime.now(dt.timezone.utc)
+    session.add(upload)
+    session.commit()
+    discard_journal(str(upload.id))
+
+
+def _reject_checksum(session: Session, upload: UploadSession) -> None:
+    get_storage().abort_upload(str(upload.id), upload.storage_handle)
+    upload.status = UploadStatus.FAILED
+    _fail_batch(session, upload)
+    session.add(upload)
+    session.commit()
+    discard_journal(str(upload.id))
+    raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Checksum mismatch")
+
+
+def _digest(upload: UploadSession, hasher: Optional[ResumableSha256]) -> str:
+    if hasher is not None:
+        return hasher.hexdigest()
+    # No resumable state on this platform: the finished upload is read back once instead of once per PATCH.
+    with get_storage().open_upload(str(upload.id), upload.storage_handle) as fp:
+        return read_sha256(fp)
+
+
+def _complete_partial(session: Session, upload: UploadSession, offset: int, computed_sha: str) -> None:
+    upload.offset = offset
+    upload.updated_at = dt.datetime.now(dt.timezone.utc)
+    if computed_sha != upload.sha256:
+        _reject_checksum(session, upload)
+    get_storage().seal_upload(str(upload.id), upload.storage_handle, offset)
+    upload.sha256_state = None
+    upload.status = UploadStatus.COMPLETE
+    session.add(upload)
+    session.commit()
+    discard_journal(str(upload.id))
+
+
+def _complete_upload(session: Session, upload: UploadSession, offset: int, computed_sha: str) -> None:
+    storage = get_storage()
+    received = offset - upload.offset
+    upload.offset = offset
+    upload.sha256_state = None
+    upload.updated_at = dt.datetime.now(dt.timezone.utc)
+    if computed_sha != upload.sha256:
+        _reject_checksum(session, upload)
+    claim_blob(session, blob_uri(computed_sha))
+    uri, size = storage.commit_upload(str(upload.id), upload.storage_handle, computed_sha, offset)
+    stored_file = attach_blob(session, upload.segment_id, upload.file_type, uri, computed_sha, size, upload.filename)
+    segment = session.get(Segment, upload.segment_id)
+    if segment:
+        if upload.file_type == FileType.VIDEO_MP4:
+            segment.file_size_bytes = size
+            segment.sha256 = computed_sha
+        session.add(segment)
+    upload.status = UploadStatus.COMPLETE
+    _advance_batch(session, upload, received, finished=True)
+    session.add(upload)
+    session.commit()
+    discard_journal(str(upload.id))
+    trip = session.get(Trip, upload.trip_id)
+    if upload.file_type == FileType.VIDEO_MP4:
+        enqueue_checksum(session, stored_file, trip.user_id)
+    enqueue_processing(session, stored_file, trip.user_id)
+
+
 @router.head("/{upload_id}")
 def head_upload(
     upload_id: uuid.UUID,
+    request: Request,
     current_user: CurrentUser,
     session: Session = Depends(get_session),
 ) -> Response:
-    upload = session.get(UploadSession, upload_id)
-    if not upload or upload.trip.user_id != current_user.id:
-        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    upload = _get_owned_upload(session, upload_id, current_user)
+    offset, _ = _durable_progress(upload)
     response = Response(status_code=status.HTTP_204_NO_CONTENT)
-    response.headers["Upload-Offset"] = str(upload.offset)
+    response.headers["Upload-Offset"] = str(offset)
     response.headers["Upload-Length"] = str(upload.upload_length)
+    if upload.concat == UploadConcat.PARTIAL:
+        response.headers["Upload-Concat"] = UploadConcat.PARTIAL.value
+    elif upload.concat == UploadConcat.FINAL:
+        statement = select(UploadSession.id).where(UploadSession.final_id == upload.id)
+        part_ids = session.exec(statement.order_by(UploadSession.part_index)).all()
+        urls = " ".join(request.url_for("patch_upload", upload_id=part_id).path for part_id in part_ids)
+        response.headers["Upload-Concat"] = f"{UploadConcat.FINAL.value};{urls}"
     return response
 
 
@@ -72,53 +469,63 @@ async def patch_upload(
     session: Session = Depends(get_session),
     upload_offset: int = Header(alias="Upload-Offset"),
 ) -> Response:
-    upload = session.get(UploadSession, upload_id)
-    if not upload or upload.trip.user_id != current_user.id:
-        raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    upload = await run_io(_get_owned_upload, session, upload_id, current_user)
+    if upload.concat == UploadConcat.FINAL:
+        raise HTTPException(status.HTTP_403_FORBIDDEN, detail="Final concatenated uploads cannot be patched")
     if upload.status == UploadStatus.COMPLETE:
         raise HTTPException(status.HTTP_409_CONFLICT, detail="Upload already complete")
-    if upload.offset != upload_offset:
+    offset, state = await run_io(_durable_progress, upload)
+    if offset != upload_offset:
         raise HTTPException(status.HTTP_409_CONFLICT, detail="Offset mismatch")
-    body = await request.body()
-    if not body:
-        response = Response(status_code=status.HTTP_204_NO_CONTENT)
-        response.headers["Upload-Offset"] = str(upload.offset)
-        return response
-    path = get_upload_path(str(upload.id))
-    write_chunk(path, body, upload.offset)
-    upload.offset += len(body)
-    upload.status = UploadStatus.RECEIVING
-    upload.updated_at = dt.datetime.now(dt.timezone.utc)
-    session.add(upload)
-    session.commit()
-    if upload.offset >= upload.upload_length:
-        dest_dir = settings.storage_dir / "segments" / str(upload.segment_id)
-        dest_dir.mkdir(parents=True, exist_ok=True)
-        final_path = dest_dir / upload.filename
-        computed_sha, size = finalize_upload(path, final_path)
-        if computed_sha != upload.sha256:
-            final_path.unlink(missing_ok=True)
-            upload.status = UploadStatus.FAILED
-            session.add(upload)
-            session.commit()
-            raise HTTPException(status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Checksum mismatch")
-        stored_file = StoredFile(
-            segment_id=upload.segment_id,
-            type=upload.file_type,
-            storage_uri=str(final_path.relative_to(settings.storage_dir)),
-            sha256=computed_sha,
-            bytes=size,
-        )
-        session.add(stored_file)
-        segment = session.get(Segment, upload.segment_id)
-        if segment:
-            if upload.file_type == FileType.VIDEO_MP4:
-                segment.file_size_bytes = size
-                segment.sha256 = computed_sha
-            session.add(segment)
-        upload.status = UploadStatus.COMPLETE
-        session.add(upload)
-        session.commit()
+    storage = get_storage()
+    open_prefix = functools.partial(storage.open_upload, str(upload.id), upload.storage_handle)
+    try:
+        hasher = await run_io(resume_sha256, open_prefix, offset, state)
+    except ValueError as exc:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail=f"Upload cannot be resumed: {exc}") from exc
+    if hasher is None and not storage.reads_open_uploads:
+        raise HTTPException(status.HTTP_409_CONFLICT, detail="Upload cannot be resumed: no SHA-256 state was saved")
+    writer = await run_io(
+        storage.open_chunk,
+        str(upload.id),
+        upload.storage_handle,
+        offset,
+        limit=upload.upload_length - offset,
+        total=upload.upload_length,
+        hasher=hasher,
+    )
+    too_large = False
+    too_small: Optional[str] = None
+    started = time.perf_counter()
+    UPLOADS_IN_PROGRESS.inc()
+    try:
+        try:
+            async for data in request.stream():
+                await writer.awrite(data)
+        except ClientDisconnect:
+            pass
+        except ChunkTooLarge:
+            too_large = True
+        finally:
+            await writer.aclose()
+    except ChunkTooSmall as exc:
+        too_small = str(exc)
+    finally:
+        UPLOADS_IN_PROGRESS.dec()
+    if writer.written:
+        UPLOAD_RECEIVED_BYTES.inc(writer.written, upload.file_type.value)
+        UPLOAD_THROUGHPUT.observe(writer.written / max(time.perf_counter() - started, 1e-6))
+    offset += writer.written
+    if writer.written:
+        await run_io(_save_progress, session, upload, offset, hasher.state if hasher is not None else None)
+    if too_large:
+        raise HTTPException(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Chunk exceeds upload length")
+    if too_small is not None:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, detail=too_small)
+    if offset >= upload.upload_length:
+        computed_sha = await run_io(_digest, upload, hasher)
+        complete = _complete_partial if upload.concat == UploadConcat.PARTIAL else _complete_upload
+        await run_io(complete, session, upload, offset, computed_sha)
     response = Response(status_code=status.HTTP_204_NO_CONTENT)
-    response.headers["Upload-Offset"] = str(upload.offset)
+    response.headers["Upload-Offset"] = str(offset)
     return response
@@ -1,7 +1,10 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
+from sqlmodel import Session
 
 from ..auth import CurrentUser
-from ..schemas import UserRead
+from ..database import get_session
+from ..schemas import UsageRead, UserRead
+from ..services.usage import get_usage
 
 router = APIRouter(prefix="/me", tags=["users"])
 
@@ -9,3 +12,16 @@ router = APIRouter(prefix="/me", tags=["users"])
 @router.get("", response_model=UserRead)
 def read_me(current_user: CurrentUser) -> UserRead:
     return UserRead(id=current_user.id, email=current_user.email, name=current_user.name, role=current_user.role)
+
+
+@router.get("/usage", response_model=UsageRead)
+def read_usage(current_user: CurrentUser, session: Session = Depends(get_session)) -> UsageRead:
+    usage = get_usage(session, current_user.id)
+    return UsageRead(
+        stored_files=usage.stored_files,
+        stored_bytes=usage.stored_bytes,
+        pending_uploads=usage.pending_uploads,
+        pending_upload_bytes=usage.pending_upload_bytes,
+        updated_at=usage.updated_at,
+        reconciled_at=usage.reconciled_at,
+    )
@@ -4,7 +4,16 @@ from typing import Optional
 
 from pydantic import BaseModel, Field
 
-from .models import DevicePlatform, FileType, TripStatus, UploadStatus, UserRole
+from .models import (
+    DevicePlatform,
+    FileType,
+    JobKind,
+    JobStatus,
+    TripStatus,
+    UploadBatchStatus,
+    UploadStatus,
+    UserRole,
+)
 
 
 class TokenRequest(BaseModel):
@@ -26,6 +35,15 @@ class UserRead(BaseModel):
     role: UserRole
 
 
+class UsageRead(BaseModel):
+    stored_files: int
+    stored_bytes: int
+    pending_uploads: int
+    pending_upload_bytes: int
+    updated_at: dt.datetime
+    reconciled_at: Optional[dt.datetime]
+
+
 class DeviceRegisterRequest(BaseModel):
     platform: DevicePlatform
     model: str
@@ -61,6 +79,10 @@ class TripRead(BaseModel):
     end_time_utc: Optional[dt.datetime]
     duration_s: Optional[int]
     distance_m: Optional[float]
+    moving_time_s: Optional[float] = None
+    max_speed_mps: Optional[float] = None
+    avg_speed_mps: Optional[float] = None
+    elevation_gain_m: Optional[float] = None
     status: TripStatus
 
 
@@ -88,6 +110,15 @@ class SegmentRead(BaseModel):
     file_size_bytes: Optional[int]
     duration_s: Optional[float]
     sha256: Optional[str]
+    video_codec: Optional[str] = None
+    audio_codec: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    media_error: Optional[str] = None
+    thumbnail_interval_s: Optional[float] = None
+    thumbnail_count: Optional[int] = None
+    thumbnail_columns: Optional[int] = None
     created_at: dt.datetime
 
 
@@ -112,6 +143,37 @@ class UploadRead(BaseModel):
     status: UploadStatus
 
 
+class UploadBatchFile(BaseModel):
+    segment_id: uuid.UUID
+    filename: str
+    file_type: FileType
+    sha256: str
+    upload_length: int = Field(gt=0)
+
+
+class UploadBatchCreateRequest(BaseModel):
+    trip_id: uuid.UUID
+    files: list[UploadBatchFile] = Field(min_length=1, max_length=1000)
+    complete_trip: bool = True
+
+
+class BatchUploadRead(UploadRead):
+    upload_url: str
+
+
+class UploadBatchRead(BaseModel):
+    id: uuid.UUID
+    trip_id: uuid.UUID
+    status: UploadBatchStatus
+    total_bytes: int
+    completed_bytes: int
+    file_count: int
+    completed_files: int
+    created_at: dt.datetime
+    completed_at: Optional[dt.datetime]
+    uploads: Optional[list[BatchUploadRead]] = None
+
+
 class StoredFileRead(BaseModel):
     id: uuid.UUID
     type: FileType
@@ -120,6 +182,50 @@ class StoredFileRead(BaseModel):
     storage_uri: str
 
 
+class LocationTrackRead(BaseModel):
+    segment_id: uuid.UUID
+    source_type: FileType
+    sample_count: int
+    skipped_count: int
+    start_time_utc: Optional[dt.datetime]
+    end_time_utc: Optional[dt.datetime]
+    min_lat: Optional[float]
+    max_lat: Optional[float]
+    min_lon: Optional[float]
+    max_lon: Optional[float]
+    sample_rate_hz: Optional[float]
+    gap_count: int
+    max_gap_s: Optional[float]
+    distance_m: float
+    moving_time_s: float
+    max_speed_mps: Optional[float]
+    avg_speed_mps: Optional[float]
+    elevation_gain_m: float
+
+
+class PositionRead(BaseModel):
+    t: float
+    ts_utc: dt.datetime
+    lat: float
+    lon: float
+    alt: Optional[float]
+    spd: Optional[float]
+    brg: Optional[float]
+
+
+class PositionsRequest(BaseModel):
+    t: list[float] = Field(max_length=100_000)
+
+
+class PositionsResponse(BaseModel):
+    t: list[float]
+    lat: list[Optional[float]]
+    lon: list[Optional[float]]
+    alt: list[Optional[float]]
+    spd: list[Optional[float]]
+    brg: list[Optional[float]]
+
+
 class SegmentMetadataRequest(BaseModel):
     type: FileType
     content: str
@@ -132,8 +238,49 @@ class DownloadToken(BaseModel):
 
 
 class TripDetail(TripRead):
-    segments: list[SegmentRead]
+    segments: Optional[list[SegmentRead]] = None
 
 
 class TripsResponse(BaseModel):
     trips: list[TripDetail]
+    next_cursor: Optional[str] = None
+
+
+class SegmentTimeRange(BaseModel):
+    segment_id: uuid.UUID
+    start_time_utc: dt.datetime
+    end_time_utc: dt.datetime
+
+
+class TripSearchHit(TripRead):
+    segments: list[SegmentTimeRange]
+
+
+class TripSearchResponse(BaseModel):
+    trips: list[TripSearchHit]
+    next_cursor: Optional[str] = None
+
+
+class SegmentPolyline(BaseModel):
+    segment_id: uuid.UUID
+    index: int
+    polyline: str
+
+
+class TripTrackResponse(BaseModel):
+    trip_id: uuid.UUID
+    zoom: int
+    segments: list[SegmentPolyline]
+
+
+class JobRead(BaseModel):
+    id: uuid.UUID
+    kind: JobKind
+    status: JobStatus
+    segment_id: Optional[uuid.UUID]
+    attempts: int
+    max_attempts: int
+    run_after: dt.datetime
+    last_error: Optional[str]
+    created_at: dt.datetime
+    finished_at: Optional[dt.datetime]
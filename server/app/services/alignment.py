@@ -0,0 +1,105 @@
+import datetime as dt
+import os
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from sqlmodel import Session
+
+from ..config import settings
+from ..models import LocationTrack, Segment
+from .gps import load_track
+from .storage import ensure_parent, get_temp_path
+
+# GPS fixes keyed by video presentation time (seconds from the first frame).
+ALIGNMENT_DTYPE = np.dtype(
+    [
+        ("pts", "<f8"),
+        ("lat", "<f8"),
+        ("lon", "<f8"),
+        ("alt", "<f4"),
+        ("spd", "<f4"),
+        ("brg", "<f4"),
+    ]
+)
+POSITION_FIELDS = ("lat", "lon", "alt", "spd", "brg")
+
+
+def get_alignment_path(segment_id: uuid.UUID) -> Path:
+    return settings.storage_dir / "tracks" / f"{segment_id}.align.npy"
+
+
+def video_epoch(segment: Segment, location_track: Optional[LocationTrack]) -> Optional[float]:
+    # The MP4 creation time anchors PTS 0; without it the GPS track start is assumed.
+    for anchor in (segment.media_created_utc, location_track.start_time_utc if location_track else None):
+        if anchor is not None:
+            if anchor.tzinfo is None:
+                anchor = anchor.replace(tzinfo=dt.timezone.utc)
+            return anchor.timestamp()
+    return None
+
+
+def build_alignment(session: Session, segment_id: uuid.UUID) -> Optional[np.ndarray]:
+    segment = session.get(Segment, segment_id)
+    track = load_track(segment_id)
+    if segment is None or track is None:
+        return None
+    epoch = video_epoch(segment, session.get(LocationTrack, segment_id))
+    if epoch is None:
+        return None
+    pts = track["ts"] - epoch
+    # Only fixes around the video's duration are kept, plus one gap of margin.
+    keep = pts >= -settings.gps_gap_seconds
+    if segment.duration_s:
+        keep &= pts <= segment.duration_s + settings.gps_gap_seconds
+    index = np.empty(int(np.count_nonzero(keep)), dtype=ALIGNMENT_DTYPE)
+    index["pts"] = pts[keep]
+    for name in POSITION_FIELDS:
+        index[name] = track[name][keep]
+    path = get_temp_path()
+    ensure_parent(path)
+    with path.open("wb") as fp:
+        np.save(fp, index)
+    dest = get_alignment_path(segment_id)
+    ensure_parent(dest)
+    os.replace(path, dest)
+    return index
+
+
+def load_alignment(segment_id: uuid.UUID) -> Optional[np.ndarray]:
+    try:
+        return np.load(get_alignment_path(segment_id), mmap_mode="r")
+    except FileNotFoundError:
+        return None
+
+
+def lookup_positions(index: np.ndarray, t: np.ndarray) -> dict[str, np.ndarray]:
+    # Linear interpolation between the two fixes around each t; NaN where the
+    # video time falls outside the track or inside a recording gap.
+    t = np.asarray(t, dtype=np.float64)
+    count = len(index)
+    if not count:
+        return {name: np.full(t.shape, np.nan) for name in POSITION_FIELDS}
+    pts = index["pts"]
+    right = np.searchsorted(pts, t, side="left")
+    inside = right < count
+    right = np.minimum(right, count - 1)
+    exact = inside & (pts[right] == t)
+    left = np.where(exact, right, right - 1)
+    valid = inside & (left >= 0)
+    left = np.maximum(left, 0)
+    span = pts[right] - pts[left]
+    valid &= span <= settings.gps_gap_seconds
+    weight = np.divide(t - pts[left], span, out=np.zeros_like(t), where=span > 0)
+    positions: dict[str, np.ndarray] = {}
+    for name in POSITION_FIELDS:
+        start = index[name][left].astype(np.float64)
+        delta = index[name][right].astype(np.float64) - start
+        if name == "brg":
+            delta = (delta + 180.0) % 360.0 - 180.0
+            value = (start + weight * delta) % 360.0
+        else:
+            value = start + weight * delta
+        positions[name] = np.where(valid, value, np.nan)
+    return positions
@@ -0,0 +1,285 @@
+import datetime as dt
+import json
+import math
+import os
+import uuid
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Any, BinaryIO, Iterable, Iterator, Optional
+
+import numpy as np
+from sqlmodel import Session, select
+
+from ..config import settings
+from ..models import FileType, LocationTrack, Segment, StoredFile, Trip
+from .polyline import write_pyramid
+from .spatial import index_segment_track
+from .stats import compute_track_stats, refresh_trip_stats
+from .storage import ensure_parent, get_storage, get_temp_path
+
+# One fixed-width little-endian record per fix; missing optional fields are NaN.
+SAMPLE_DTYPE = np.dtype(
+    [
+        ("ts", "<f8"),
+        ("lat", "<f8"),
+        ("lon", "<f8"),
+        ("alt", "<f4"),
+        ("spd", "<f4"),
+        ("brg", "<f4"),
+        ("acc", "<f4"),
+    ]
+)
+BLOCK_SAMPLES = 8192
+# Ingestion prefers the JSONL sidecar; GPX only carries a subset of the fields.
+GPS_FILE_TYPES = (FileType.GPS_JSONL, FileType.GPS_GPX)
+
+Sample = tuple[float, float, float, float, float, float, float]
+
+
+def get_track_path(segment_id: uuid.UUID) -> Path:
+    return settings.storage_dir / "tracks" / f"{segment_id}.bin"
+
+
+def _parse_timestamp(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        seconds = value / 1000.0 if value > 1e11 else float(value)
+        return seconds if math.isfinite(seconds) else None
+    if isinstance(value, str):
+        try:
+            parsed = dt.datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=dt.timezone.utc)
+        return parsed.timestamp()
+    return None
+
+
+def _number(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _sample(
+    ts: Any,
+    lat: Any,
+    lon: Any,
+    alt: Any = None,
+    spd: Any = None,
+    brg: Any = None,
+    acc: Any = None,
+) -> Optional[Sample]:
+    seconds = _parse_timestamp(ts)
+    latitude = _number(lat)
+    longitude = _number(lon)
+    if seconds is None or not -90.0 <= latitude <= 90.0 or not -180.0 <= longitude <= 180.0:
+        return None
+    return seconds, latitude, longitude, _number(alt), _number(spd), _number(brg), _number(acc)
+
+
+def parse_jsonl_line(line: bytes) -> Optional[Sample]:
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict):
+        return None
+    return _sample(
+        record.get("ts"),
+        record.get("lat"),
+        record.get("lon"),
+        record.get("alt"),
+        record.get("spd"),
+        record.get("brg"),
+        record.get("acc"),
+    )
+
+
+def iter_jsonl_samples(fp: BinaryIO) -> Iterator[Optional[Sample]]:
+    # Yields None for lines that cannot be used so the caller can count them.
+    for line in fp:
+        if line.strip():
+            yield parse_jsonl_line(line)
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def iter_gpx_samples(fp: BinaryIO) -> Iterator[Optional[Sample]]:
+    # Detaches every parsed <trkpt> from its parent so memory stays flat.
+    parents: list[ET.Element] = []
+    try:
+        for event, element in ET.iterparse(fp, events=("start", "end")):
+            if event == "start":
+                parents.append(element)
+                continue
+            parents.pop()
+            if _local_name(element.tag) != "trkpt":
+                continue
+            values = {_local_name(child.tag): child.text for child in element.iter()}
+            yield _sample(
+                values.get("time"),
+                element.get("lat"),
+                element.get("lon"),
+                values.get("ele"),
+                values.get("speed"),
+                values.get("course"),
+            )
+            if parents:
+                parents[-1].remove(element)
+    except ET.ParseError:
+        yield None
+
+
+def write_track(samples: Iterable[Optional[Sample]], path: Path) -> tuple[int, int]:
+    block = np.empty(BLOCK_SAMPLES, dtype=SAMPLE_DTYPE)
+    count = 0
+    skipped = 0
+    filled = 0
+    with path.open("wb") as fp:
+        for sample in samples:
+            if sample is None:
+                skipped += 1
+                continue
+            block[filled] = sample
+            filled += 1
+            if filled == BLOCK_SAMPLES:
+                block.tofile(fp)
+                count += filled
+                filled = 0
+        block[:filled].tofile(fp)
+        count += filled
+    return count, skipped
+
+
+def _sort_track(path: Path, count: int) -> None:
+    if count < 2:
+        return
+    track = np.memmap(path, dtype=SAMPLE_DTYPE, mode="r+", shape=(count,))
+    ts = track["ts"]
+    if np.any(ts[1:] < ts[:-1]):
+        track[:] = track[np.argsort(ts, kind="stable")]
+        track.flush()
+    del track
+
+
+def load_track(segment_id: uuid.UUID) -> Optional[np.ndarray]:
+    path = get_track_path(segment_id)
+    if not path.exists():
+        return None
+    if path.stat().st_size == 0:
+        return np.empty(0, dtype=SAMPLE_DTYPE)
+    return np.memmap(path, dtype=SAMPLE_DTYPE, mode="r")
+
+
+def _to_datetime(seconds: float) -> dt.datetime:
+    return dt.datetime.fromtimestamp(float(seconds), dt.timezone.utc)
+
+
+def summarize_track(track: np.ndarray) -> dict[str, Any]:
+    summary: dict[str, Any] = {
+        "sample_count": int(len(track)),
+        "start_time_utc": None,
+        "end_time_utc": None,
+        "min_lat": None,
+        "max_lat": None,
+        "min_lon": None,
+        "max_lon": None,
+        "sample_rate_hz": None,
+        "gap_count": 0,
+        "max_gap_s": None,
+    }
+    if not len(track):
+        return summary
+    ts = track["ts"]
+    summary.update(
+        start_time_utc=_to_datetime(ts[0]),
+        end_time_utc=_to_datetime(ts[-1]),
+        min_lat=float(track["lat"].min()),
+        max_lat=float(track["lat"].max()),
+        min_lon=float(track["lon"].min()),
+        max_lon=float(track["lon"].max()),
+    )
+    if len(track) > 1:
+        intervals = np.diff(ts)
+        typical = float(np.median(intervals))
+        summary.update(
+            sample_rate_hz=1.0 / typical if typical > 0 else None,
+            gap_count=int(np.count_nonzero(intervals > settings.gps_gap_seconds)),
+            max_gap_s=float(intervals.max()),
+        )
+    return summary
+
+
+def _source_file(session: Session, segment_id: uuid.UUID) -> Optional[StoredFile]:
+    for file_type in GPS_FILE_TYPES:
+        statement = (
+            select(StoredFile)
+            .where(StoredFile.segment_id == segment_id, StoredFile.type == file_type)
+            .order_by(StoredFile.created_at.desc())
+        )
+        stored_file = session.exec(statement).first()
+        if stored_file is not None:
+            return stored_file
+    return None
+
+
+def ingest_segment_track(session: Session, segment_id: uuid.UUID, force: bool = False) -> Optional[LocationTrack]:
+    source = _source_file(session, segment_id)
+    if source is None:
+        return None
+    location_track = session.get(LocationTrack, segment_id)
+    dest = get_track_path(segment_id)
+    if (
+        not force
+        and location_track is not None
+        and source.sha256
+        and location_track.source_sha256 == source.sha256
+        and dest.exists()
+    ):
+        return location_track
+    parse = iter_jsonl_samples if source.type == FileType.GPS_JSONL else iter_gpx_samples
+    path = get_temp_path()
+    ensure_parent(path)
+    try:
+        with get_storage().open(source.storage_uri) as fp:
+            count, skipped = write_track(parse(fp), path)
+        _sort_track(path, count)
+        ensure_parent(dest)
+        os.replace(path, dest)
+    finally:
+        path.unlink(missing_ok=True)
+    if location_track is None:
+        location_track = LocationTrack(segment_id=segment_id, source_type=source.type)
+    track = load_track(segment_id)
+    write_pyramid(segment_id, track)
+    for name, value in {**summarize_track(track), **compute_track_stats(track)}.items():
+        setattr(location_track, name, value)
+    location_track.source_type = source.type
+    location_track.source_sha256 = source.sha256
+    location_track.skipped_count = skipped
+    location_track.updated_at = dt.datetime.now(dt.timezone.utc)
+    session.add(location_track)
+    session.flush()
+    segment = session.get(Segment, segment_id)
+    trip = session.get(Trip, segment.trip_id) if segment is not None else None
+    if trip is not None:
+        index_segment_track(session, segment_id, trip.id, trip.user_id, track)
+        refresh_trip_stats(session, trip.id)
+    session.commit()
+    session.refresh(location_track)
+    return location_track
+
+
+def rebuild_tracks(session: Session) -> int:
+    statement = select(StoredFile.segment_id).where(StoredFile.type.in_(GPS_FILE_TYPES)).distinct()
+    rebuilt = 0
+    for segment_id in session.exec(statement).all():
+        if ingest_segment_track(session, segment_id, force=True) is not None:
+            rebuilt += 1
+    return rebuilt
@@ -0,0 +1,136 @@
+import ctypes
+import ctypes.util
+import hashlib
+import struct
+import sys
+from typing import Optional
+
+# OpenSSL's SHA256_CTX: h[8], Nl, Nh, data[16], num, md_len (all 32-bit).
+_SHA256_CTX_SIZE = 112
+_DATA_OFFSET = 40
+_NUM_OFFSET = 104
+_BLOCK_SIZE = 64
+
+# Saved state is ours, not OpenSSL's: a format byte, the eight chaining words and the byte count (big-endian),
+# then the bytes of the unfinished block. It is the same on every platform and OpenSSL build.
+_STATE_FORMAT = 1
+_STATE_HEADER = struct.Struct(">B8IQ")
+
+
+def _context_fits(lib: ctypes.CDLL) -> bool:
+    # Hashes a known vector in an oversized buffer: SHA256_Final wipes the whole context, so a larger
+    # SHA256_CTX than assumed shows up as overwritten guard bytes.
+    scratch = ctypes.create_string_buffer(b"\xa5" * (_SHA256_CTX_SIZE * 2), _SHA256_CTX_SIZE * 2)
+    digest = ctypes.create_string_buffer(32)
+    lib.SHA256_Init(scratch)
+    lib.SHA256_Update(scratch, b"abc", 3)
+    raw = scratch.raw
+    if int.from_bytes(raw[32:36], sys.byteorder) != 24 or int.from_bytes(raw[104:108], sys.byteorder) != 3:
+        return False
+    if raw[_DATA_OFFSET : _DATA_OFFSET + 3] != b"abc":
+        return False
+    lib.SHA256_Final(digest, scratch)
+    guard_intact = scratch.raw[_SHA256_CTX_SIZE:] == b"\xa5" * _SHA256_CTX_SIZE
+    return guard_intact and digest.raw == hashlib.sha256(b"abc").digest()
+
+
+def _load_libcrypto() -> Optional[ctypes.CDLL]:
+    # macOS aborts the process when the unversioned libcrypto is loaded, so it always uses the fallback.
+    if sys.platform == "darwin":
+        return None
+    name = ctypes.util.find_library("crypto")
+    if not name:
+        return None
+    try:
+        lib = ctypes.CDLL(name)
+        for symbol in ("SHA256_Init", "SHA256_Update", "SHA256_Final"):
+            getattr(lib, symbol).restype = ctypes.c_int
+    except (OSError, AttributeError):
+        return None
+    lib.SHA256_Init.argtypes = [ctypes.c_void_p]
+    lib.SHA256_Update.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+    lib.SHA256_Final.argtypes = [ctypes.c_char_p, ctypes.c_void_p]
+    if not _context_fits(lib):
+        return None
+    return lib
+
+
+_libcrypto = _load_libcrypto()
+
+
+def resumable() -> bool:
+    return _libcrypto is not None
+
+
+def _words(raw: bytes, offset: int, count: int) -> tuple[int, ...]:
+    return struct.unpack_from(("<" if sys.byteorder == "little" else ">") + f"{count}I", raw, offset)
+
+
+def _pack_words(ctx: ctypes.Array, offset: int, *words: int) -> None:
+    struct.pack_into(("<" if sys.byteorder == "little" else ">") + f"{len(words)}I", ctx, offset, *words)
+
+
+# SHA-256 whose intermediate state can be persisted and restored in another
+# process. Falls back to hashlib (``state`` is None) without libcrypto.
+class ResumableSha256:
+    def __init__(self, state: Optional[bytes] = None):
+        self._ctx: Optional[ctypes.Array] = None
+        self._hasher = None
+        if _libcrypto is None:
+            if state is not None:
+                raise ValueError("Resumable SHA-256 state is not supported on this platform")
+            self._hasher = hashlib.sha256()
+            self._length = 0
+            return
+        self._ctx = ctypes.create_string_buffer(_SHA256_CTX_SIZE)
+        _libcrypto.SHA256_Init(self._ctx)
+        if state is not None:
+            self._restore(state)
+
+    def _restore(self, state: bytes) -> None:
+        if len(state) < _STATE_HEADER.size or state[0] != _STATE_FORMAT:
+            raise ValueError("Unknown SHA-256 state format")
+        _, *chaining, length = _STATE_HEADER.unpack_from(state)
+        tail = state[_STATE_HEADER.size :]
+        if len(tail) != length % _BLOCK_SIZE:
+            raise ValueError("SHA-256 state is corrupt")
+        bits = length * 8
+        _pack_words(self._ctx, 0, *chaining, bits & 0xFFFFFFFF, bits >> 32)
+        ctypes.memmove(ctypes.addressof(self._ctx) + _DATA_OFFSET, tail, len(tail))
+        _pack_words(self._ctx, _NUM_OFFSET, len(tail))
+
+    @property
+    def length(self) -> int:
+        if self._ctx is None:
+            return self._length
+        low, high = _words(self._ctx.raw, 32, 2)
+        return ((high << 32) | low) // 8
+
+    @property
+    def state(self) -> Optional[bytes]:
+        if self._ctx is None:
+            return None
+        raw = self._ctx.raw
+        length = self.length
+        tail = raw[_DATA_OFFSET : _DATA_OFFSET + length % _BLOCK_SIZE]
+        return _STATE_HEADER.pack(_STATE_FORMAT, *_words(raw, 0, 8), length) + tail
+
+    def update(self, data: bytes | bytearray) -> None:
+        if self._ctx is None:
+            self._hasher.update(data)
+            self._length += len(data)
+            return
+        if isinstance(data, bytearray):
+            buffer = (ctypes.c_char * len(data)).from_buffer(data)
+            _libcrypto.SHA256_Update(self._ctx, ctypes.addressof(buffer), len(data))
+            del buffer
+        else:
+            _libcrypto.SHA256_Update(self._ctx, bytes(data), len(data))
+
+    def hexdigest(self) -> str:
+        if self._ctx is None:
+            return self._hasher.hexdigest()
+        ctx = ctypes.create_string_buffer(self._ctx.raw, _SHA256_CTX_SIZE)
+        digest = ctypes.create_string_buffer(32)
+        _libcrypto.SHA256_Final(digest, ctx)
+        return digest.raw.hex()
@@ -0,0 +1,343 @@
+import datetime as dt
+import hashlib
+import json
+import shutil
+import tempfile
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, and_, or_, select
+
+from .. import database
+from ..config import settings
+from ..models import FileType, Job, JobKind, JobStatus, Segment, StoredFile, Trip, UploadSession, UploadStatus
+from .alignment import build_alignment
+from .gps import GPS_FILE_TYPES, ingest_segment_track
+from .mp4 import Mp4Error, codec_name, parse_mp4
+from .storage import (
+    STAGED_PREFIX,
+    commit_staged_file,
+    compute_sha256,
+    get_storage,
+    release_stored_file,
+    store_and_attach,
+)
+from .thumbnails import ThumbnailError, generate_thumbnails
+
+Handler = Callable[[Session, dict[str, Any]], None]
+
+HANDLERS: dict[JobKind, Handler] = {}
+
+
+class PermanentJobError(Exception):
+    pass
+
+
+def handler(kind: JobKind) -> Callable[[Handler], Handler]:
+    def register(func: Handler) -> Handler:
+        HANDLERS[kind] = func
+        return func
+
+    return register
+
+
+def _now() -> dt.datetime:
+    return dt.datetime.now(dt.timezone.utc)
+
+
+def enqueue(
+    session: Session,
+    kind: JobKind,
+    idempotency_key: str,
+    payload: dict[str, Any],
+    user_id: Optional[uuid.UUID] = None,
+    segment_id: Optional[uuid.UUID] = None,
+) -> Job:
+    # Commits on its own; callers must have committed their own changes first.
+    statement = select(Job).where(Job.idempotency_key == idempotency_key)
+    existing = session.exec(statement).first()
+    if existing is not None:
+        return existing
+    job = Job(
+        kind=kind,
+        idempotency_key=idempotency_key,
+        payload=json.dumps(payload),
+        user_id=user_id,
+        segment_id=segment_id,
+        max_attempts=settings.job_max_attempts,
+    )
+    session.add(job)
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        return session.exec(statement).one()
+    session.refresh(job)
+    return job
+
+
+def enqueue_gps_ingest(session: Session, stored_file: StoredFile, user_id: uuid.UUID) -> Job:
+    return enqueue(
+        session,
+        JobKind.INGEST_GPS,
+        f"{JobKind.INGEST_GPS.value}:{stored_file.segment_id}:{stored_file.sha256 or stored_file.id}",
+        {"segment_id": str(stored_file.segment_id)},
+        user_id=user_id,
+        segment_id=stored_file.segment_id,
+    )
+
+
+def enqueue_checksum(session: Session, stored_file: StoredFile, user_id: uuid.UUID) -> Job:
+    return enqueue(
+        session,
+        JobKind.VERIFY_CHECKSUM,
+        f"{JobKind.VERIFY_CHECKSUM.value}:{stored_file.id}",
+        {"stored_file_id": str(stored_file.id)},
+        user_id=user_id,
+        segment_id=stored_file.segment_id,
+    )
+
+
+def enqueue_metadata_extraction(session: Session, stored_file: StoredFile, user_id: uuid.UUID) -> Job:
+    return enqueue(
+        session,
+        JobKind.EXTRACT_METADATA,
+        f"{JobKind.EXTRACT_METADATA.value}:{stored_file.id}",
+        {"stored_file_id": str(stored_file.id)},
+        user_id=user_id,
+        segment_id=stored_file.segment_id,
+    )
+
+
+def enqueue_thumbnails(session: Session, stored_file: StoredFile, user_id: Optional[uuid.UUID]) -> Job:
+    return enqueue(
+        session,
+        JobKind.GENERATE_THUMBNAILS,
+        f"{JobKind.GENERATE_THUMBNAILS.value}:{stored_file.id}",
+        {"stored_file_id": str(stored_file.id)},
+        user_id=user_id,
+        segment_id=stored_file.segment_id,
+    )
+
+
+def enqueue_processing(session: Session, stored_file: StoredFile, user_id: uuid.UUID) -> None:
+    if stored_file.type == FileType.VIDEO_MP4:
+        enqueue_metadata_extraction(session, stored_file, user_id)
+    elif stored_file.type in GPS_FILE_TYPES:
+        enqueue_gps_ingest(session, stored_file, user_id)
+
+
+def _claimable(now: dt.datetime) -> Any:
+    # Queued jobs that are due, plus running jobs whose worker let the lease expire.
+    return or_(
+        and_(Job.status == JobStatus.QUEUED, Job.run_after <= now),
+        and_(Job.status == JobStatus.RUNNING, Job.locked_until < now),
+    )
+
+
+def claim_next(session: Session, worker_id: str) -> Optional[uuid.UUID]:
+    now = _now()
+    candidates = session.exec(select(Job.id).where(_claimable(now)).order_by(Job.run_after).limit(8)).all()
+    for job_id in candidates:
+        result = session.exec(
+            update(Job)
+            .where(Job.id == job_id, _claimable(now))
+            .values(
+                status=JobStatus.RUNNING,
+                locked_by=worker_id,
+                locked_until=now + dt.timedelta(seconds=settings.job_lease_seconds),
+                attempts=Job.attempts + 1,
+                updated_at=now,
+            )
+        )
+        session.commit()
+        if result.rowcount == 1:
+            return job_id
+    return None
+
+
+def backoff_seconds(attempts: int) -> float:
+    return min(settings.job_backoff_seconds * 2 ** max(attempts - 1, 0), settings.job_backoff_max_seconds)
+
+
+def _record_failure(job: Job, exc: Exception) -> None:
+    job.last_error = f"{type(exc).__name__}: {exc}"[:2000]
+    if isinstance(exc, PermanentJobError) or job.attempts >= job.max_attempts:
+        job.status = JobStatus.FAILED
+        job.finished_at = _now()
+    else:
+        job.status = JobStatus.QUEUED
+        job.run_after = _now() + dt.timedelta(seconds=backoff_seconds(job.attempts))
+
+
+def run_job(job_id: uuid.UUID, worker_id: str) -> Optional[JobStatus]:
+    with Session(database.engine) as session:
+        job = session.get(Job, job_id)
+        if job is None or job.status != JobStatus.RUNNING or job.locked_by != worker_id:
+            return None
+        if job.attempts > job.max_attempts:
+            _record_failure(job, PermanentJobError("Lease expired on the final attempt"))
+        else:
+            try:
+                HANDLERS[job.kind](session, json.loads(job.payload))
+            except Exception as exc:
+                session.rollback()
+                job = session.get(Job, job_id)
+                _record_failure(job, exc)
+            else:
+                job.status = JobStatus.SUCCEEDED
+                job.last_error = None
+                job.finished_at = _now()
+        job.locked_by = None
+        job.locked_until = None
+        job.updated_at = _now()
+        session.add(job)
+        session.commit()
+        return job.status
+
+
+def run_pending(worker_id: str = "inline", limit: Optional[int] = None) -> int:
+    processed = 0
+    while limit is None or processed < limit:
+        with Session(database.engine) as session:
+            job_id = claim_next(session, worker_id)
+        if job_id is None:
+            break
+        run_job(job_id, worker_id)
+        processed += 1
+    return processed
+
+
+@handler(JobKind.VERIFY_CHECKSUM)
+def _verify_checksum(session: Session, payload: dict[str, Any]) -> None:
+    stored_file = session.get(StoredFile, uuid.UUID(payload["stored_file_id"]))
+    if stored_file is None or not stored_file.sha256:
+        return
+    hasher = hashlib.sha256()
+    with get_storage().open(stored_file.storage_uri) as fp:
+        for chunk in iter(lambda: fp.read(settings.upload_buffer_bytes), b""):
+            hasher.update(chunk)
+    staged = stored_file.storage_uri.startswith(f"{STAGED_PREFIX}/")
+    if hasher.hexdigest() != stored_file.sha256:
+        if staged:
+            _reject_staged(session, stored_file)
+        raise PermanentJobError(f"Stored bytes of {stored_file.storage_uri} do not match their SHA-256")
+    if staged:
+        _commit_staged(session, stored_file)
+
+
+def _reject_staged(session: Session, stored_file: StoredFile) -> None:
+    upload = session.get(UploadSession, uuid.UUID(stored_file.storage_uri.removeprefix(f"{STAGED_PREFIX}/")))
+    release_stored_file(session, stored_file)
+    if upload is not None:
+        upload.status = UploadStatus.FAILED
+        upload.updated_at = _now()
+        session.add(upload)
+        session.commit()
+
+
+def _commit_staged(session: Session, stored_file: StoredFile) -> None:
+    # Final concatenated uploads are stored before their digest is known; they only reach the blob store, the
+    # segment and the processing jobs once it has been checked here.
+    stored_file = commit_staged_file(session, stored_file)
+    segment = session.get(Segment, stored_file.segment_id)
+    if stored_file.type == FileType.VIDEO_MP4:
+        segment.file_size_bytes = stored_file.bytes
+        segment.sha256 = stored_file.sha256
+        session.add(segment)
+        session.commit()
+    trip = session.get(Trip, segment.trip_id)
+    enqueue_processing(session, stored_file, trip.user_id)
+
+
+@handler(JobKind.INGEST_GPS)
+def _ingest_gps(session: Session, payload: dict[str, Any]) -> None:
+    segment_id = uuid.UUID(payload["segment_id"])
+    if ingest_segment_track(session, segment_id) is not None:
+        build_alignment(session, segment_id)
+
+
+@handler(JobKind.EXTRACT_METADATA)
+def _extract_metadata(session: Session, payload: dict[str, Any]) -> None:
+    stored_file = session.get(StoredFile, uuid.UUID(payload["stored_file_id"]))
+    if stored_file is None:
+        return
+    segment = session.get(Segment, stored_file.segment_id)
+    segment.media_probed_at = _now()
+    try:
+        with get_storage().open(stored_file.storage_uri) as fp:
+            info = parse_mp4(fp)
+    except Mp4Error as exc:
+        segment.media_error = str(exc)
+        session.add(segment)
+        session.commit()
+        raise PermanentJobError(f"Invalid MP4: {exc}") from exc
+    video = info.first("vide")
+    audio = info.first("soun")
+    segment.media_error = None
+    segment.duration_s = info.duration_s
+    segment.media_created_utc = info.created_at
+    segment.metadata_tracks = ",".join(track.codec or track.handler for track in info.metadata_tracks) or None
+    if video is not None:
+        segment.video_codec = codec_name(video.codec)
+        segment.width = video.width
+        segment.height = video.height
+        segment.fps = round(video.fps, 3) if video.fps else None
+    segment.audio_codec = codec_name(audio.codec) if audio is not None else None
+    session.add(segment)
+    session.commit()
+    build_alignment(session, segment.id)
+    if video is not None and segment.duration_s:
+        trip = session.get(Trip, segment.trip_id)
+        enqueue_thumbnails(session, stored_file, trip.user_id if trip else None)
+
+
+def _store_image(session: Session, segment_id: uuid.UUID, file_type: FileType, path: Path, filename: str) -> StoredFile:
+    return store_and_attach(session, segment_id, file_type, path, compute_sha256(path), filename)
+
+
+@handler(JobKind.GENERATE_THUMBNAILS)
+def _generate_thumbnails(session: Session, payload: dict[str, Any]) -> None:
+    stored_file = session.get(StoredFile, uuid.UUID(payload["stored_file_id"]))
+    if stored_file is None:
+        return
+    segment = session.get(Segment, stored_file.segment_id)
+    if not segment.duration_s:
+        raise PermanentJobError("Segment has no known duration")
+    storage = get_storage()
+    workdir = settings.storage_dir / "tmp"
+    workdir.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        source = storage.local_path(stored_file.storage_uri)
+        if source is None:
+            source = Path(tmp) / "source.mp4"
+            with storage.open(stored_file.storage_uri) as src, source.open("wb") as dest:
+                shutil.copyfileobj(src, dest, settings.upload_buffer_bytes)
+        try:
+            thumbnails = generate_thumbnails(source, Path(tmp), segment.duration_s)
+        except ThumbnailError as exc:
+            raise PermanentJobError(str(exc)) from exc
+        kept = {
+            _store_image(session, segment.id, FileType.THUMBNAIL_JPEG, path, f"poster_{number:05d}.jpg").storage_uri
+            for number, path in enumerate(thumbnails.posters)
+        }
+        sprite = _store_image(session, segment.id, FileType.THUMBNAIL_SPRITE, thumbnails.sprite, "sprite.jpg")
+        kept.add(sprite.storage_uri)
+    segment.thumbnail_interval_s = thumbnails.interval_s
+    segment.thumbnail_count = len(thumbnails.posters)
+    segment.thumbnail_columns = thumbnails.columns
+    session.add(segment)
+    session.commit()
+    # Frames from an earlier run that the new set no longer references are dropped.
+    stale = session.exec(
+        select(StoredFile).where(
+            StoredFile.segment_id == segment.id,
+            StoredFile.type.in_([FileType.THUMBNAIL_JPEG, FileType.THUMBNAIL_SPRITE]),
+            StoredFile.storage_uri.not_in(kept),
+        )
+    ).all()
+    for old in stale:
+        release_stored_file(session, old)
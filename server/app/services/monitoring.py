@@ -0,0 +1,344 @@
+import asyncio
+import bisect
+import math
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+from sqlalchemy import event, func
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from sqlmodel import Session, select
+
+from .. import database
+from ..config import settings
+from ..models import Job, UploadSession, UploadStatus
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(loop.time() - started - self.interval, 0.0)
+            self.max_lag = max(self.max_lag, self.last_lag)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+IO_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+THROUGHPUT_BUCKETS = tuple(float(2**power) for power in range(16, 31, 2))
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return _escape_help(value).replace('"', '\\"')
+
+
+def _escape_help(value: str) -> str:
+    # HELP text escapes backslashes and line feeds; label values also escape double quotes.
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {_escape_help(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        collect: Optional[Callable[[], dict[tuple[str, ...], float]]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._collect = collect
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, *labels: str) -> None:
+        self.inc(-amount, *labels)
+
+    def samples(self) -> list[str]:
+        if self._collect is not None:
+            # Gauges backed by a callback are read at scrape time, never on the request path.
+            values = self._collect()
+            with self._lock:
+                self._values = dict(values)
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket..., +Inf count, sum]; cumulated only when rendered.
+        self._series: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = []
+        for key, values in series:
+            cumulative = 0.0
+            for bound, count in zip((*self.buckets, math.inf), values):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(cumulative)}")
+        return lines
+
+
+M = TypeVar("M", bound=Metric)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: M) -> M:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "bike_recorder_http_request_duration_seconds",
+        "HTTP request latency by route template.",
+        ("method", "route", "status"),
+    )
+)
+UPLOAD_RECEIVED_BYTES = REGISTRY.register(
+    Counter("bike_recorder_upload_received_bytes_total", "Bytes written to upload sessions.", ("file_type",))
+)
+UPLOAD_THROUGHPUT = REGISTRY.register(
+    Histogram(
+        "bike_recorder_upload_throughput_bytes_per_second",
+        "Bytes per second received by each upload PATCH request.",
+        buckets=THROUGHPUT_BUCKETS,
+    )
+)
+UPLOADS_IN_PROGRESS = REGISTRY.register(
+    Gauge("bike_recorder_uploads_in_progress", "Upload PATCH requests currently streaming.")
+)
+STORAGE_WRITE_SECONDS = REGISTRY.register(
+    Histogram("bike_recorder_storage_write_seconds", "Time spent writing one buffered chunk.", buckets=IO_BUCKETS)
+)
+SHA256_SECONDS = REGISTRY.register(
+    Histogram("bike_recorder_sha256_seconds", "Time spent hashing upload data.", ("stage",), buckets=IO_BUCKETS)
+)
+SWEEPER_RECLAIMED_BYTES = REGISTRY.register(
+    Counter(
+        "bike_recorder_sweeper_reclaimed_bytes_total",
+        "Bytes deleted by the storage sweeper, by kind.",
+        ("kind",),
+    )
+)
+DB_COMMIT_SECONDS = REGISTRY.register(
+    Histogram("bike_recorder_db_commit_seconds", "Time spent in Session.commit, including flush.", buckets=IO_BUCKETS)
+)
+
+
+def _pool_usage() -> dict[tuple[str, ...], float]:
+    pool = database.engine.pool
+    usage = {}
+    # SQLite memory databases use a pool without size accounting.
+    for state, attribute in (("size", "size"), ("checked_out", "checkedout"), ("overflow", "overflow")):
+        reader = getattr(pool, attribute, None)
+        if reader is not None:
+            usage[(state,)] = float(reader())
+    return usage
+
+
+def _disk_usage() -> dict[tuple[str, ...], float]:
+    usage = shutil.disk_usage(settings.storage_dir)
+    return {("free",): float(usage.free), ("total",): float(usage.total)}
+
+
+def _count_by_status(model: Any, statuses: Optional[list[Any]] = None) -> dict[tuple[str, ...], float]:
+    statement = select(model.status, func.count()).group_by(model.status)
+    if statuses is not None:
+        statement = statement.where(model.status.in_(statuses))
+    with Session(database.engine) as session:
+        rows = session.exec(statement).all()
+    return {(getattr(status, "value", str(status)),): float(count) for status, count in rows}
+
+
+DB_POOL_CONNECTIONS = REGISTRY.register(
+    Gauge("bike_recorder_db_pool_connections", "Database pool connections by state.", ("state",), _pool_usage)
+)
+STORAGE_BYTES = REGISTRY.register(
+    Gauge("bike_recorder_storage_bytes", "Free and total bytes on the storage volume.", ("state",), _disk_usage)
+)
+UPLOAD_SESSIONS = REGISTRY.register(
+    Gauge(
+        "bike_recorder_upload_sessions",
+        "Upload sessions that have not completed, by status.",
+        ("status",),
+        lambda: _count_by_status(UploadSession, [UploadStatus.PENDING, UploadStatus.RECEIVING]),
+    )
+)
+JOBS = REGISTRY.register(
+    Gauge("bike_recorder_jobs", "Background jobs by status.", ("status",), lambda: _count_by_status(Job))
+)
+
+
+def _before_commit(session: Session) -> None:
+    session.info["commit_started"] = time.perf_counter()
+
+
+def _after_commit(session: Session) -> None:
+    started = session.info.pop("commit_started", None)
+    if started is not None:
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+
+def _after_rollback(session: Session) -> None:
+    session.info.pop("commit_started", None)
+
+
+def instrument_sessions() -> None:
+    if not event.contains(Session, "before_commit", _before_commit):
+        event.listen(Session, "before_commit", _before_commit)
+        event.listen(Session, "after_commit", _after_commit)
+        event.listen(Session, "after_soft_rollback", lambda session, previous: _after_rollback(session))
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope; the template keeps label cardinality bounded.
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status_code),
+            )
@@ -0,0 +1,236 @@
+import datetime as dt
+import io
+import mmap
+import os
+import struct
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Iterator, Optional
+
+import numpy as np
+
+from ..config import settings
+
+# Seconds between the ISO-BMFF epoch (1904-01-01) and the Unix epoch.
+MP4_EPOCH_OFFSET = 2_082_844_800
+CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"mvex", b"edts"}
+CODEC_NAMES = {
+    "avc1": "h264",
+    "avc3": "h264",
+    "hvc1": "hevc",
+    "hev1": "hevc",
+    "av01": "av1",
+    "vp09": "vp9",
+    "mp4a": "aac",
+    "Opus": "opus",
+    "ac-3": "ac3",
+    "ec-3": "eac3",
+}
+METADATA_HANDLERS = {"meta", "text", "sbtl", "subt", "camm"}
+
+
+class Mp4Error(ValueError):
+    pass
+
+
+@dataclass
+class Mp4Track:
+    track_id: int
+    handler: str
+    codec: Optional[str] = None
+    timescale: int = 0
+    duration_s: Optional[float] = None
+    sample_count: int = 0
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+    @property
+    def fps(self) -> Optional[float]:
+        if not self.sample_count or not self.duration_s:
+            return None
+        return self.sample_count / self.duration_s
+
+
+@dataclass
+class Mp4Info:
+    brand: str
+    duration_s: Optional[float]
+    created_at: Optional[dt.datetime]
+    tracks: list[Mp4Track] = field(default_factory=list)
+
+    def first(self, handler: str) -> Optional[Mp4Track]:
+        return next((track for track in self.tracks if track.handler == handler), None)
+
+    @property
+    def metadata_tracks(self) -> list[Mp4Track]:
+        return [track for track in self.tracks if track.handler in METADATA_HANDLERS]
+
+
+def codec_name(fourcc: Optional[str]) -> Optional[str]:
+    return CODEC_NAMES.get(fourcc, fourcc) if fourcc else None
+
+
+def _iter_boxes(buffer: memoryview, start: int, end: int) -> Iterator[tuple[bytes, int, int]]:
+    # Yields (type, payload_start, box_end) for the children of [start, end).
+    offset = start
+    while offset < end:
+        if end - offset < 8:
+            raise Mp4Error(f"Truncated box header at offset {offset}")
+        size, kind = struct.unpack_from(">I4s", buffer, offset)
+        header = 8
+        if size == 1:
+            if end - offset < 16:
+                raise Mp4Error(f"Truncated box header at offset {offset}")
+            (size,) = struct.unpack_from(">Q", buffer, offset + 8)
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise Mp4Error(f"Box {kind!r} at offset {offset} overruns its parent")
+        yield kind, offset + header, offset + size
+        offset += size
+
+
+def _full_box(buffer: memoryview, start: int, end: int, v0: str, v1: str) -> tuple:
+    if start + 4 > end:
+        raise Mp4Error("Truncated full box")
+    version = buffer[start]
+    layout = v0 if version == 0 else v1 if version == 1 else None
+    if layout is None:
+        raise Mp4Error(f"Unsupported box version {version}")
+    if start + 4 + struct.calcsize(layout) > end:
+        raise Mp4Error("Truncated full box")
+    return struct.unpack_from(layout, buffer, start + 4)
+
+
+def _parse_stsd(buffer: memoryview, start: int, end: int, track: Mp4Track) -> None:
+    if end - start < 8:
+        raise Mp4Error("Truncated stsd box")
+    (count,) = struct.unpack_from(">I", buffer, start + 4)
+    if not count:
+        return
+    for kind, payload, entry_end in _iter_boxes(buffer, start + 8, end):
+        track.codec = kind.decode("latin-1")
+        if track.handler == "vide" and entry_end - payload >= 28:
+            track.width, track.height = struct.unpack_from(">HH", buffer, payload + 24)
+        return
+
+
+def _parse_stts(buffer: memoryview, start: int, end: int, track: Mp4Track) -> None:
+    if end - start < 8:
+        raise Mp4Error("Truncated stts box")
+    (count,) = struct.unpack_from(">I", buffer, start + 4)
+    if start + 8 + count * 8 > end:
+        raise Mp4Error("stts entry table overruns its box")
+    entries = np.frombuffer(buffer, dtype=">u4", count=count * 2, offset=start + 8).reshape(-1, 2)
+    track.sample_count = int(entries[:, 0].sum(dtype=np.uint64))
+    if not track.duration_s and track.timescale:
+        ticks = int((entries[:, 0].astype(np.uint64) * entries[:, 1]).sum())
+        track.duration_s = ticks / track.timescale or None
+
+
+def _parse_trak(buffer: memoryview, start: int, end: int) -> Mp4Track:
+    track = Mp4Track(track_id=0, handler="")
+    stbl: list[tuple[bytes, int, int]] = []
+
+    def walk(first: int, last: int) -> None:
+        for kind, payload, box_end in _iter_boxes(buffer, first, last):
+            if kind == b"tkhd":
+                (track.track_id,) = _full_box(buffer, payload, box_end, ">8xI", ">16xI")
+            elif kind == b"mdhd":
+                timescale, duration = _full_box(buffer, payload, box_end, ">8xII", ">16xIQ")
+                if not timescale:
+                    raise Mp4Error("Track timescale is zero")
+                track.timescale = timescale
+                track.duration_s = duration / timescale if duration not in (0, 0xFFFFFFFF) else None
+            elif kind == b"hdlr":
+                (handler,) = _full_box(buffer, payload, box_end, ">4x4s", ">4x4s")
+                track.handler = handler.decode("latin-1")
+            elif kind in (b"stsd", b"stts"):
+                stbl.append((kind, payload, box_end))
+            elif kind in CONTAINER_BOXES:
+                walk(payload, box_end)
+
+    walk(start, end)
+    # Sample tables are interpreted once the handler and timescale are known.
+    for kind, payload, box_end in stbl:
+        if kind == b"stsd":
+            _parse_stsd(buffer, payload, box_end, track)
+        else:
+            _parse_stts(buffer, payload, box_end, track)
+    return track
+
+
+def _parse_moov(buffer: memoryview, brand: str) -> Mp4Info:
+    info = Mp4Info(brand=brand, duration_s=None, created_at=None)
+    timescale = 0
+    for kind, payload, box_end in _iter_boxes(buffer, 0, len(buffer)):
+        if kind == b"mvhd":
+            created, timescale, duration = _full_box(buffer, payload, box_end, ">I4xII", ">Q8xIQ")
+            if not timescale:
+                raise Mp4Error("Movie timescale is zero")
+            if duration not in (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+                info.duration_s = duration / timescale
+            if created > MP4_EPOCH_OFFSET:
+                info.created_at = dt.datetime.fromtimestamp(created - MP4_EPOCH_OFFSET, dt.timezone.utc)
+        elif kind == b"trak":
+            info.tracks.append(_parse_trak(buffer, payload, box_end))
+        elif kind == b"mvex":
+            for child, child_payload, child_end in _iter_boxes(buffer, payload, box_end):
+                if child == b"mehd" and timescale and not info.duration_s:
+                    (duration,) = _full_box(buffer, child_payload, child_end, ">I", ">Q")
+                    info.duration_s = duration / timescale or None
+    if not timescale:
+        raise Mp4Error("moov box has no mvhd")
+    if info.duration_s is None:
+        durations = [track.duration_s for track in info.tracks if track.duration_s]
+        info.duration_s = max(durations) if durations else None
+    return info
+
+
+def _read_at(fp: BinaryIO) -> tuple[Callable[[int, int], bytes], Optional[mmap.mmap]]:
+    try:
+        mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        def read(offset: int, size: int) -> bytes:
+            fp.seek(offset)
+            return fp.read(size)
+
+        return read, None
+    return (lambda offset, size: mapped[offset : offset + size]), mapped
+
+
+def parse_mp4(fp: BinaryIO) -> Mp4Info:
+    # Walks only the top-level box headers and the moov box; media data is never read.
+    file_size = fp.seek(0, os.SEEK_END)
+    read, mapped = _read_at(fp)
+    try:
+        brand = None
+        offset = 0
+        while offset < file_size:
+            header = read(offset, 16)
+            if len(header) < 8:
+                raise Mp4Error(f"Truncated box header at offset {offset}")
+            size, kind = struct.unpack_from(">I4s", header)
+            header_size = 8
+            if size == 1:
+                if len(header) < 16:
+                    raise Mp4Error(f"Truncated box header at offset {offset}")
+                (size,) = struct.unpack_from(">Q", header, 8)
+                header_size = 16
+            elif size == 0:
+                size = file_size - offset
+            if size < header_size or offset + size > file_size:
+                raise Mp4Error(f"Box {kind!r} at offset {offset} overruns the file")
+            if brand is None:
+                if kind != b"ftyp":
+                    raise Mp4Error("Not an ISO-BMFF file (missing ftyp)")
+                brand = read(offset + header_size, 4).decode("latin-1")
+            elif kind == b"moov":
+                if size - header_size > settings.mp4_max_moov_bytes:
+                    raise Mp4Error("moov box is too large")
+                return _parse_moov(memoryview(read(offset + header_size, size - header_size)), brand)
+            offset += size
+        raise Mp4Error("No moov box found")
+    finally:
+        if mapped is not None:
+            mapped.close()
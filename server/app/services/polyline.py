@@ -0,0 +1,109 @@
+import json
+import math
+import os
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from ..config import settings
+from .stats import EARTH_RADIUS_M
+from .storage import ensure_parent, get_temp_path
+
+# Web-map zoom levels precomputed at ingest; requests are served from the
+# nearest level at or above the requested zoom.
+POLYLINE_ZOOMS = (6, 8, 10, 12, 14, 16, 18)
+METERS_PER_PIXEL_Z0 = 156_543.03
+
+
+def get_polyline_path(segment_id: uuid.UUID) -> Path:
+    return settings.storage_dir / "tracks" / f"{segment_id}.polylines.json"
+
+
+def tolerance_for_zoom(zoom: int) -> float:
+    return METERS_PER_PIXEL_Z0 / (2**zoom)
+
+
+def level_for_zoom(zoom: int) -> int:
+    for level in POLYLINE_ZOOMS:
+        if level >= zoom:
+            return level
+    return POLYLINE_ZOOMS[-1]
+
+
+def encode_polyline(lat: np.ndarray, lon: np.ndarray) -> str:
+    # Google's encoded polyline format with 1e-5 precision.
+    points = np.column_stack((np.round(np.asarray(lat) * 1e5), np.round(np.asarray(lon) * 1e5))).astype(np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    zigzag = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    chars: list[str] = []
+    for value in zigzag.tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def simplify(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    # Iterative Douglas-Peucker; returns the indices of the points to keep.
+    count = len(x)
+    if count < 3:
+        return np.arange(count)
+    keep = np.zeros(count, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        px = x[start + 1 : end] - x[start]
+        py = y[start + 1 : end] - y[start]
+        norm = math.hypot(dx, dy)
+        distances = np.abs(dx * py - dy * px) / norm if norm else np.hypot(px, py)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = start + 1 + farthest
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return np.flatnonzero(keep)
+
+
+def build_pyramid(track: np.ndarray) -> dict[int, str]:
+    if not len(track):
+        return {zoom: "" for zoom in POLYLINE_ZOOMS}
+    lat = np.asarray(track["lat"], dtype=np.float64)
+    lon = np.asarray(track["lon"], dtype=np.float64)
+    scale = math.cos(math.radians(float(lat[0])))
+    x = np.radians(lon - lon[0]) * EARTH_RADIUS_M * scale
+    y = np.radians(lat - lat[0]) * EARTH_RADIUS_M
+    pyramid: dict[int, str] = {}
+    # Each coarser level simplifies the previous one instead of the full track.
+    indices = np.arange(len(track))
+    for zoom in sorted(POLYLINE_ZOOMS, reverse=True):
+        indices = indices[simplify(x[indices], y[indices], tolerance_for_zoom(zoom))]
+        pyramid[zoom] = encode_polyline(lat[indices], lon[indices])
+    return pyramid
+
+
+def write_pyramid(segment_id: uuid.UUID, track: np.ndarray) -> dict[int, str]:
+    pyramid = build_pyramid(track)
+    path = get_temp_path()
+    ensure_parent(path)
+    path.write_text(json.dumps({str(zoom): encoded for zoom, encoded in pyramid.items()}))
+    dest = get_polyline_path(segment_id)
+    ensure_parent(dest)
+    os.replace(path, dest)
+    return pyramid
+
+
+def read_polyline(segment_id: uuid.UUID, zoom: int) -> Optional[str]:
+    try:
+        levels = json.loads(get_polyline_path(segment_id).read_text())
+    except FileNotFoundError:
+        return None
+    return levels.get(str(level_for_zoom(zoom)))
@@ -0,0 +1,300 @@
+import io
+import tempfile
+from pathlib import Path
+from typing import Any, BinaryIO, Optional
+from urllib.parse import quote
+
+from ..config import settings
+from .hashing import ResumableSha256, resumable
+from .storage import ChunkSink, ChunkTooSmall, StagedPart, StorageBackend, blob_uri
+
+try:  # pragma: no cover - optional dependency
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:  # pragma: no cover - optional dependency
+    boto3 = None
+    ClientError = Exception
+
+
+# UploadPartCopy copies at most 5 GiB per part.
+MAX_COPY_PART_BYTES = 5 * 1024**3
+
+
+def _is_missing(exc: Exception) -> bool:
+    error = getattr(exc, "response", {}).get("Error", {})
+    return error.get("Code") in {"404", "NoSuchKey", "NotFound", "NoSuchUpload"}
+
+
+class S3PartWriter(ChunkSink):
+    # Spools one PATCH body (bounded memory, overflow to a temp file) and
+    # uploads it as a single multipart part when the request ends.
+    def __init__(
+        self,
+        storage: "S3Storage",
+        upload_id: str,
+        handle: str,
+        part_number: int,
+        offset: int,
+        limit: int,
+        total: int,
+        hasher: Optional[ResumableSha256] = None,
+    ):
+        super().__init__(limit, settings.upload_buffer_bytes, hasher)
+        self._storage = storage
+        self._key, self._handle = storage.upload_target(upload_id, handle)
+        self._part_number = part_number
+        self._offset = offset
+        self._total = total
+        self._spool = tempfile.SpooledTemporaryFile(max_size=settings.upload_buffer_bytes)
+
+    def _write_buffer(self) -> None:
+        self._spool.write(self._buffer)
+
+    def _commit(self) -> None:
+        if not self.received:
+            return
+        if self.received < settings.s3_min_part_bytes and self._offset + self.received < self._total:
+            raise ChunkTooSmall(f"Chunks must be at least {settings.s3_min_part_bytes} bytes except the last one")
+        self._spool.seek(0)
+        self._storage.client.upload_part(
+            Bucket=self._storage.bucket,
+            Key=self._key,
+            UploadId=self._handle,
+            PartNumber=self._part_number,
+            Body=self._spool,
+            ContentLength=self.received,
+        )
+        self.written = self.received
+
+    def _release(self) -> None:
+        self._spool.close()
+
+
+class S3ObjectReader(io.RawIOBase):
+    def __init__(self, client: Any, bucket: str, key: str):
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._size = client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = self._size + offset
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        if self._position >= self._size or not len(buffer):
+            return 0
+        end = min(self._position + len(buffer), self._size) - 1
+        response = self._client.get_object(Bucket=self._bucket, Key=self._key, Range=f"bytes={self._position}-{end}")
+        data = response["Body"].read()
+        buffer[: len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+class S3Storage(StorageBackend):
+    name = "s3"
+    reads_open_uploads = False
+
+    def __init__(self, bucket: str, client: Any, prefix: str = ""):
+        self.bucket = bucket
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_settings(cls) -> "S3Storage":
+        if boto3 is None:
+            raise RuntimeError("The S3 storage backend requires boto3 (pip install bike-recorder-server[s3])")
+        if not settings.s3_bucket:
+            raise RuntimeError("BIKE_RECORDER_S3_BUCKET must be set for the S3 storage backend")
+        if not resumable():
+            # Parts of an unfinished multipart upload cannot be read back, so a resumed PATCH could never
+            # re-hash its prefix without saved hash state.
+            raise RuntimeError("The S3 storage backend requires libcrypto for resumable SHA-256 state")
+        client = boto3.client(
+            "s3",
+            endpoint_url=settings.s3_endpoint_url,
+            region_name=settings.s3_region,
+            aws_access_key_id=settings.s3_access_key_id,
+            aws_secret_access_key=settings.s3_secret_access_key,
+        )
+        return cls(settings.s3_bucket, client, prefix=settings.s3_prefix)
+
+    def key(self, uri: str) -> str:
+        return f"{self.prefix}{uri}"
+
+    def staging_key(self, upload_id: str) -> str:
+        return self.key(f"uploads/{upload_id}")
+
+    def upload_target(self, upload_id: str, handle: str) -> tuple[str, str]:
+        # Handles of uploads opened at their blob key are "<blob uri> <multipart upload id>"; the rest are bare
+        # multipart upload IDs at the staging key.
+        uri, _, multipart_id = handle.rpartition(" ")
+        return (self.key(uri) if uri else self.staging_key(upload_id)), multipart_id
+
+    def _parts(self, upload_id: str, handle: str) -> list[dict]:
+        key, multipart_id = self.upload_target(upload_id, handle)
+        parts: list[dict] = []
+        marker = 0
+        while True:
+            response = self.client.list_parts(
+                Bucket=self.bucket, Key=key, UploadId=multipart_id, PartNumberMarker=marker
+            )
+            parts.extend(response.get("Parts", []))
+            if not response.get("IsTruncated"):
+                break
+            marker = response["NextPartNumberMarker"]
+        return sorted(parts, key=lambda part: part["PartNumber"])
+
+    def _parts_covering(self, upload_id: str, handle: str, offset: int) -> list[dict]:
+        covered = 0
+        selected = []
+        for expected, part in enumerate(self._parts(upload_id, handle), start=1):
+            if covered == offset or part["PartNumber"] != expected:
+                break
+            selected.append(part)
+            covered += part["Size"]
+        if covered != offset:
+            raise ValueError("Upload offset does not fall on a part boundary")
+        return selected
+
+    def begin_upload(self, upload_id: str, sha256: Optional[str] = None) -> Optional[str]:
+        # With the digest known up front the parts are uploaded straight to the blob key, so finalize only has
+        # to complete the multipart upload instead of copying the object.
+        if sha256 is None:
+            return self.client.create_multipart_upload(Bucket=self.bucket, Key=self.staging_key(upload_id))["UploadId"]
+        uri = blob_uri(sha256)
+        response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key(uri))
+        return f"{uri} {response['UploadId']}"
+
+    def open_chunk(
+        self,
+        upload_id: str,
+        handle: Optional[str],
+        offset: int,
+        limit: int,
+        total: int,
+        hasher: Optional[ResumableSha256] = None,
+    ) -> ChunkSink:
+        part_number = len(self._parts_covering(upload_id, handle, offset)) + 1
+        return S3PartWriter(self, upload_id, handle, part_number, offset, limit, total, hasher)
+
+    def open_upload(self, upload_id: str, handle: Optional[str]) -> BinaryIO:
+        # Only sealed partial uploads exist as an object; parts of an open multipart upload cannot be read.
+        if not self.exists(f"uploads/{upload_id}"):
+            raise ValueError("Parts of an unfinished S3 multipart upload cannot be read back")
+        return self.open(f"uploads/{upload_id}")
+
+    def _complete(self, upload_id: str, handle: Optional[str], size: int) -> None:
+        parts = self._parts_covering(upload_id, handle, size)
+        key, multipart_id = self.upload_target(upload_id, handle)
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=multipart_id,
+            MultipartUpload={"Parts": [{"PartNumber": part["PartNumber"], "ETag": part["ETag"]} for part in parts]},
+        )
+
+    def seal_upload(self, upload_id: str, handle: Optional[str], size: int) -> None:
+        self._complete(upload_id, handle, size)
+
+    def concat_uploads(self, upload_id: str, handle: Optional[str], parts: list[StagedPart]) -> None:
+        # Every part but the last must meet the multipart minimum, so check them all before copying anything.
+        if any(size < settings.s3_min_part_bytes for _, _, size in parts[:-1]):
+            raise ChunkTooSmall(f"Partial uploads must be at least {settings.s3_min_part_bytes} bytes except the last")
+        key, multipart_id = self.upload_target(upload_id, handle)
+        number = 0
+        for part_id, _, size in parts:
+            # Large parts are split into equal ranges, so no range is left below the minimum.
+            pieces = -(-size // MAX_COPY_PART_BYTES)
+            step = -(-size // pieces)
+            for start in range(0, size, step):
+                number += 1
+                self.client.upload_part_copy(
+                    Bucket=self.bucket,
+                    Key=key,
+                    UploadId=multipart_id,
+                    PartNumber=number,
+                    CopySource={"Bucket": self.bucket, "Key": self.staging_key(part_id)},
+                    CopySourceRange=f"bytes={start}-{min(start + step, size) - 1}",
+                )
+
+    def commit_upload(self, upload_id: str, handle: Optional[str], sha256: str, size: int) -> tuple[str, int]:
+        uri = blob_uri(sha256)
+        key, multipart_id = self.upload_target(upload_id, handle)
+        if key == self.key(uri):
+            if self.exists(uri):
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=multipart_id)
+            else:
+                self._complete(upload_id, handle, size)
+            return uri, size
+        # Uploads opened without a digest still finish with a server-side copy.
+        self._complete(upload_id, handle, size)
+        return self.commit_staged(upload_id, sha256, size)
+
+    def commit_staged(self, upload_id: str, sha256: str, size: int) -> tuple[str, int]:
+        uri = blob_uri(sha256)
+        staging = self.staging_key(upload_id)
+        if not self.exists(uri):
+            self.client.copy({"Bucket": self.bucket, "Key": staging}, self.bucket, self.key(uri))
+        self.client.delete_object(Bucket=self.bucket, Key=staging)
+        return uri, size
+
+    def abort_upload(self, upload_id: str, handle: Optional[str]) -> None:
+        if not handle:
+            return
+        key, multipart_id = self.upload_target(upload_id, handle)
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=multipart_id)
+        except ClientError as exc:
+            if not _is_missing(exc):
+                raise
+        # A sealed partial upload is already an object rather than an open multipart upload. An upload at its
+        # blob key never is, and the object there may be another file's blob.
+        if key == self.staging_key(upload_id):
+            self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def store_file(self, path: Path, sha256: str) -> tuple[str, int]:
+        uri = blob_uri(sha256)
+        size = path.stat().st_size
+        if not self.exists(uri):
+            self.client.upload_file(str(path), self.bucket, self.key(uri))
+        path.unlink(missing_ok=True)
+        return uri, size
+
+    def open(self, uri: str) -> BinaryIO:
+        reader = S3ObjectReader(self.client, self.bucket, self.key(uri))
+        return io.BufferedReader(reader, buffer_size=settings.upload_buffer_bytes)
+
+    def exists(self, uri: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(uri))
+        except ClientError as exc:
+            if _is_missing(exc):
+                return False
+            raise
+        return True
+
+    def delete(self, uri: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(uri))
+
+    def presign(self, uri: str, expires_in: int, filename: Optional[str] = None) -> Optional[str]:
+        params = {"Bucket": self.bucket, "Key": self.key(uri)}
+        if filename:
+            params["ResponseContentDisposition"] = f"inline; filename*=UTF-8''{quote(filename)}"
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in)
@@ -0,0 +1,326 @@
+import hashlib
+import zlib
+from pathlib import Path
+from typing import Iterator, Optional
+from xml.parsers import expat
+
+from ..config import settings
+from ..models import FileType
+from .gps import parse_jsonl_line
+from .storage import ChunkWriter
+
+try:  # pragma: no cover - optional dependency
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+SIDECAR_MEDIA_TYPES = {
+    "application/x-ndjson": FileType.GPS_JSONL,
+    "application/jsonl": FileType.GPS_JSONL,
+    "application/gpx+xml": FileType.GPS_GPX,
+    "application/json": FileType.METADATA_JSON,
+}
+# Decompressed output is produced in slices of this size so a small, highly
+# compressed request body cannot expand into one huge buffer.
+DECODE_SLICE_BYTES = 1024 * 1024
+MAX_LINE_BYTES = 1024 * 1024
+MAX_REPORTED_ERRORS = 20
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+class SidecarDecodeError(ValueError):
+    pass
+
+
+class Decoder:
+    def decode(self, data: bytes) -> Iterator[bytes]:
+        if data:
+            yield data
+
+    def finish(self) -> Iterator[bytes]:
+        return iter(())
+
+
+class GzipDecoder(Decoder):
+    def __init__(self) -> None:
+        # wbits 32+15 accepts both gzip and zlib framing.
+        self._inflate = zlib.decompressobj(32 + zlib.MAX_WBITS)
+
+    def _drain(self, data: bytes) -> Iterator[bytes]:
+        try:
+            while data:
+                chunk = self._inflate.decompress(data, DECODE_SLICE_BYTES)
+                if chunk:
+                    yield chunk
+                data = self._inflate.unconsumed_tail
+                if self._inflate.eof and self._inflate.unused_data:
+                    # Concatenated gzip members (e.g. appended log rotations) continue the stream.
+                    data = self._inflate.unused_data
+                    self._inflate = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        except zlib.error as exc:
+            raise SidecarDecodeError(f"Invalid gzip body: {exc}") from exc
+
+    def decode(self, data: bytes) -> Iterator[bytes]:
+        yield from self._drain(data)
+
+    def finish(self) -> Iterator[bytes]:
+        yield from self._drain(self._inflate.unconsumed_tail)
+        tail = self._inflate.flush()
+        if tail:
+            yield tail
+        if not self._inflate.eof:
+            raise SidecarDecodeError("Truncated gzip body")
+
+
+class ZstdDecoder(Decoder):
+    # decompressobj has no output limit, so the input is cut at block headers instead: a zstd block never
+    # decodes to more than 128 KiB, and each call is given at most DECODE_SLICE_BYTES worth of blocks.
+    MAX_BLOCK_BYTES = 128 * 1024
+    FRAME_MAGIC = 0xFD2FB528
+    SKIPPABLE_MAGIC = 0x184D2A50
+
+    def __init__(self) -> None:
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._inflate = self._decompressor.decompressobj(write_size=DECODE_SLICE_BYTES)
+        self._header = bytearray()
+        self._skip = 0
+        self._in_frame = False
+        self._checksum = False
+        self._budget = 0
+
+    def _wanted(self) -> int:
+        if self._in_frame:
+            return 3
+        if len(self._header) < 4:
+            return 4
+        magic = int.from_bytes(self._header[:4], "little")
+        if magic & 0xFFFFFFF0 == self.SKIPPABLE_MAGIC:
+            return 8
+        if magic != self.FRAME_MAGIC:
+            raise SidecarDecodeError("Invalid zstd body: unknown frame magic")
+        return 5
+
+    def _parse_header(self) -> int:
+        # Returns the most the block just announced can decode to; frame headers decode to nothing.
+        header = int.from_bytes(self._header, "little")
+        descriptor = self._header[4] if len(self._header) == 5 else 0
+        kind = len(self._header)
+        self._header.clear()
+        if kind == 3:
+            last, block_type, size = header & 1, (header >> 1) & 3, header >> 3
+            if block_type == 3:
+                raise SidecarDecodeError("Invalid zstd body: reserved block type")
+            self._skip = 1 if block_type == 1 else size
+            if last:
+                self._in_frame = False
+                self._skip += 4 if self._checksum else 0
+            return size if block_type < 2 else self.MAX_BLOCK_BYTES
+        if kind == 8:
+            self._skip = header >> 32
+            return 0
+        single_segment = descriptor >> 5 & 1
+        self._checksum = bool(descriptor >> 2 & 1)
+        self._skip = (0, 1, 2, 4)[descriptor & 3] + (single_segment, 2, 4, 8)[descriptor >> 6] + 1 - single_segment
+        self._in_frame = True
+        return 0
+
+    def _pieces(self, data: bytes) -> Iterator[memoryview]:
+        view = memoryview(data)
+        start = position = 0
+        while position < len(view):
+            if self._skip:
+                step = min(self._skip, len(view) - position)
+                self._skip -= step
+                position += step
+                continue
+            wanted = self._wanted()
+            take = min(wanted - len(self._header), len(view) - position)
+            self._header += view[position : position + take]
+            position += take
+            if len(self._header) < wanted or wanted != self._wanted():
+                continue
+            decoded = self._parse_header()
+            if self._budget + decoded > DECODE_SLICE_BYTES:
+                cut = position - take
+                yield view[start:cut]
+                start, self._budget = cut, 0
+            self._budget += decoded
+        if start < len(view):
+            yield view[start:]
+
+    def _drain(self, data: bytes) -> Iterator[bytes]:
+        try:
+            for piece in self._pieces(data):
+                while piece:
+                    if self._inflate.eof:
+                        # Concatenated frames continue the stream, as gzip members do.
+                        self._inflate = self._decompressor.decompressobj(write_size=DECODE_SLICE_BYTES)
+                    chunk = self._inflate.decompress(piece)
+                    piece = self._inflate.unused_data if self._inflate.eof else b""
+                    for start in range(0, len(chunk), DECODE_SLICE_BYTES):
+                        yield chunk[start : start + DECODE_SLICE_BYTES]
+        except zstandard.ZstdError as exc:
+            raise SidecarDecodeError(f"Invalid zstd body: {exc}") from exc
+
+    def decode(self, data: bytes) -> Iterator[bytes]:
+        yield from self._drain(data)
+
+    def finish(self) -> Iterator[bytes]:
+        if not self._inflate.eof or self._header or self._skip:
+            raise SidecarDecodeError("Truncated zstd body")
+        return iter(())
+
+
+def get_decoder(content_encoding: Optional[str]) -> Decoder:
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return Decoder()
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        return GzipDecoder()
+    if encoding == "zstd":
+        if zstandard is None:
+            raise UnsupportedEncoding("zstd bodies need the zstandard package (pip install -e .[zstd])")
+        return ZstdDecoder()
+    raise UnsupportedEncoding(f"Unsupported Content-Encoding: {encoding}")
+
+
+class Validator:
+    def __init__(self) -> None:
+        self.records = 0
+        self.errors: list[str] = []
+        self.error_count = 0
+
+    def _error(self, message: str) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
+    def feed(self, data: bytes) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class JsonlValidator(Validator):
+    # Checks each line as it arrives; only the current partial line is buffered.
+    def __init__(self) -> None:
+        super().__init__()
+        self._partial = bytearray()
+        self._line = 0
+        self._overlong = False
+
+    def _check(self, line: bytes) -> None:
+        self._line += 1
+        if self._overlong:
+            self._overlong = False
+            self._error(f"line {self._line}: longer than {MAX_LINE_BYTES} bytes")
+        elif line.strip():
+            self.records += 1
+            if parse_jsonl_line(line) is None:
+                self._error(f"line {self._line}: not a GPS sample with ts, lat and lon")
+
+    def feed(self, data: bytes) -> None:
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+            if self._partial:
+                self._partial += data[start:end]
+                self._check(bytes(self._partial))
+                self._partial.clear()
+            else:
+                self._check(data[start:end])
+            start = end + 1
+        if not self._overlong:
+            self._partial += data[start:]
+            if len(self._partial) > MAX_LINE_BYTES:
+                self._overlong = True
+                self._partial.clear()
+
+    def close(self) -> None:
+        if self._partial or self._overlong:
+            self._check(bytes(self._partial))
+            self._partial.clear()
+
+
+class GpxValidator(Validator):
+    # expat checks well-formedness without building a tree.
+    def __init__(self) -> None:
+        super().__init__()
+        self._parser = expat.ParserCreate()
+        self._parser.StartElementHandler = self._start
+        self._root: Optional[str] = None
+
+    def _start(self, name: str, attributes: dict[str, str]) -> None:
+        local = name.rsplit(":", 1)[-1]
+        if self._root is None:
+            self._root = local
+            if local != "gpx":
+                self._error(f"root element is <{name}>, expected <gpx>")
+        if local != "trkpt":
+            return
+        self.records += 1
+        try:
+            valid = -90 <= float(attributes["lat"]) <= 90 and -180 <= float(attributes["lon"]) <= 180
+        except (KeyError, ValueError):
+            valid = False
+        if not valid:
+            self._error(f"line {self._parser.CurrentLineNumber}: trkpt without a valid lat/lon")
+
+    def _parse(self, data: bytes, final: bool) -> None:
+        if self._parser is None:
+            return
+        try:
+            self._parser.Parse(data, final)
+        except expat.ExpatError as exc:
+            self._error(f"malformed XML: {exc}")
+            self._parser = None
+
+    def feed(self, data: bytes) -> None:
+        self._parse(data, False)
+
+    def close(self) -> None:
+        self._parse(b"", True)
+
+
+def get_validator(file_type: FileType, enabled: bool) -> Validator:
+    if not enabled:
+        return Validator()
+    if file_type == FileType.GPS_JSONL:
+        return JsonlValidator()
+    if file_type == FileType.GPS_GPX:
+        return GpxValidator()
+    return Validator()
+
+
+class SidecarWriter:
+    # Decodes, validates, hashes and writes one request body chunk at a time.
+    def __init__(self, path: Path, file_type: FileType, content_encoding: Optional[str], validate: bool):
+        self.decoder = get_decoder(content_encoding)
+        self.validator = get_validator(file_type, validate)
+        self.hasher = hashlib.sha256()
+        self.path = path
+        self._writer = ChunkWriter(path, 0, settings.metadata_max_bytes, settings.upload_buffer_bytes, self.hasher)
+
+    def _write(self, chunks: Iterator[bytes]) -> None:
+        for chunk in chunks:
+            self.validator.feed(chunk)
+            self._writer.write(chunk)
+
+    def write(self, data: bytes) -> None:
+        self._write(self.decoder.decode(data))
+
+    def close(self) -> tuple[str, int]:
+        self._write(self.decoder.finish())
+        self.validator.close()
+        self._writer.close()
+        return self.hasher.hexdigest(), self._writer.written
+
+    def abort(self) -> None:
+        self._writer.abort()
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,142 @@
+import datetime as dt
+import math
+import uuid
+from typing import Any, Optional
+
+import numpy as np
+from sqlalchemy import delete
+from sqlmodel import Session, and_, or_
+
+from ..config import settings
+from ..models import TrackCell
+from .stats import distance_m
+
+METERS_PER_DEGREE_LAT = 110_574.0
+METERS_PER_DEGREE_LON = 111_320.0
+
+
+def _columns() -> int:
+    return int(round(360.0 / settings.spatial_cell_degrees))
+
+
+def _rows() -> int:
+    return int(round(180.0 / settings.spatial_cell_degrees))
+
+
+def cell_x(lon: Any) -> Any:
+    cells = np.floor((np.asarray(lon) + 180.0) / settings.spatial_cell_degrees)
+    return np.clip(cells, 0, _columns() - 1).astype(np.int64)
+
+
+def cell_y(lat: Any) -> Any:
+    cells = np.floor((np.asarray(lat) + 90.0) / settings.spatial_cell_degrees)
+    return np.clip(cells, 0, _rows() - 1).astype(np.int64)
+
+
+def _to_datetime(seconds: float) -> dt.datetime:
+    return dt.datetime.fromtimestamp(float(seconds), dt.timezone.utc)
+
+
+def index_segment_track(
+    session: Session,
+    segment_id: uuid.UUID,
+    trip_id: uuid.UUID,
+    user_id: uuid.UUID,
+    track: np.ndarray,
+) -> int:
+    # One row per grid cell the track visits, with the first and last time and fix index it was there.
+    session.exec(delete(TrackCell).where(TrackCell.segment_id == segment_id))
+    if not len(track):
+        return 0
+    keys = cell_y(track["lat"]) * _columns() + cell_x(track["lon"])
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    ts = track["ts"][order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    first_seen = np.minimum.reduceat(ts, starts)
+    last_seen = np.maximum.reduceat(ts, starts)
+    # The stable sort keeps each cell's fixes in track order.
+    first_index = order[starts]
+    last_index = order[np.r_[starts[1:], len(order)] - 1]
+    for key, first, last, first_fix, last_fix in zip(
+        keys[starts].tolist(), first_seen.tolist(), last_seen.tolist(), first_index.tolist(), last_index.tolist()
+    ):
+        y, x = divmod(key, _columns())
+        session.add(
+            TrackCell(
+                segment_id=segment_id,
+                cell_x=x,
+                cell_y=y,
+                trip_id=trip_id,
+                user_id=user_id,
+                start_time_utc=_to_datetime(first),
+                end_time_utc=_to_datetime(last),
+                first_index=first_fix,
+                last_index=last_fix,
+            )
+        )
+    return len(starts)
+
+
+def _bbox_condition(min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> Any:
+    y_range = TrackCell.cell_y.between(int(cell_y(min_lat)), int(cell_y(max_lat)))
+    if min_lon <= max_lon:
+        return and_(y_range, TrackCell.cell_x.between(int(cell_x(min_lon)), int(cell_x(max_lon))))
+    # The box crosses the antimeridian.
+    return and_(
+        y_range,
+        or_(TrackCell.cell_x >= int(cell_x(min_lon)), TrackCell.cell_x <= int(cell_x(max_lon))),
+    )
+
+
+def area_condition(
+    bbox: Optional[tuple[float, float, float, float]] = None,
+    center: Optional[tuple[float, float]] = None,
+    radius_m: Optional[float] = None,
+) -> Any:
+    if bbox is not None:
+        return _bbox_condition(*bbox)
+    lat, lon = center
+    cell = settings.spatial_cell_degrees
+    lon_scale = METERS_PER_DEGREE_LON * max(math.cos(math.radians(lat)), 1e-6)
+    dlat = radius_m / METERS_PER_DEGREE_LAT
+    dlon = min(radius_m / lon_scale, 180.0)
+    prefilter = _bbox_condition(
+        max(lat - dlat, -90.0),
+        (lon - dlon + 180.0) % 360.0 - 180.0 if dlon < 180.0 else -180.0,
+        min(lat + dlat, 90.0),
+        (lon + dlon + 180.0) % 360.0 - 180.0 if dlon < 180.0 else 180.0,
+    )
+    # Equirectangular distance from the circle's centre to each cell centre,
+    # widened by half a cell diagonal so partially covered cells still match.
+    dx = ((TrackCell.cell_x + 0.5) * cell - 180.0 - lon) * lon_scale
+    dy = ((TrackCell.cell_y + 0.5) * cell - 90.0 - lat) * METERS_PER_DEGREE_LAT
+    reach = radius_m + 0.5 * cell * math.hypot(lon_scale, METERS_PER_DEGREE_LAT)
+    return and_(prefilter, dx * dx + dy * dy <= reach * reach)
+
+
+def fixes_in_cells(track: np.ndarray, cells: list[tuple[int, int, Optional[int], Optional[int]]]) -> np.ndarray:
+    # Indices of the fixes inside the given (cell_x, cell_y, first_index, last_index) cells. Only each cell's
+    # index range is read; cells indexed before the ranges were stored fall back to the whole track.
+    if any(first is None or last is None for _, _, first, last in cells):
+        span = np.arange(len(track))
+    else:
+        span = np.unique(np.concatenate([np.arange(first, min(last + 1, len(track))) for _, _, first, last in cells]))
+    keys = cell_y(track["lat"][span]) * _columns() + cell_x(track["lon"][span])
+    return span[np.isin(keys, [y * _columns() + x for x, y, _, _ in cells])]
+
+
+def area_mask(
+    track: np.ndarray,
+    bbox: Optional[tuple[float, float, float, float]] = None,
+    center: Optional[tuple[float, float]] = None,
+    radius_m: Optional[float] = None,
+) -> np.ndarray:
+    # The exact test behind area_condition, which only matches whole grid cells.
+    lat = track["lat"]
+    lon = track["lon"]
+    if bbox is not None:
+        min_lat, min_lon, max_lat, max_lon = bbox
+        in_lon = (lon >= min_lon) & (lon <= max_lon) if min_lon <= max_lon else (lon >= min_lon) | (lon <= max_lon)
+        return (lat >= min_lat) & (lat <= max_lat) & in_lon
+    return distance_m(lat, lon, np.full(len(track), center[0]), np.full(len(track), center[1])) <= radius_m
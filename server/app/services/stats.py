@@ -0,0 +1,192 @@
+import datetime as dt
+import uuid
+from typing import Any
+
+import numpy as np
+from sqlmodel import Session, func, select
+
+from ..config import settings
+from ..models import LocationTrack, Segment, Trip
+
+EARTH_RADIUS_M = 6_371_008.8
+PLAY_BLOCK = 64
+
+
+def distance_m(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dlambda = np.radians(lon2) - np.radians(lon1)
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_m(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    # Distances between consecutive fixes, one element shorter than the input.
+    return distance_m(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
+
+def window_speed(fixes: np.ndarray, window_s: float) -> np.ndarray:
+    # Net displacement across a time window around each step. Position jitter around a fixed point cancels out
+    # over the window instead of adding up step by step.
+    ts = fixes["ts"]
+    low = np.searchsorted(ts, ts[:-1] - window_s / 2, "left")
+    high = np.searchsorted(ts, ts[1:] + window_s / 2, "right") - 1
+    span = ts[high] - ts[low]
+    moved = distance_m(fixes["lat"][low], fixes["lon"][low], fixes["lat"][high], fixes["lon"][high])
+    return np.divide(moved, span, out=np.zeros_like(moved), where=span > 0)
+
+
+def compute_track_stats(track: np.ndarray) -> dict[str, Any]:
+    stats: dict[str, Any] = {
+        "distance_m": 0.0,
+        "moving_time_s": 0.0,
+        "max_speed_mps": None,
+        "avg_speed_mps": None,
+        "elevation_gain_m": 0.0,
+    }
+    accuracy = track["acc"]
+    valid = np.isnan(accuracy) | (accuracy <= settings.gps_max_accuracy_m)
+    fixes = track[valid]
+    if len(fixes) < 2:
+        return stats
+    steps = haversine_m(fixes["lat"], fixes["lon"])
+    elapsed = np.diff(fixes["ts"])
+    # Steps across a recording gap or implying an implausible speed are dropped.
+    usable = (elapsed > 0) & (elapsed <= settings.gps_gap_seconds)
+    computed_speed = np.divide(steps, elapsed, out=np.zeros_like(steps), where=elapsed > 0)
+    usable &= computed_speed <= settings.gps_max_speed_mps
+    reported = fixes["spd"][1:].astype(np.float64)
+    speed = np.where(
+        np.isfinite(reported) & (reported >= 0), reported, window_speed(fixes, settings.gps_smoothing_window_seconds)
+    )
+    moving = usable & (speed >= settings.gps_moving_speed_mps)
+    # Reported speeds get the same plausibility cap as the computed ones before they can set the maximum.
+    plausible = moving & (speed <= settings.gps_max_speed_mps)
+    # Only moving steps count towards distance, or position jitter while parked adds up to kilometres.
+    distance = float(steps[moving].sum())
+    moving_time = float(elapsed[moving].sum())
+    stats.update(
+        distance_m=distance,
+        moving_time_s=moving_time,
+        max_speed_mps=float(speed[plausible].max()) if plausible.any() else None,
+        avg_speed_mps=distance / moving_time if moving_time > 0 else None,
+        elevation_gain_m=elevation_gain(
+            smooth(fixes["ts"], fixes["alt"].astype(np.float64), settings.gps_smoothing_window_seconds),
+            usable,
+            settings.gps_climb_threshold_m,
+        ),
+    )
+    return stats
+
+
+def smooth(ts: np.ndarray, values: np.ndarray, window_s: float) -> np.ndarray:
+    # Centred moving average over a time window, so it adapts to the sample rate; missing values are skipped.
+    # The window narrows towards both ends so it stays centred, and a steady climb keeps its first and last value.
+    finite = np.isfinite(values)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(finite, values, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(finite)))
+    half = np.minimum(window_s / 2, np.minimum(ts - ts[0], ts[-1] - ts))
+    low = np.searchsorted(ts, ts - half, "left")
+    high = np.searchsorted(ts, ts + half, "right")
+    averaged = (sums[high] - sums[low]) / np.maximum(counts[high] - counts[low], 1)
+    return np.where(finite, averaged, np.nan)
+
+
+def _compose_clamps(low: np.ndarray, high: np.ndarray) -> None:
+    # In place along the last axis: element i becomes the composition of clamps 0..i, by doubling in log2 passes.
+    step = 1
+    while step < low.shape[-1]:
+        composed_low = np.minimum(np.maximum(low[..., :-step], low[..., step:]), high[..., step:])
+        composed_high = np.minimum(np.maximum(high[..., :-step], low[..., step:]), high[..., step:])
+        low[..., step:] = composed_low
+        high[..., step:] = composed_high
+        step *= 2
+
+
+def _play_trace(values: np.ndarray, restart: np.ndarray, half: float) -> np.ndarray:
+    # Follows the values with a play of +-half: y = clip(y_prev, x - half, x + half), reset to x at each restart,
+    # so it only turns once the values have moved 2 * half back from an extreme. Every step is a clamp and clamps
+    # compose into clamps, so the prefixes are built within blocks of PLAY_BLOCK and then across the blocks.
+    padding = -len(values) % PLAY_BLOCK
+    low = np.r_[np.where(restart, values, values - half), np.full(padding, -np.inf)].reshape(-1, PLAY_BLOCK)
+    high = np.r_[np.where(restart, values, values + half), np.full(padding, np.inf)].reshape(-1, PLAY_BLOCK)
+    _compose_clamps(low, high)
+    # The first value is a restart, so every prefix from it is constant: the trace at each block's end.
+    block_end = low[:, -1].copy()
+    _compose_clamps(block_end, high[:, -1].copy())
+    carry = np.r_[block_end[:1], block_end[:-1]]
+    return np.minimum(np.maximum(carry[:, None], low), high).ravel()[: len(values)]
+
+
+def elevation_gain(altitude: np.ndarray, usable: np.ndarray, threshold: float) -> float:
+    # Sums the climbs between turning points of the altitude. A peak or valley only becomes a turning point once
+    # the altitude has moved threshold away from it, so GPS noise smaller than that adds nothing. Unusable steps
+    # start a new stretch from the next fix, and missing altitudes are skipped.
+    finite = np.isfinite(altitude)
+    values = altitude[finite]
+    if len(values) < 2:
+        return 0.0
+    restart = np.r_[True, ~usable][finite]
+    restart[0] = True
+    # Between a stretch's start and its local extremes the altitude only rises or only falls, and then only the
+    # extreme can move the trace, so everything else is dropped before building it.
+    distinct = restart | np.r_[True, np.diff(values) != 0]
+    values, restart = values[distinct], restart[distinct]
+    if len(values) < 2:
+        return 0.0
+    rising = np.diff(values) > 0
+    kept = restart | np.r_[restart[1:], True] | np.r_[False, rising[1:] != rising[:-1], False]
+    values, restart = values[kept], restart[kept]
+    trace = _play_trace(values, restart, threshold / 2)
+    direction = np.sign(np.diff(trace))
+    direction[restart[1:]] = 0
+    moves = np.flatnonzero(direction)
+    if not len(moves):
+        return 0.0
+    # The last move of each leg of the trace marks an extreme of the altitude.
+    stretch = np.cumsum(restart)
+    leg_ends = np.r_[
+        (direction[moves[1:]] != direction[moves[:-1]]) | (stretch[moves[1:]] != stretch[moves[:-1]]), True
+    ]
+    ends = moves[leg_ends] + 1
+    end_stretch = stretch[ends]
+    extreme = values[ends]
+    origin = values[np.flatnonzero(restart)][end_stretch - 1]
+    # Extremes are counted from the first one that lies threshold away from the start of its stretch; every later
+    # one does by construction.
+    order = np.arange(len(ends))
+    first_in_stretch = np.searchsorted(end_stretch, end_stretch, "left")
+    counted = np.maximum.accumulate(np.where(np.abs(extreme - origin) >= threshold, order, -1)) >= first_in_stretch
+    follows = np.r_[False, counted[:-1]] & (first_in_stretch < order)
+    previous = np.where(follows, np.r_[0.0, extreme[:-1]], origin)
+    return float(np.maximum(extreme - previous, 0.0)[counted].sum())
+
+
+def refresh_trip_stats(session: Session, trip_id: uuid.UUID) -> None:
+    # Re-aggregates the already computed per-segment rows; no samples are read.
+    statement = (
+        select(
+            func.count(LocationTrack.segment_id),
+            func.sum(LocationTrack.distance_m),
+            func.sum(LocationTrack.moving_time_s),
+            func.max(LocationTrack.max_speed_mps),
+            func.sum(LocationTrack.elevation_gain_m),
+            func.min(LocationTrack.start_time_utc),
+            func.max(LocationTrack.end_time_utc),
+        )
+        .join(Segment, Segment.id == LocationTrack.segment_id)
+        .where(Segment.trip_id == trip_id)
+    )
+    count, distance, moving_time, max_speed, gain, start, end = session.exec(statement).one()
+    trip = session.get(Trip, trip_id)
+    if trip is None or not count:
+        return
+    trip.distance_m = distance or 0.0
+    trip.moving_time_s = moving_time or 0.0
+    trip.max_speed_mps = max_speed
+    trip.avg_speed_mps = trip.distance_m / trip.moving_time_s if trip.moving_time_s else None
+    trip.elevation_gain_m = gain or 0.0
+    if start is not None and end is not None:
+        trip.duration_s = int(round((end - start).total_seconds()))
+    trip.stats_updated_at = dt.datetime.now(dt.timezone.utc)
+    session.add(trip)
@@ -1,37 +1,527 @@
+import asyncio
+import datetime as dt
+import functools
 import hashlib
+import os
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple
+from typing import BinaryIO, Callable, Optional, TypeVar
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
 
 from ..config import settings
+from ..models import FileType, ReleasedBlob, StoredFile
+from .hashing import ResumableSha256, resumable
+from .monitoring import SHA256_SECONDS, STORAGE_WRITE_SECONDS
+from .usage import adjust_usage
+
+T = TypeVar("T")
+# (upload_id, storage handle, length) of a finished partial upload, in assembly order.
+StagedPart = tuple[str, Optional[str], int]
+
+BLOB_PREFIX = "blobs"
+STAGED_PREFIX = "uploads"
+
+_io_executor = ThreadPoolExecutor(max_workers=settings.io_threads, thread_name_prefix="storage-io")
+
+
+async def run_io(func: Callable[..., T], *args, **kwargs) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_executor, functools.partial(func, *args, **kwargs))
+
+
+def get_temp_path() -> Path:
+    return settings.storage_dir / "tmp" / uuid.uuid4().hex
 
 
 def get_upload_path(upload_id: str) -> Path:
     return settings.storage_dir / "uploads" / upload_id
 
 
+def get_journal_path(upload_id: str) -> Path:
+    return settings.storage_dir / "uploads" / f"{upload_id}.journal"
+
+
 def ensure_parent(path: Path) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
 
 
-def write_chunk(path: Path, data: bytes, offset: int) -> int:
+class ChunkTooLarge(ValueError):
+    pass
+
+
+class ChunkTooSmall(ValueError):
+    pass
+
+
+class ChunkSink:
+    def __init__(self, limit: int, buffer_size: int, hasher: Optional[ResumableSha256] = None):
+        self._buffer = bytearray()
+        self._buffer_size = max(buffer_size, 1)
+        self._hasher = hasher
+        self.limit = limit
+        self.received = 0
+        self.written = 0
+
+    def _append(self, data: bytes) -> bool:
+        if self.received + len(self._buffer) + len(data) > self.limit:
+            raise ChunkTooLarge("Chunk exceeds upload length")
+        self._buffer += data
+        return len(self._buffer) >= self._buffer_size
+
+    def write(self, data: bytes) -> None:
+        if self._append(data):
+            self.flush()
+
+    async def awrite(self, data: bytes) -> None:
+        if self._append(data):
+            await run_io(self.flush)
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        with STORAGE_WRITE_SECONDS.time():
+            self._write_buffer()
+        if self._hasher is not None:
+            with SHA256_SECONDS.time("stream"):
+                self._hasher.update(self._buffer)
+        self.received += len(self._buffer)
+        self._buffer.clear()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+            self._commit()
+        finally:
+            self._release()
+
+    def abort(self) -> None:
+        self._buffer.clear()
+        self._release()
+
+    async def aclose(self) -> None:
+        await run_io(self.close)
+
+    def _write_buffer(self) -> None:
+        raise NotImplementedError
+
+    def _commit(self) -> None:
+        raise NotImplementedError
+
+    def _release(self) -> None:
+        pass
+
+
+class ChunkWriter(ChunkSink):
+    def __init__(
+        self,
+        path: Path,
+        offset: int,
+        limit: int,
+        buffer_size: int,
+        hasher: Optional[ResumableSha256] = None,
+        durable: bool = False,
+    ):
+        super().__init__(limit, buffer_size, hasher)
+        ensure_parent(path)
+        self._fp = path.open("r+b" if path.exists() else "wb", buffering=0)
+        self._fp.truncate(offset)
+        self._fp.seek(offset)
+        self._durable = durable
+
+    def _write_buffer(self) -> None:
+        pending = len(self._buffer)
+        with memoryview(self._buffer) as view:
+            done = 0
+            while done < pending:
+                done += self._fp.write(view[done:])
+
+    def _commit(self) -> None:
+        if self._durable and self.received:
+            os.fsync(self._fp.fileno())
+        self.written = self.received
+
+    def _release(self) -> None:
+        self._fp.close()
+
+
+def append_journal(upload_id: str, offset: int, state: Optional[bytes]) -> None:
+    path = get_journal_path(upload_id)
     ensure_parent(path)
-    with path.open("r+b" if path.exists() else "wb") as fp:
-        fp.seek(offset)
-        fp.write(data)
-    return len(data)
+    record = f"{offset} {state.hex() if state is not None else '-'}\n".encode()
+    with path.open("a+b") as fp:
+        if fp.seek(0, os.SEEK_END):
+            fp.seek(-1, os.SEEK_END)
+            if fp.read(1) != b"\n":
+                record = b"\n" + record
+        fp.write(record)
+        fp.flush()
+        os.fsync(fp.fileno())
+
+
+def read_journal(upload_id: str) -> Optional[tuple[int, Optional[bytes]]]:
+    path = get_journal_path(upload_id)
+    try:
+        lines = path.read_bytes().split(b"\n")
+    except FileNotFoundError:
+        return None
+    # The last element is either empty or a record torn by a crash mid-append.
+    for line in reversed(lines[:-1]):
+        try:
+            offset, state = line.decode().split(" ")
+            return int(offset), None if state == "-" else bytes.fromhex(state)
+        except ValueError:
+            continue
+    return None
+
+
+def discard_journal(upload_id: str) -> None:
+    get_journal_path(upload_id).unlink(missing_ok=True)
+
+
+def copy_range(source: BinaryIO, dest: BinaryIO, size: int) -> None:
+    # copy_file_range keeps the bytes in the kernel, and XFS/btrfs can share the extents instead of copying.
+    remaining = size
+    if hasattr(os, "copy_file_range"):
+        try:
+            while remaining:
+                copied = os.copy_file_range(source.fileno(), dest.fileno(), remaining)
+                if not copied:
+                    break
+                remaining -= copied
+        except OSError:
+            pass
+    while remaining:
+        chunk = source.read(min(remaining, settings.upload_buffer_bytes))
+        if not chunk:
+            raise ValueError("Partial upload is shorter than its length")
+        dest.write(chunk)
+        remaining -= len(chunk)
 
 
 def compute_sha256(path: Path) -> str:
-    digest = hashlib.sha256()
     with path.open("rb") as fp:
+        return read_sha256(fp)
+
+
+def resume_sha256(
+    open_prefix: Callable[[], BinaryIO], offset: int, state: Optional[bytes]
+) -> Optional[ResumableSha256]:
+    if state is not None:
+        try:
+            hasher = ResumableSha256(state)
+        except ValueError:
+            hasher = None
+        if hasher is not None and hasher.length == offset:
+            return hasher
+    hasher = ResumableSha256()
+    if not offset:
+        return hasher
+    if not resumable():
+        # Without libcrypto no state was saved, and reading the prefix back on every PATCH would make a chunked
+        # upload quadratic; the digest is computed once, when the upload completes (see read_sha256).
+        return None
+    # Only reached when saved state is missing or corrupt: the prefix is read once and the state saved again.
+    remaining = offset
+    with SHA256_SECONDS.time("resume"), open_prefix() as fp:
+        while remaining:
+            chunk = fp.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                raise ValueError("Upload is shorter than its offset")
+            hasher.update(chunk)
+            remaining -= len(chunk)
+    return hasher
+
+
+def read_sha256(fp: BinaryIO) -> str:
+    digest = hashlib.sha256()
+    with SHA256_SECONDS.time("file"):
         for chunk in iter(lambda: fp.read(1024 * 1024), b""):
             digest.update(chunk)
     return digest.hexdigest()
 
 
-def finalize_upload(path: Path, dest: Path) -> Tuple[str, int]:
-    ensure_parent(dest)
-    path.replace(dest)
-    size = dest.stat().st_size
-    sha = compute_sha256(dest)
-    return sha, size
+def blob_uri(sha256: str) -> str:
+    return f"{BLOB_PREFIX}/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def staged_uri(upload_id: str) -> str:
+    return f"{STAGED_PREFIX}/{upload_id}"
+
+
+def store_blob(path: Path, sha256: str) -> tuple[str, int]:
+    uri = blob_uri(sha256)
+    dest = settings.storage_dir / uri
+    try:
+        # A dedupe hit restarts the orphan sweep's grace period for the blob it is about to reference.
+        os.utime(dest)
+    except FileNotFoundError:
+        ensure_parent(dest)
+        path.replace(dest)
+    else:
+        path.unlink(missing_ok=True)
+    return uri, dest.stat().st_size
+
+
+def attach_blob(
+    session: Session,
+    segment_id: uuid.UUID,
+    file_type: FileType,
+    uri: str,
+    sha256: str,
+    size: int,
+    filename: Optional[str] = None,
+) -> StoredFile:
+    statement = select(StoredFile).where(
+        StoredFile.segment_id == segment_id,
+        StoredFile.type == file_type,
+        StoredFile.storage_uri == uri,
+    )
+    stored_file = session.exec(statement).first()
+    if stored_file is None:
+        stored_file = StoredFile(
+            segment_id=segment_id,
+            type=file_type,
+            storage_uri=uri,
+            sha256=sha256,
+            bytes=size,
+            filename=filename,
+        )
+        session.add(stored_file)
+        adjust_usage(session, segment_id, size, 1)
+    return stored_file
+
+
+def claim_blob(session: Session, uri: str) -> None:
+    # Runs in the transaction that attaches the blob, before the blob is stored: deleting the release marker waits
+    # for a sweep that is deleting the same blob (so the blob is stored afresh) and stops any later one.
+    session.exec(delete(ReleasedBlob).where(ReleasedBlob.storage_uri == uri))
+
+
+def store_and_attach(
+    session: Session,
+    segment_id: uuid.UUID,
+    file_type: FileType,
+    path: Path,
+    sha256: str,
+    filename: Optional[str] = None,
+) -> StoredFile:
+    claim_blob(session, blob_uri(sha256))
+    uri, size = get_storage().store_file(path, sha256)
+    return attach_blob(session, segment_id, file_type, uri, sha256, size, filename)
+
+
+def commit_staged_file(session: Session, stored_file: StoredFile) -> StoredFile:
+    # Moves a verified staged upload into the blob store. If the segment already has this blob attached as the
+    # same type, that row is kept and the staged one is dropped, as attach_blob would have done.
+    upload_id = stored_file.storage_uri.removeprefix(f"{STAGED_PREFIX}/")
+    claim_blob(session, blob_uri(stored_file.sha256))
+    uri, size = get_storage().commit_staged(upload_id, stored_file.sha256, stored_file.bytes)
+    statement = select(StoredFile).where(
+        StoredFile.segment_id == stored_file.segment_id,
+        StoredFile.type == stored_file.type,
+        StoredFile.storage_uri == uri,
+    )
+    existing = session.exec(statement).first()
+    if existing is not None:
+        adjust_usage(session, stored_file.segment_id, -stored_file.bytes, -1)
+        session.delete(stored_file)
+        session.commit()
+        return existing
+    stored_file.storage_uri = uri
+    stored_file.bytes = size
+    session.add(stored_file)
+    session.commit()
+    return stored_file
+
+
+def _mark_released(session: Session, uri: str) -> None:
+    now = dt.datetime.now(dt.timezone.utc)
+    refreshed = session.exec(update(ReleasedBlob).where(ReleasedBlob.storage_uri == uri).values(released_at=now))
+    if not refreshed.rowcount:
+        session.add(ReleasedBlob(storage_uri=uri, released_at=now))
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+
+
+def release_stored_file(session: Session, stored_file: StoredFile) -> None:
+    # The blob is not deleted here: a concurrent upload of the same content may be attaching it right now.
+    # The sweeper deletes it once it has stayed unreferenced for the grace period.
+    uri = stored_file.storage_uri
+    _mark_released(session, uri)
+    adjust_usage(session, stored_file.segment_id, -stored_file.bytes, -1)
+    session.delete(stored_file)
+    session.commit()
+
+
+def migrate_to_cas(session: Session) -> int:
+    migrated = 0
+    # Staged uploads waiting for their checksum job are promoted by that job, never here.
+    statement = select(StoredFile).where(
+        StoredFile.storage_uri.not_like(f"{BLOB_PREFIX}/%"), StoredFile.storage_uri.not_like(f"{STAGED_PREFIX}/%")
+    )
+    legacy = session.exec(statement).all()
+    for stored_file in legacy:
+        path = settings.storage_dir / stored_file.storage_uri
+        if path.exists():
+            sha = stored_file.sha256 or compute_sha256(path)
+            claim_blob(session, blob_uri(sha))
+            uri, _ = store_blob(path, sha)
+        elif stored_file.sha256 and (settings.storage_dir / blob_uri(stored_file.sha256)).exists():
+            sha, uri = stored_file.sha256, blob_uri(stored_file.sha256)
+        else:
+            continue
+        if stored_file.filename is None:
+            stored_file.filename = Path(stored_file.storage_uri).name
+        stored_file.storage_uri = uri
+        stored_file.sha256 = sha
+        session.add(stored_file)
+        session.commit()
+        migrated += 1
+        try:
+            path.parent.rmdir()
+        except OSError:
+            pass
+    return migrated
+
+
+class StorageBackend(ABC):
+    name: str
+    # Whether open_upload can read an upload that has not been completed or sealed yet.
+    reads_open_uploads = True
+
+    def begin_upload(self, upload_id: str, sha256: Optional[str] = None) -> Optional[str]:
+        return None
+
+    @abstractmethod
+    def open_chunk(
+        self,
+        upload_id: str,
+        handle: Optional[str],
+        offset: int,
+        limit: int,
+        total: int,
+        hasher: Optional[ResumableSha256] = None,
+    ) -> ChunkSink: ...
+
+    @abstractmethod
+    def open_upload(self, upload_id: str, handle: Optional[str]) -> BinaryIO: ...
+
+    @abstractmethod
+    def commit_upload(self, upload_id: str, handle: Optional[str], sha256: str, size: int) -> tuple[str, int]: ...
+
+    @abstractmethod
+    def abort_upload(self, upload_id: str, handle: Optional[str]) -> None: ...
+
+    @abstractmethod
+    def commit_staged(self, upload_id: str, sha256: str, size: int) -> tuple[str, int]: ...
+
+    def seal_upload(self, upload_id: str, handle: Optional[str], size: int) -> None:
+        pass
+
+    @abstractmethod
+    def concat_uploads(self, upload_id: str, handle: Optional[str], parts: list[StagedPart]) -> None: ...
+
+    @abstractmethod
+    def store_file(self, path: Path, sha256: str) -> tuple[str, int]: ...
+
+    @abstractmethod
+    def open(self, uri: str) -> BinaryIO: ...
+
+    @abstractmethod
+    def exists(self, uri: str) -> bool: ...
+
+    @abstractmethod
+    def delete(self, uri: str) -> None: ...
+
+    def local_path(self, uri: str) -> Optional[Path]:
+        return None
+
+    def presign(self, uri: str, expires_in: int, filename: Optional[str] = None) -> Optional[str]:
+        return None
+
+
+class FilesystemStorage(StorageBackend):
+    name = "filesystem"
+
+    def open_chunk(
+        self,
+        upload_id: str,
+        handle: Optional[str],
+        offset: int,
+        limit: int,
+        total: int,
+        hasher: Optional[ResumableSha256] = None,
+    ) -> ChunkSink:
+        return ChunkWriter(
+            get_upload_path(upload_id),
+            offset,
+            limit=limit,
+            buffer_size=settings.upload_buffer_bytes,
+            hasher=hasher,
+            durable=settings.upload_durable_offsets,
+        )
+
+    def open_upload(self, upload_id: str, handle: Optional[str]) -> BinaryIO:
+        return get_upload_path(upload_id).open("rb")
+
+    def commit_upload(self, upload_id: str, handle: Optional[str], sha256: str, size: int) -> tuple[str, int]:
+        return self.commit_staged(upload_id, sha256, size)
+
+    def commit_staged(self, upload_id: str, sha256: str, size: int) -> tuple[str, int]:
+        return store_blob(get_upload_path(upload_id), sha256)
+
+    def abort_upload(self, upload_id: str, handle: Optional[str]) -> None:
+        get_upload_path(upload_id).unlink(missing_ok=True)
+
+    def concat_uploads(self, upload_id: str, handle: Optional[str], parts: list[StagedPart]) -> None:
+        # The parts are only read, so they stay intact until the final upload has committed.
+        with get_upload_path(upload_id).open("wb", buffering=0) as out:
+            for part_id, _, size in parts:
+                with get_upload_path(part_id).open("rb", buffering=0) as source:
+                    copy_range(source, out, size)
+            if settings.upload_durable_offsets:
+                os.fsync(out.fileno())
+
+    def store_file(self, path: Path, sha256: str) -> tuple[str, int]:
+        return store_blob(path, sha256)
+
+    def open(self, uri: str) -> BinaryIO:
+        return (settings.storage_dir / uri).open("rb")
+
+    def exists(self, uri: str) -> bool:
+        return (settings.storage_dir / uri).exists()
+
+    def delete(self, uri: str) -> None:
+        (settings.storage_dir / uri).unlink(missing_ok=True)
+
+    def local_path(self, uri: str) -> Optional[Path]:
+        return settings.storage_dir / uri
+
+
+_storage: Optional[StorageBackend] = None
+
+
+def get_storage() -> StorageBackend:
+    global _storage
+    if _storage is None:
+        if settings.storage_backend == "s3":
+            from .s3 import S3Storage
+
+            _storage = S3Storage.from_settings()
+        elif settings.storage_backend == "filesystem":
+            _storage = FilesystemStorage()
+        else:
+            raise ValueError(f"Unknown storage backend: {settings.storage_backend}")
+    return _storage
+
+
+def reset_storage(backend: Optional[StorageBackend] = None) -> None:
+    global _storage
+    _storage = backend
@@ -0,0 +1,253 @@
+import asyncio
+import datetime as dt
+import logging
+import os
+import shutil
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+from sqlalchemy import delete, exists, update
+from sqlmodel import Session, and_, or_, select
+
+from .. import database
+from ..config import settings
+from ..models import ReleasedBlob, StoredFile, UploadBatch, UploadBatchStatus, UploadConcat, UploadSession, UploadStatus
+from .monitoring import SWEEPER_RECLAIMED_BYTES
+from .storage import BLOB_PREFIX, STAGED_PREFIX, discard_journal, get_journal_path, get_storage, get_upload_path, run_io
+from .usage import reconcile_usage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SweepReport:
+    dry_run: bool = False
+    expired_uploads: int = 0
+    expired_bytes: int = 0
+    orphan_files: int = 0
+    orphan_bytes: int = 0
+    released_blobs: int = 0
+    missing_blobs: list[str] = field(default_factory=list)
+    users: int = 0
+
+
+def _as_utc(value: dt.datetime) -> dt.datetime:
+    return value if value.tzinfo else value.replace(tzinfo=dt.timezone.utc)
+
+
+def _stat(path: Path) -> Optional[tuple[float, int]]:
+    try:
+        info = path.stat()
+    except FileNotFoundError:
+        return None
+    return info.st_mtime, info.st_size
+
+
+def _holds_staged_bytes() -> Any:
+    # Unfinished uploads, plus finished partial uploads that no final upload has consumed yet.
+    return or_(
+        UploadSession.status != UploadStatus.COMPLETE,
+        and_(UploadSession.concat == UploadConcat.PARTIAL, UploadSession.final_id.is_(None)),
+    )
+
+
+def _last_activity(upload: UploadSession) -> dt.datetime:
+    # Between checkpoints only the journal and the staged file are touched, not the row.
+    latest = _as_utc(upload.updated_at)
+    for path in (get_journal_path(str(upload.id)), get_upload_path(str(upload.id))):
+        info = _stat(path)
+        if info is not None:
+            latest = max(latest, dt.datetime.fromtimestamp(info[0], dt.timezone.utc))
+    return latest
+
+
+def _staged_bytes(upload: UploadSession) -> int:
+    staged = _stat(get_upload_path(str(upload.id)))
+    journal = _stat(get_journal_path(str(upload.id)))
+    # S3 parts are not on local disk; the checkpointed offset is the best estimate of what they hold.
+    return (staged[1] if staged else upload.offset) + (journal[1] if journal else 0)
+
+
+def expire_uploads(session: Session, now: dt.datetime, report: SweepReport) -> None:
+    cutoff = now - dt.timedelta(seconds=settings.upload_expiry_seconds)
+    statement = select(UploadSession).where(_holds_staged_bytes(), UploadSession.updated_at < cutoff)
+    storage = get_storage()
+    for upload in session.exec(statement).all():
+        if _last_activity(upload) >= cutoff:
+            continue
+        size = _staged_bytes(upload)
+        report.expired_uploads += 1
+        report.expired_bytes += size
+        if report.dry_run:
+            continue
+        storage.abort_upload(str(upload.id), upload.storage_handle)
+        discard_journal(str(upload.id))
+        if upload.batch_id is not None:
+            session.exec(
+                update(UploadBatch)
+                .where(UploadBatch.id == upload.batch_id, UploadBatch.status == UploadBatchStatus.OPEN)
+                .values(status=UploadBatchStatus.FAILED, updated_at=now)
+            )
+        session.exec(
+            update(UploadSession)
+            .where(UploadSession.final_id == upload.id)
+            .values(final_id=None)
+            .execution_options(synchronize_session=False)
+        )
+        session.delete(upload)
+        session.commit()
+        SWEEPER_RECLAIMED_BYTES.inc(size, "expired_upload")
+
+
+def purge_released_blobs(session: Session, now: dt.datetime, report: SweepReport) -> None:
+    cutoff = now - dt.timedelta(seconds=settings.orphan_grace_seconds)
+    storage = get_storage()
+    released = session.exec(select(ReleasedBlob.storage_uri).where(ReleasedBlob.released_at < cutoff)).all()
+    for uri in released:
+        referenced = exists().where(StoredFile.storage_uri == uri)
+        if report.dry_run:
+            if not session.exec(select(referenced)).one():
+                report.released_blobs += 1
+            continue
+        # The marker stays locked until the blob is gone and this transaction commits, so an upload claiming the
+        # same blob meanwhile waits for it and then stores the content afresh (see claim_blob).
+        purged = session.exec(
+            delete(ReleasedBlob).where(ReleasedBlob.storage_uri == uri, ReleasedBlob.released_at < cutoff, ~referenced)
+        )
+        if not purged.rowcount:
+            # Referenced again since it was released.
+            session.exec(delete(ReleasedBlob).where(ReleasedBlob.storage_uri == uri, ReleasedBlob.released_at < cutoff))
+            session.commit()
+            continue
+        local = storage.local_path(uri)
+        info = _stat(local) if local is not None else None
+        try:
+            storage.delete(uri)
+        except Exception:
+            session.rollback()
+            logger.exception("Could not delete released blob %s", uri)
+            continue
+        session.commit()
+        report.released_blobs += 1
+        if info is not None:
+            SWEEPER_RECLAIMED_BYTES.inc(info[1], "released_blob")
+
+
+def _tree_size(path: Path) -> int:
+    size = 0
+    # os.walk skips directories that vanish mid-walk; files can vanish between listing and stat.
+    for root, _, files in os.walk(path):
+        for name in files:
+            info = _stat(Path(root) / name)
+            size += info[1] if info is not None else 0
+    return size
+
+
+def _remove(path: Path, report: SweepReport) -> None:
+    if path.is_dir():
+        size = _tree_size(path)
+        if not report.dry_run:
+            shutil.rmtree(path, ignore_errors=True)
+    else:
+        info = _stat(path)
+        if info is None:
+            return
+        size = info[1]
+        if not report.dry_run:
+            path.unlink(missing_ok=True)
+    report.orphan_files += 1
+    report.orphan_bytes += size
+    if not report.dry_run:
+        SWEEPER_RECLAIMED_BYTES.inc(size, "orphan")
+
+
+def _is_stale(path: Path, cutoff: float) -> bool:
+    # Uploads, jobs and requests create and delete files here concurrently; one that is gone is not an orphan.
+    info = _stat(path)
+    return info is not None and info[0] < cutoff
+
+
+def sweep_orphans(session: Session, now: dt.datetime, report: SweepReport) -> None:
+    # Anything younger than the grace period may belong to a request that has not committed its row yet.
+    cutoff = (now - dt.timedelta(seconds=settings.orphan_grace_seconds)).timestamp()
+    statement = select(UploadSession.id).where(_holds_staged_bytes())
+    live = {str(upload_id) for upload_id in session.exec(statement)}
+    # Final uploads waiting for their checksum job are referenced from their staging path.
+    staged = select(StoredFile.storage_uri).where(StoredFile.storage_uri.like(f"{STAGED_PREFIX}/%"))
+    live.update(uri.removeprefix(f"{STAGED_PREFIX}/") for uri in session.exec(staged))
+    uploads_dir = settings.storage_dir / "uploads"
+    if uploads_dir.is_dir():
+        for path in uploads_dir.iterdir():
+            if path.name.removesuffix(".journal") not in live and _is_stale(path, cutoff):
+                _remove(path, report)
+    tmp_dir = settings.storage_dir / "tmp"
+    if tmp_dir.is_dir():
+        for path in tmp_dir.iterdir():
+            if _is_stale(path, cutoff):
+                _remove(path, report)
+    # Blobs are only walked on the filesystem backend; S3 buckets should use lifecycle rules instead.
+    if get_storage().name != "filesystem":
+        return
+    referenced = set(session.exec(select(StoredFile.storage_uri).distinct()))
+    # Released blobs are left to purge_released_blobs, which deletes them under the marker's lock.
+    released = set(session.exec(select(ReleasedBlob.storage_uri)))
+    found = set()
+    blobs_dir = settings.storage_dir / BLOB_PREFIX
+    if blobs_dir.is_dir():
+        for root, _, files in os.walk(blobs_dir):
+            for name in files:
+                path = Path(root) / name
+                uri = path.relative_to(settings.storage_dir).as_posix()
+                found.add(uri)
+                if uri in referenced or uri in released:
+                    continue
+                # The snapshot above may predate an upload that deduplicated onto this blob: check its references
+                # again, then its mtime, which store_blob refreshes on every dedupe hit.
+                if session.exec(select(StoredFile.id).where(StoredFile.storage_uri == uri).limit(1)).first():
+                    continue
+                if _is_stale(path, cutoff):
+                    _remove(path, report)
+    # Rows whose blob is gone are reported, never deleted: that is data loss an operator has to look at.
+    report.missing_blobs = sorted(uri for uri in referenced if uri.startswith(f"{BLOB_PREFIX}/") and uri not in found)
+
+
+def sweep(dry_run: bool = False) -> SweepReport:
+    report = SweepReport(dry_run=dry_run)
+    now = dt.datetime.now(dt.timezone.utc)
+    with Session(database.engine) as session:
+        expire_uploads(session, now, report)
+        purge_released_blobs(session, now, report)
+        sweep_orphans(session, now, report)
+        if not dry_run:
+            report.users = reconcile_usage(session)
+    return report
+
+
+class PeriodicSweeper:
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.last_report: Optional[SweepReport] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.last_report = await run_io(sweep)
+            except Exception:
+                logger.exception("Storage sweep failed")
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -0,0 +1,78 @@
+import math
+import shutil
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from ..config import settings
+
+
+class ThumbnailError(RuntimeError):
+    pass
+
+
+@dataclass
+class ThumbnailSet:
+    interval_s: float
+    columns: int
+    posters: list[Path]
+    sprite: Path
+
+
+def ffmpeg_path() -> Optional[str]:
+    return shutil.which(settings.ffmpeg_binary)
+
+
+def thumbnail_interval(duration_s: float) -> float:
+    # Long recordings get a wider interval so the sprite stays a single small image.
+    return max(settings.thumbnail_interval_seconds, duration_s / settings.thumbnail_max_frames)
+
+
+def generate_thumbnails(source: Path, workdir: Path, duration_s: float) -> ThumbnailSet:
+    binary = ffmpeg_path()
+    if binary is None:
+        raise ThumbnailError(f"{settings.ffmpeg_binary} not found on PATH")
+    interval = thumbnail_interval(duration_s)
+    expected = max(1, math.ceil(duration_s / interval))
+    columns = min(settings.thumbnail_sprite_columns, expected)
+    rows = math.ceil(expected / columns)
+    # One decode pass feeds both the individual poster frames and the tiled sprite.
+    graph = (
+        f"[0:v:0]fps=1/{interval:g},scale={settings.thumbnail_width}:-2,split=2[frames][tiles];"
+        f"[tiles]tile={columns}x{rows}[sprite]"
+    )
+    command = [
+        binary,
+        "-nostdin",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        str(source),
+        "-filter_complex",
+        graph,
+        "-map",
+        "[frames]",
+        "-q:v",
+        "4",
+        str(workdir / "poster_%05d.jpg"),
+        "-map",
+        "[sprite]",
+        "-frames:v",
+        "1",
+        "-q:v",
+        "4",
+        str(workdir / "sprite.jpg"),
+    ]
+    try:
+        subprocess.run(command, check=True, capture_output=True, timeout=settings.thumbnail_timeout_seconds)
+    except subprocess.CalledProcessError as exc:
+        message = exc.stderr.decode(errors="replace").strip().splitlines()
+        raise ThumbnailError(message[-1] if message else f"ffmpeg exited with {exc.returncode}") from exc
+    posters = sorted(workdir.glob("poster_*.jpg"))[: columns * rows]
+    sprite = workdir / "sprite.jpg"
+    if not posters or not sprite.exists():
+        raise ThumbnailError("ffmpeg produced no frames")
+    return ThumbnailSet(interval_s=interval, columns=columns, posters=posters, sprite=sprite)
@@ -0,0 +1,79 @@
+import datetime as dt
+import uuid
+from typing import Optional
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, func, select
+
+from ..models import Segment, StoredFile, Trip, UploadSession, UploadStatus, User, UserUsage
+
+
+def adjust_usage(session: Session, segment_id: uuid.UUID, stored_bytes: int, stored_files: int) -> None:
+    # Runs in the caller's transaction; users without a tally row are picked up by the next reconcile.
+    owner = select(Trip.user_id).join(Segment, Segment.trip_id == Trip.id).where(Segment.id == segment_id)
+    session.exec(
+        update(UserUsage)
+        .where(UserUsage.user_id == owner.scalar_subquery())
+        .values(
+            stored_bytes=UserUsage.stored_bytes + stored_bytes,
+            stored_files=UserUsage.stored_files + stored_files,
+            updated_at=dt.datetime.now(dt.timezone.utc),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _measure(session: Session, user_id: Optional[uuid.UUID]) -> tuple[dict, dict]:
+    stored = (
+        select(Trip.user_id, func.count(StoredFile.id), func.coalesce(func.sum(StoredFile.bytes), 0))
+        .select_from(StoredFile)
+        .join(Segment, StoredFile.segment_id == Segment.id)
+        .join(Trip, Segment.trip_id == Trip.id)
+        .group_by(Trip.user_id)
+    )
+    pending = (
+        select(Trip.user_id, func.count(UploadSession.id), func.coalesce(func.sum(UploadSession.offset), 0))
+        .select_from(UploadSession)
+        .join(Trip, UploadSession.trip_id == Trip.id)
+        .where(UploadSession.status.in_([UploadStatus.PENDING, UploadStatus.RECEIVING]))
+        .group_by(Trip.user_id)
+    )
+    if user_id is not None:
+        stored = stored.where(Trip.user_id == user_id)
+        pending = pending.where(Trip.user_id == user_id)
+    return (
+        {owner: (count, total) for owner, count, total in session.exec(stored)},
+        {owner: (count, total) for owner, count, total in session.exec(pending)},
+    )
+
+
+def reconcile_usage(session: Session, user_id: Optional[uuid.UUID] = None) -> int:
+    # Recomputes the tally with two grouped queries; the running totals are only adjusted incrementally between runs.
+    stored, pending = _measure(session, user_id)
+    users = [user_id] if user_id is not None else session.exec(select(User.id)).all()
+    statement = select(UserUsage)
+    if user_id is not None:
+        statement = statement.where(UserUsage.user_id == user_id)
+    existing = {usage.user_id: usage for usage in session.exec(statement)}
+    now = dt.datetime.now(dt.timezone.utc)
+    for owner in users:
+        usage = existing.get(owner) or UserUsage(user_id=owner)
+        usage.stored_files, usage.stored_bytes = stored.get(owner, (0, 0))
+        usage.pending_uploads, usage.pending_upload_bytes = pending.get(owner, (0, 0))
+        usage.updated_at = now
+        usage.reconciled_at = now
+        session.add(usage)
+    session.commit()
+    return len(users)
+
+
+def get_usage(session: Session, user_id: uuid.UUID) -> UserUsage:
+    usage = session.get(UserUsage, user_id)
+    if usage is None:
+        try:
+            reconcile_usage(session, user_id)
+        except IntegrityError:
+            session.rollback()
+        usage = session.get(UserUsage, user_id)
+    return usage
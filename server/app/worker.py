@@ -0,0 +1,51 @@
+import argparse
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+
+from sqlmodel import Session
+
+from . import database
+from .config import settings
+from .services.jobs import claim_next, run_job, run_pending
+
+
+def _init_process() -> None:
+    # Connections inherited from the parent must not be shared across processes.
+    database.engine.dispose(close=False)
+
+
+def serve(processes: int, poll_interval: float) -> None:
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    running: set[Future] = set()
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_process) as pool:
+        while True:
+            running = {future for future in running if not future.done()}
+            while len(running) < processes:
+                with Session(database.engine) as session:
+                    job_id = claim_next(session, worker_id)
+                if job_id is None:
+                    break
+                running.add(pool.submit(run_job, job_id, worker_id))
+            if running:
+                wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(poll_interval)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="bike-recorder-worker", description="Run BikeRecorder background jobs")
+    parser.add_argument("--processes", type=int, default=settings.worker_processes)
+    parser.add_argument("--poll-interval", type=float, default=settings.worker_poll_interval_seconds)
+    parser.add_argument("--once", action="store_true", help="Run every due job in this process and exit")
+    args = parser.parse_args(argv)
+    database.init_db()
+    if args.once:
+        print(f"Ran {run_pending()} jobs")
+        return
+    serve(max(args.processes, 1), args.poll_interval)
+
+
+if __name__ == "__main__":
+    main()
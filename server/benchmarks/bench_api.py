@@ -0,0 +1,420 @@
+"""Load test for the upload, finalize, listing and auth paths of a running API.
+
+Starts uvicorn on a throwaway SQLite database and storage directory, unless
+--base-url points at a server that is already running. Use --database-url to
+run against a local PostgreSQL instead; listing needs it to seed trips
+directly when --base-url is given.
+
+    python benchmarks/bench_api.py --output results.json
+    python benchmarks/bench_api.py uploads --users 10 --rate-mbps 10 --chunk-sizes 256K,1M,4M
+    python benchmarks/bench_api.py --database-url postgresql+psycopg://localhost/bench listing
+"""
+
+import argparse
+import asyncio
+import datetime as dt
+import hashlib
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import httpx
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+SCENARIOS = ("auth", "listing", "uploads", "finalize")
+UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def _size(value: str) -> int:
+    value = value.strip().upper()
+    if value and value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+
+def _sizes(value: str) -> list[int]:
+    return [_size(part) for part in value.split(",") if part]
+
+
+def _ints(value: str) -> list[int]:
+    return [int(part) for part in value.split(",") if part]
+
+
+def _latency(samples: list[float]) -> dict:
+    if not samples:
+        return {"count": 0}
+    values = np.array(samples) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(samples),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+class Payload:
+    # Deterministic upload bytes without holding whole files in memory.
+    def __init__(self, seed: int, size: int, block_size: int = 1024**2):
+        self.size = size
+        self.block = np.random.default_rng(seed).bytes(block_size)
+        digest = hashlib.sha256()
+        for offset in range(0, size, block_size):
+            digest.update(self.read(offset, block_size))
+        self.sha256 = digest.hexdigest()
+
+    def read(self, offset: int, length: int) -> bytes:
+        length = min(length, self.size - offset)
+        start = offset % len(self.block)
+        data = self.block[start : start + length]
+        while len(data) < length:
+            data += self.block[: length - len(data)]
+        return data
+
+
+class Server:
+    def __init__(self, base_url: Optional[str], database_url: Optional[str], workers: int):
+        self.base_url = base_url
+        self.database_url = database_url
+        self.workers = workers
+        self.process: Optional[subprocess.Popen] = None
+        self._tmp: Optional[tempfile.TemporaryDirectory] = None
+
+    def __enter__(self) -> "Server":
+        if self.base_url:
+            return self
+        self._tmp = tempfile.TemporaryDirectory(prefix="bike-bench-")
+        tmp = Path(self._tmp.name)
+        self.database_url = self.database_url or f"sqlite:///{tmp / 'bench.db'}"
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        env = {
+            **os.environ,
+            "BIKE_RECORDER_DATABASE_URL": self.database_url,
+            "BIKE_RECORDER_STORAGE_DIR": str(tmp / "storage"),
+        }
+        command = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"]
+        if self.workers > 1:
+            command += ["--workers", str(self.workers)]
+        self.process = subprocess.Popen(command, cwd=ROOT, env=env)
+        self.base_url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                if httpx.get(f"{self.base_url}/healthz").status_code == 200:
+                    return self
+            except httpx.TransportError:
+                time.sleep(0.1)
+        self.__exit__(None, None, None)
+        raise RuntimeError("uvicorn did not become healthy")
+
+    def __exit__(self, *exc) -> None:
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+        if self._tmp is not None:
+            self._tmp.cleanup()
+
+    def rss(self) -> dict:
+        # Resident and peak memory of the server process (and its workers) on Linux.
+        if self.process is None:
+            return {}
+        pids = [self.process.pid]
+        children = Path(f"/proc/{self.process.pid}/task/{self.process.pid}/children")
+        if children.exists():
+            pids += [int(pid) for pid in children.read_text().split()]
+        totals = {"rss_mb": 0.0, "peak_rss_mb": 0.0}
+        for pid in pids:
+            try:
+                status = Path(f"/proc/{pid}/status").read_text()
+            except OSError:
+                return {}
+            for line in status.splitlines():
+                if line.startswith("VmRSS:"):
+                    totals["rss_mb"] += int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    totals["peak_rss_mb"] += int(line.split()[1]) / 1024
+        return {key: round(value, 1) for key, value in totals.items()}
+
+
+async def _login(client: httpx.AsyncClient, email: str) -> tuple[dict[str, str], str]:
+    response = await client.post("/auth/token", json={"email": email, "password": "bench"})
+    response.raise_for_status()
+    body = response.json()
+    return {"Authorization": f"Bearer {body['access_token']}"}, body["user_id"]
+
+
+async def _new_segment(client: httpx.AsyncClient, headers: dict[str, str], size: int) -> tuple[str, str]:
+    device = await client.post(
+        "/devices/register", json={"platform": "android", "model": "bench", "os_version": "14"}, headers=headers
+    )
+    start = dt.datetime.now(dt.timezone.utc).isoformat()
+    trip = await client.post(
+        "/trips", json={"device_id": device.json()["id"], "start_time_utc": start}, headers=headers
+    )
+    trip_id = trip.json()["id"]
+    segment = await client.post(
+        f"/trips/{trip_id}/segments", json={"index": 0, "expected_bytes": size}, headers=headers
+    )
+    return trip_id, segment.json()["id"]
+
+
+async def _create_upload(client: httpx.AsyncClient, headers: dict[str, str], payload: Payload) -> str:
+    trip_id, segment_id = await _new_segment(client, headers, payload.size)
+    response = await client.post(
+        "/uploads",
+        json={
+            "trip_id": trip_id,
+            "segment_id": segment_id,
+            "filename": "bench.mp4",
+            "file_type": "video_mp4",
+            "sha256": payload.sha256,
+            "upload_length": payload.size,
+        },
+        headers=headers,
+    )
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+async def _patch(
+    client: httpx.AsyncClient, headers: dict[str, str], upload_id: str, offset: int, data: bytes
+) -> float:
+    started = time.perf_counter()
+    response = await client.patch(
+        f"/uploads/{upload_id}",
+        content=data,
+        headers={**headers, "Upload-Offset": str(offset), "Content-Type": "application/offset+octet-stream"},
+    )
+    elapsed = time.perf_counter() - started
+    response.raise_for_status()
+    return elapsed
+
+
+async def bench_uploads(client: httpx.AsyncClient, args: argparse.Namespace) -> list[dict]:
+    results = []
+    for chunk_size in args.chunk_sizes:
+        latencies: list[float] = []
+        user_rates: list[float] = []
+
+        async def user(payload: Payload, headers: dict[str, str], upload_id: str) -> None:
+            started = time.perf_counter()
+            for offset in range(0, payload.size, chunk_size):
+                data = payload.read(offset, chunk_size)
+                latencies.append(await _patch(client, headers, upload_id, offset, data))
+                if args.rate_mbps:
+                    # Paces each client like a phone on a link of the given bandwidth.
+                    due = (offset + len(data)) * 8 / (args.rate_mbps * 1e6)
+                    await asyncio.sleep(max(due - (time.perf_counter() - started), 0))
+            user_rates.append(payload.size * 8 / 1e6 / (time.perf_counter() - started))
+
+        sessions = []
+        for number in range(args.users):
+            headers, _ = await _login(client, f"upload-{number}@bench.local")
+            payload = Payload(args.seed + number, args.file_size)
+            sessions.append((payload, headers, await _create_upload(client, headers, payload)))
+        started = time.perf_counter()
+        await asyncio.gather(*(user(*session) for session in sessions))
+        elapsed = time.perf_counter() - started
+        results.append(
+            {
+                "chunk_bytes": chunk_size,
+                "users": args.users,
+                "file_bytes": args.file_size,
+                "target_mbps_per_user": args.rate_mbps,
+                "patch": _latency(latencies),
+                "throughput_mb_per_s": round(args.users * args.file_size / 1024**2 / elapsed, 2),
+                "min_user_mbps": round(min(user_rates), 2),
+                "seconds": round(elapsed, 3),
+            }
+        )
+    return results
+
+
+async def bench_finalize(client: httpx.AsyncClient, args: argparse.Namespace) -> list[dict]:
+    # Times the PATCH that carries the last byte: storage commit, checksum check and the DB update.
+    headers, _ = await _login(client, "finalize@bench.local")
+    results = []
+    for size in args.finalize_sizes:
+        samples = []
+        for repeat in range(args.repeat):
+            payload = Payload(args.seed + repeat, size)
+            upload_id = await _create_upload(client, headers, payload)
+            last = max(size - args.finalize_tail, 0)
+            for offset in range(0, last, args.finalize_chunk):
+                data = payload.read(offset, min(args.finalize_chunk, last - offset))
+                await _patch(client, headers, upload_id, offset, data)
+            samples.append(await _patch(client, headers, upload_id, last, payload.read(last, size - last)))
+        results.append({"file_bytes": size, "finalize": _latency(samples)})
+    return results
+
+
+def _seed_trips(database_url: str, user_id: str, trips: int, segments: int) -> None:
+    from sqlmodel import Session
+
+    from app import database
+    from app.config import settings
+    from app.models import Device, DevicePlatform, Segment, Trip
+
+    settings.database_url = database_url
+    engine = database.get_engine()
+    start = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+    with Session(engine) as session:
+        device = Device(user_id=uuid.UUID(user_id), platform=DevicePlatform.ANDROID, model="bench", os_version="14")
+        session.add(device)
+        for number in range(trips):
+            trip = Trip(
+                user_id=device.user_id,
+                device_id=device.id,
+                start_time_utc=start + dt.timedelta(hours=number),
+                distance_m=1000.0,
+            )
+            session.add(trip)
+            session.add_all(Segment(trip_id=trip.id, index=index, duration_s=60.0) for index in range(segments))
+            if number % 1000 == 999:
+                session.commit()
+        session.commit()
+    engine.dispose()
+
+
+async def bench_listing(client: httpx.AsyncClient, args: argparse.Namespace, server: Server) -> list[dict]:
+    if not server.database_url:
+        return [{"skipped": "pass --database-url to seed trips on an external server"}]
+    results = []
+    for trips in args.trip_counts:
+        headers, user_id = await _login(client, f"listing-{trips}@bench.local")
+        await asyncio.to_thread(_seed_trips, server.database_url, user_id, trips, args.segments_per_trip)
+        for include_segments in (True, False):
+            params = {"limit": args.page_size, "include_segments": str(include_segments).lower()}
+            first, paged = [], []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                response = await client.get("/trips", params=params, headers=headers)
+                first.append(time.perf_counter() - started)
+                response.raise_for_status()
+                cursor = response.json().get("next_cursor")
+                if cursor:
+                    started = time.perf_counter()
+                    response = await client.get("/trips", params={**params, "cursor": cursor}, headers=headers)
+                    response.raise_for_status()
+                    paged.append(time.perf_counter() - started)
+            results.append(
+                {
+                    "trips": trips,
+                    "segments_per_trip": args.segments_per_trip,
+                    "include_segments": include_segments,
+                    "first_page": _latency(first),
+                    "second_page": _latency(paged),
+                }
+            )
+    return results
+
+
+async def bench_auth(client: httpx.AsyncClient, args: argparse.Namespace) -> dict:
+    # /healthz and /me differ only by token verification and the user lookup.
+    headers, _ = await _login(client, "auth@bench.local")
+    samples: dict[str, list[float]] = {"anonymous": [], "authenticated": [], "token_issue": []}
+    for _ in range(args.requests):
+        for name, request in (
+            ("anonymous", lambda: client.get("/healthz")),
+            ("authenticated", lambda: client.get("/me", headers=headers)),
+            ("token_issue", lambda: client.post("/auth/token", json={"email": "auth@bench.local", "password": "x"})),
+        ):
+            started = time.perf_counter()
+            (await request()).raise_for_status()
+            samples[name].append(time.perf_counter() - started)
+    result = {name: _latency(values) for name, values in samples.items()}
+    result["overhead_p50_ms"] = round(result["authenticated"]["p50_ms"] - result["anonymous"]["p50_ms"], 3)
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args: argparse.Namespace) -> dict:
+    report = {
+        "benchmark": "api",
+        "commit": _git_commit(),
+        "timestamp": dt.datetime.now(dt.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "scenarios")},
+        "scenarios": {},
+    }
+    with Server(args.base_url, args.database_url, args.workers) as server:
+        report["database"] = (server.database_url or "external").split(":", 1)[0]
+        limits = httpx.Limits(max_connections=max(args.users, 1) * 2)
+        async with httpx.AsyncClient(base_url=server.base_url, timeout=300, limits=limits) as client:
+            for scenario in args.scenarios:
+                started = time.perf_counter()
+                if scenario == "uploads":
+                    result = await bench_uploads(client, args)
+                elif scenario == "finalize":
+                    result = await bench_finalize(client, args)
+                elif scenario == "listing":
+                    result = await bench_listing(client, args, server)
+                else:
+                    result = await bench_auth(client, args)
+                report["scenarios"][scenario] = {
+                    "results": result,
+                    "seconds": round(time.perf_counter() - started, 3),
+                    "server": server.rss(),
+                }
+    report["client_peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", help=f"Any of {', '.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--base-url", help="Benchmark an already running server instead of starting uvicorn")
+    parser.add_argument("--database-url", help="Database for the spawned server and for seeding trips")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--rate-mbps", type=float, default=10.0, help="Per-user upload pacing; 0 means unthrottled")
+    parser.add_argument("--file-size", type=_size, default=_size("16M"))
+    parser.add_argument("--chunk-sizes", type=_sizes, default=_sizes("256K,1M,4M"))
+    parser.add_argument("--finalize-sizes", type=_sizes, default=_sizes("1M,16M,64M"))
+    parser.add_argument("--finalize-chunk", type=_size, default=_size("8M"))
+    parser.add_argument("--finalize-tail", type=_size, default=_size("64K"))
+    parser.add_argument("--trip-counts", type=_ints, default=[100, 1000, 10000])
+    parser.add_argument("--segments-per-trip", type=int, default=3)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per variant in the auth scenario")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path, help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Commit throughput of the default engine versus a bare SQLAlchemy engine.
+
+Simulates concurrent upload PATCHes: every worker thread repeatedly updates
+and commits its own UploadSession row.
+
+    python benchmarks/bench_db_commits.py --threads 16 --commits 200
+"""
+
+import argparse
+import datetime as dt
+import json
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel, create_engine
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app import database  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.models import Device, DevicePlatform, FileType, Segment, Trip, UploadSession, User  # noqa: E402
+
+
+def _seed(engine, count: int) -> list:
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        user = User(email="bench@example.com")
+        device = Device(user_id=user.id, platform=DevicePlatform.ANDROID, model="bench", os_version="14")
+        trip = Trip(user_id=user.id, device_id=device.id, start_time_utc=dt.datetime.now(dt.timezone.utc))
+        segment = Segment(trip_id=trip.id)
+        uploads = [
+            UploadSession(
+                trip_id=trip.id,
+                segment_id=segment.id,
+                filename=f"{index}.mp4",
+                file_type=FileType.VIDEO_MP4,
+                sha256="0" * 64,
+                upload_length=1 << 30,
+            )
+            for index in range(count)
+        ]
+        session.add_all([user, device, trip, segment, *uploads])
+        session.commit()
+        return [upload.id for upload in uploads]
+
+
+def _run(engine, threads: int, commits: int) -> dict:
+    upload_ids = _seed(engine, threads)
+    errors = []
+
+    def worker(upload_id) -> None:
+        for _ in range(commits):
+            try:
+                with Session(engine) as session:
+                    upload = session.get(UploadSession, upload_id)
+                    upload.offset += 1024 * 1024
+                    upload.updated_at = dt.datetime.now(dt.timezone.utc)
+                    session.add(upload)
+                    session.commit()
+            except OperationalError as exc:
+                errors.append(str(exc.orig))
+
+    workers = [threading.Thread(target=worker, args=(upload_id,)) for upload_id in upload_ids]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    succeeded = threads * commits - len(errors)
+    return {
+        "commits": succeeded,
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "commits_per_second": round(succeeded / elapsed, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--commits", type=int, default=200)
+    args = parser.parse_args()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        bare = create_engine(f"sqlite:///{tmp}/bare.db", connect_args={"check_same_thread": False})
+        results["bare"] = _run(bare, args.threads, args.commits)
+        bare.dispose()
+        settings.database_url = f"sqlite:///{tmp}/tuned.db"
+        tuned = database.get_engine()
+        results["tuned"] = _run(tuned, args.threads, args.commits)
+        tuned.dispose()
+    print(json.dumps({"benchmark": "db_commits", "threads": args.threads, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
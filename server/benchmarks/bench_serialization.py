@@ -0,0 +1,215 @@
+"""GET /trips with the orjson read path versus the previous Pydantic response models.
+
+Seeds one user with --trips trips (default 5,000) in a throwaway SQLite
+database and pages through all of them with limit=500, in process. The
+baseline is the route as it was before: hand-built TripDetail models
+returned through response_model=TripsResponse.
+
+    python benchmarks/bench_serialization.py --trips 5000 --repeat 5
+"""
+
+import argparse
+import datetime as dt
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import orjson
+
+_tmp = tempfile.TemporaryDirectory(prefix="bike-bench-")
+os.environ["BIKE_RECORDER_DATABASE_URL"] = f"sqlite:///{_tmp.name}/bench.db"
+os.environ["BIKE_RECORDER_STORAGE_DIR"] = f"{_tmp.name}/storage"
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi import Depends, Query  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlmodel import Session, select  # noqa: E402
+
+from app import database  # noqa: E402
+from app.auth import CurrentUser, create_access_token  # noqa: E402
+from app.main import create_app  # noqa: E402
+from app.models import Device, DevicePlatform, Segment, Trip, User, UserRole  # noqa: E402
+from app.routers.trips import _after_cursor, _encode_cursor, _trip_detail  # noqa: E402
+from app.schemas import SegmentRead, TripDetail, TripsResponse  # noqa: E402
+
+
+def _seed(trips: int, segments: int) -> str:
+    start = dt.datetime(2024, 1, 1, tzinfo=dt.timezone.utc)
+    with Session(database.engine) as session:
+        user = User(email="serialization@bench.local", role=UserRole.USER)
+        device = Device(user_id=user.id, platform=DevicePlatform.ANDROID, model="bench", os_version="14")
+        session.add_all([user, device])
+        for number in range(trips):
+            trip = Trip(
+                user_id=user.id,
+                device_id=device.id,
+                start_time_utc=start + dt.timedelta(hours=number),
+                end_time_utc=start + dt.timedelta(hours=number, minutes=45),
+                duration_s=2700,
+                distance_m=12_345.6,
+                moving_time_s=2400.0,
+                max_speed_mps=11.2,
+                avg_speed_mps=5.1,
+                elevation_gain_m=87.0,
+            )
+            session.add(trip)
+            session.add_all(
+                Segment(
+                    trip_id=trip.id,
+                    index=index,
+                    file_size_bytes=512 * 1024**2,
+                    duration_s=900.0,
+                    sha256="ab" * 32,
+                    video_codec="h264",
+                    audio_codec="aac",
+                    width=1920,
+                    height=1080,
+                    fps=29.97,
+                )
+                for index in range(segments)
+            )
+        session.commit()
+        return create_access_token(subject=user.id, email=user.email, role=user.role)
+
+
+def _legacy_detail(trip: Trip, segments: list[Segment]) -> TripDetail:
+    return TripDetail(
+        id=trip.id,
+        device_id=trip.device_id,
+        start_time_utc=trip.start_time_utc,
+        end_time_utc=trip.end_time_utc,
+        duration_s=trip.duration_s,
+        distance_m=trip.distance_m,
+        moving_time_s=trip.moving_time_s,
+        max_speed_mps=trip.max_speed_mps,
+        avg_speed_mps=trip.avg_speed_mps,
+        elevation_gain_m=trip.elevation_gain_m,
+        status=trip.status,
+        segments=[SegmentRead.model_validate(segment, from_attributes=True) for segment in segments],
+    )
+
+
+def _add_legacy_route(app) -> None:
+    @app.get("/bench/legacy-trips", response_model=TripsResponse)
+    def legacy_trips(
+        current_user: CurrentUser,
+        session: Session = Depends(database.get_session),
+        cursor: str | None = Query(default=None),
+        limit: int = Query(default=50, ge=1, le=500),
+    ) -> TripsResponse:
+        statement = (
+            select(Trip)
+            .where(Trip.user_id == current_user.id)
+            .order_by(Trip.start_time_utc.desc(), Trip.id.desc())
+            .limit(limit + 1)
+        )
+        trips = session.exec(_after_cursor(statement, cursor)).all()
+        next_cursor = _encode_cursor(trips[limit - 1]) if len(trips) > limit else None
+        trips = trips[:limit]
+        segments_by_trip: dict = defaultdict(list)
+        statement = select(Segment).where(Segment.trip_id.in_([trip.id for trip in trips]))
+        for segment in session.exec(statement.order_by(Segment.trip_id, Segment.index)).all():
+            segments_by_trip[segment.trip_id].append(segment)
+        return TripsResponse(
+            trips=[_legacy_detail(trip, segments_by_trip[trip.id]) for trip in trips], next_cursor=next_cursor
+        )
+
+
+def _page_all(client: TestClient, path: str, headers: dict[str, str]) -> tuple[list[float], int, int, str]:
+    timings, cursor, received, count = [], None, 0, 0
+    while True:
+        params = {"limit": 500, **({"cursor": cursor} if cursor else {})}
+        started = time.perf_counter()
+        response = client.get(path, params=params, headers=headers)
+        timings.append(time.perf_counter() - started)
+        response.raise_for_status()
+        received += int(response.headers["content-length"])
+        body = response.json()
+        count += len(body["trips"])
+        cursor = body["next_cursor"]
+        if not cursor:
+            return timings, received, count, response.headers.get("content-encoding", "identity")
+
+
+def _summary(timings: list[float], received: int, trips: int) -> dict:
+    values = np.array(timings) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "pages": len(timings),
+        "trips": trips,
+        "page_p50_ms": round(float(p50), 3),
+        "page_p95_ms": round(float(p95), 3),
+        "page_p99_ms": round(float(p99), 3),
+        "trips_per_second": round(trips / values.sum() * 1000, 1),
+        "response_bytes": received,
+    }
+
+
+def _serialize_only(repeat: int) -> dict:
+    # CPU cost of turning already loaded rows into JSON bytes, without the query or HTTP layers.
+    with Session(database.engine) as session:
+        trips = session.exec(select(Trip).order_by(Trip.start_time_utc.desc())).all()
+        segments_by_trip: dict = defaultdict(list)
+        for segment in session.exec(select(Segment).order_by(Segment.trip_id, Segment.index)).all():
+            segments_by_trip[segment.trip_id].append(segment)
+    timings: dict[str, list[float]] = {"pydantic": [], "orjson": []}
+    for _ in range(repeat):
+        started = time.perf_counter()
+        model = TripsResponse(trips=[_legacy_detail(trip, segments_by_trip[trip.id]) for trip in trips])
+        model.model_dump_json()
+        timings["pydantic"].append(time.perf_counter() - started)
+        started = time.perf_counter()
+        orjson.dumps({"trips": [_trip_detail(trip, segments_by_trip[trip.id]) for trip in trips]})
+        timings["orjson"].append(time.perf_counter() - started)
+    result = {name: round(min(values) * 1000, 3) for name, values in timings.items()}
+    return {"trips": len(trips), "best_ms": result, "speedup": round(result["pydantic"] / result["orjson"], 2)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trips", type=int, default=5000)
+    parser.add_argument("--segments-per-trip", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    app = create_app()
+    _add_legacy_route(app)
+    token = _seed(args.trips, args.segments_per_trip)
+    variants = {
+        "pydantic": ("/bench/legacy-trips", "identity"),
+        "orjson": ("/trips", "identity"),
+        "orjson_gzip": ("/trips", "gzip"),
+        "orjson_br": ("/trips", "br"),
+    }
+    results = {}
+    with TestClient(app) as client:
+        for name, (path, encoding) in variants.items():
+            headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": encoding}
+            _page_all(client, path, headers)  # warm-up
+            timings, received, trips, used = [], 0, 0, encoding
+            for _ in range(args.repeat):
+                page_timings, received, trips, used = _page_all(client, path, headers)
+                timings.extend(page_timings)
+            results[name] = _summary(timings, received, trips)
+            # Without the optional brotli package the br variant is served uncompressed.
+            results[name]["content_encoding"] = used
+    baseline = results["pydantic"]["page_p50_ms"]
+    for result in results.values():
+        result["speedup_p50"] = round(baseline / result["page_p50_ms"], 2)
+    report = {
+        "benchmark": "serialization",
+        "trips": args.trips,
+        "segments_per_trip": args.segments_per_trip,
+        "results": results,
+        "serialize_only": _serialize_only(args.repeat),
+    }
+    print(json.dumps(report, indent=2))
+    _tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
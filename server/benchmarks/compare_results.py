@@ -0,0 +1,65 @@
+"""Compare two bench_api.py reports, e.g. from the base and head of a branch.
+
+Prints every latency percentile, throughput and RSS figure found in both
+reports with its relative change. Exits non-zero when a p95 or p99 latency
+regressed by more than --threshold percent.
+
+    python benchmarks/compare_results.py base.json head.json --threshold 15
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Iterator
+
+# Keys where a larger value is an improvement.
+HIGHER_IS_BETTER = ("throughput_mb_per_s", "min_user_mbps")
+COMPARED = ("p50_ms", "p95_ms", "p99_ms", "rss_mb", "peak_rss_mb", *HIGHER_IS_BETTER)
+GATED = ("p95_ms", "p99_ms")
+
+
+def _label(item: dict) -> str:
+    # Result rows are identified by their parameters rather than their position.
+    keys = ("chunk_bytes", "file_bytes", "trips", "include_segments")
+    return ",".join(f"{key}={item[key]}" for key in keys if key in item)
+
+
+def _flatten(value: Any, path: str = "") -> Iterator[tuple[str, float]]:
+    if isinstance(value, dict):
+        for key, child in value.items():
+            if key in COMPARED and isinstance(child, (int, float)):
+                yield f"{path}.{key}", float(child)
+            else:
+                yield from _flatten(child, f"{path}.{key}" if path else key)
+    elif isinstance(value, list):
+        for index, child in enumerate(value):
+            label = _label(child) if isinstance(child, dict) else ""
+            yield from _flatten(child, f"{path}[{label or index}]")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("current", type=Path)
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed p95/p99 regression in percent")
+    args = parser.parse_args()
+    reports = [json.loads(path.read_text()) for path in (args.baseline, args.current)]
+    baseline, current = (dict(_flatten(report["scenarios"])) for report in reports)
+    names = [report.get("commit") or label for report, label in zip(reports, ("baseline", "current"))]
+    print(f"{'metric':<90} {names[0]:>12} {names[1]:>12} {'change':>9}")
+    regressions = []
+    for name in sorted(baseline.keys() & current.keys()):
+        before, after = baseline[name], current[name]
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"{name:<90} {before:>12.3f} {after:>12.3f} {change:>+8.1f}%")
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        if name.endswith(GATED) and worse > args.threshold:
+            regressions.append(name)
+    if regressions:
+        print(f"\n{len(regressions)} latency regressions above {args.threshold:g}%:", *regressions, sep="\n  ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
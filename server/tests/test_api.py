@@ -1,8 +1,12 @@
 import datetime as dt
 import hashlib
 import json
+import shutil
+import subprocess
+import uuid
 from pathlib import Path
 
+import anyio
 import pytest
 from fastapi.testclient import TestClient
 
@@ -101,3 +105,1227 @@ def test_trip_upload_flow(client: TestClient, tmp_path: Path):
     stored_file = metadata_resp.json()
     file_meta = client.get(f"/files/{stored_file['id']}", headers=headers)
     assert file_meta.status_code == 200
+
+
+def _run_jobs() -> int:
+    from app.services.jobs import run_pending
+
+    return run_pending()
+
+
+def _create_upload(client: TestClient, headers: dict[str, str], content: bytes, filename: str = "segment.mp4") -> dict:
+    device = client.post(
+        "/devices/register",
+        json={"platform": "ios", "model": "iPhone", "os_version": "17"},
+        headers=headers,
+    ).json()
+    start_time = dt.datetime.now(dt.timezone.utc).isoformat()
+    trip = client.post("/trips", json={"device_id": device["id"], "start_time_utc": start_time}, headers=headers).json()
+    segment = client.post(
+        f"/trips/{trip['id']}/segments",
+        json={"index": 0, "expected_bytes": len(content)},
+        headers=headers,
+    ).json()
+    return client.post(
+        "/uploads",
+        json={
+            "trip_id": trip["id"],
+            "segment_id": segment["id"],
+            "filename": filename,
+            "file_type": "video_mp4",
+            "sha256": hashlib.sha256(content).hexdigest(),
+            "upload_length": len(content),
+        },
+        headers=headers,
+    ).json()
+
+
+def test_patch_upload_streams_in_bounded_buffers(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "upload_buffer_bytes", 7)
+    headers = _auth_headers(client)
+    content = bytes(range(256)) * 40
+    upload = _create_upload(client, headers, content)
+
+    def body():
+        for start in range(0, len(content), 1000):
+            yield content[start : start + 1000]
+
+    patch_headers = {"Upload-Offset": "0", **headers, "Content-Type": "application/offset+octet-stream"}
+    response = client.patch(f"/uploads/{upload['id']}", content=body(), headers=patch_headers)
+    assert response.status_code == 204
+    assert response.headers["Upload-Offset"] == str(len(content))
+    sha = hashlib.sha256(content).hexdigest()
+    stored = settings.storage_dir / "blobs" / sha[:2] / sha[2:4] / sha
+    assert stored.read_bytes() == content
+
+
+def test_patch_upload_rejects_bytes_past_upload_length(client: TestClient):
+    headers = _auth_headers(client)
+    content = b"0123456789"
+    upload = _create_upload(client, headers, content)
+    patch_headers = {"Upload-Offset": "0", **headers, "Content-Type": "application/offset+octet-stream"}
+    response = client.patch(f"/uploads/{upload['id']}", content=content + b"extra", headers=patch_headers)
+    assert response.status_code == 413
+    head = client.head(f"/uploads/{upload['id']}", headers=headers)
+    assert head.headers["Upload-Offset"] == "0"
+
+
+def test_patch_upload_keeps_partial_progress_on_disconnect(client: TestClient):
+    headers = _auth_headers(client)
+    content = b"a" * 64
+    upload = _create_upload(client, headers, content)
+    messages = [
+        {"type": "http.request", "body": content[:40], "more_body": True},
+        {"type": "http.disconnect"},
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        pass
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "PATCH",
+        "scheme": "http",
+        "path": f"/uploads/{upload['id']}",
+        "raw_path": f"/uploads/{upload['id']}".encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"authorization", headers["Authorization"].encode()),
+            (b"upload-offset", b"0"),
+            (b"content-type", b"application/offset+octet-stream"),
+        ],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    anyio.run(client.app, scope, receive, send)
+    head = client.head(f"/uploads/{upload['id']}", headers=headers)
+    assert head.headers["Upload-Offset"] == "40"
+    patch_headers = {"Upload-Offset": "40", **headers, "Content-Type": "application/offset+octet-stream"}
+    response = client.patch(f"/uploads/{upload['id']}", content=content[40:], headers=patch_headers)
+    assert response.status_code == 204
+    assert response.headers["Upload-Offset"] == str(len(content))
+
+
+def test_finalize_uses_incremental_hash(client: TestClient, monkeypatch):
+    from app.services import storage
+
+    def fail(*args, **kwargs):
+        raise AssertionError("finalize must not re-read the upload")
+
+    monkeypatch.setattr(storage, "compute_sha256", fail)
+    headers = _auth_headers(client)
+    content = b"first half|second half"
+    upload = _create_upload(client, headers, content)
+    patch_headers = {**headers, "Content-Type": "application/offset+octet-stream"}
+    response = client.patch(
+        f"/uploads/{upload['id']}", content=content[:11], headers={"Upload-Offset": "0", **patch_headers}
+    )
+    assert response.status_code == 204
+    response = client.patch(
+        f"/uploads/{upload['id']}", content=content[11:], headers={"Upload-Offset": "11", **patch_headers}
+    )
+    assert response.status_code == 204
+    trip = client.get("/trips", headers=headers).json()["trips"][0]
+    assert trip["segments"][0]["sha256"] == hashlib.sha256(content).hexdigest()
+
+
+def test_chunked_upload_without_libcrypto_reads_the_file_back_once(client: TestClient, monkeypatch):
+    from app.services import hashing
+    from app.services.storage import FilesystemStorage
+
+    monkeypatch.setattr(hashing, "_libcrypto", None)
+    reads = []
+    original = FilesystemStorage.open_upload
+
+    def counting_open(self, upload_id, handle):
+        reads.append(upload_id)
+        return original(self, upload_id, handle)
+
+    monkeypatch.setattr(FilesystemStorage, "open_upload", counting_open)
+    headers = _auth_headers(client)
+    content = bytes(range(256)) * 12
+    upload = _create_upload(client, headers, content)
+    patch_headers = {**headers, "Content-Type": "application/offset+octet-stream"}
+    for offset in range(0, len(content), 1024):
+        response = client.patch(
+            f"/uploads/{upload['id']}",
+            content=content[offset : offset + 1024],
+            headers={"Upload-Offset": str(offset), **patch_headers},
+        )
+        assert response.status_code == 204
+    # No prefix is re-read per PATCH; the digest is computed from one read when the upload completes.
+    assert reads == [upload["id"]]
+    trip = client.get("/trips", headers=headers).json()["trips"][0]
+    assert trip["segments"][0]["sha256"] == hashlib.sha256(content).hexdigest()
+
+
+def test_readyz_reports_event_loop_lag(client: TestClient):
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ready"
+    assert body["event_loop_lag_ms"] >= 0
+
+
+def _metric(text: str, sample: str) -> float:
+    for line in text.splitlines():
+        name, _, value = line.rpartition(" ")
+        if name == sample:
+            return float(value)
+    return 0.0
+
+
+def test_metrics_report_upload_and_route_latency(client: TestClient):
+    headers = _auth_headers(client)
+    before = client.get("/metrics").text
+    content = b"0123456789" * 100
+    upload = _create_upload(client, headers, content)
+    patch_headers = {"Upload-Offset": "0", **headers, "Content-Type": "application/offset+octet-stream"}
+    client.patch(f"/uploads/{upload['id']}", content=content[:400], headers=patch_headers)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    received = 'bike_recorder_upload_received_bytes_total{file_type="video_mp4"}'
+    assert _metric(text, received) - _metric(before, received) == 400
+    patch_count = (
+        'bike_recorder_http_request_duration_seconds_count{method="PATCH",route="/uploads/{upload_id}",status="204"}'
+    )
+    assert _metric(text, patch_count) - _metric(before, patch_count) == 1
+    # Partial progress lives in the journal until a checkpoint, so the session is still pending.
+    assert _metric(text, 'bike_recorder_upload_sessions{status="pending"}') == 1
+    assert _metric(text, "bike_recorder_uploads_in_progress") == 0
+    assert _metric(text, 'bike_recorder_storage_bytes{state="free"}') > 0
+    assert _metric(text, 'bike_recorder_db_pool_connections{state="size"}') == settings.db_pool_size
+    for timing in ("bike_recorder_storage_write_seconds_count", "bike_recorder_db_commit_seconds_count"):
+        assert _metric(text, timing) > _metric(before, timing)
+    assert 'bike_recorder_sha256_seconds_bucket{stage="stream",le="+Inf"}' in text
+
+
+def test_metrics_exposition_format_escapes_labels_and_help():
+    from app.services.monitoring import Counter, Gauge, Histogram, Registry
+
+    registry = Registry()
+    counter = registry.register(Counter("demo_total", 'Counts "things"\nwith C:\\paths.', ("route",)))
+    gauge = registry.register(Gauge("demo_in_flight", "In flight."))
+    histogram = registry.register(Histogram("demo_seconds", "Latency.", ("stage",), buckets=(0.5, 0.1)))
+    counter.inc(2, 'say "hi"\\n\n')
+    gauge.set(1.5)
+    histogram.observe(0.2, "a")
+    histogram.observe(0.1, "a")
+    assert registry.render() == (
+        '# HELP demo_total Counts "things"\\nwith C:\\\\paths.\n'
+        "# TYPE demo_total counter\n"
+        'demo_total{route="say \\"hi\\"\\\\n\\n"} 2\n'
+        "# HELP demo_in_flight In flight.\n"
+        "# TYPE demo_in_flight gauge\n"
+        "demo_in_flight 1.5\n"
+        "# HELP demo_seconds Latency.\n"
+        "# TYPE demo_seconds histogram\n"
+        'demo_seconds_bucket{stage="a",le="0.1"} 1\n'
+        'demo_seconds_bucket{stage="a",le="0.5"} 2\n'
+        'demo_seconds_bucket{stage="a",le="+Inf"} 2\n'
+        'demo_seconds_sum{stage="a"} 0.30000000000000004\n'
+        'demo_seconds_count{stage="a"} 2\n'
+    )
+
+
+def test_list_trips_keyset_pagination(client: TestClient):
+    headers = _auth_headers(client)
+    device = client.post(
+        "/devices/register",
+        json={"platform": "android", "model": "Pixel", "os_version": "14"},
+        headers=headers,
+    ).json()
+    base = dt.datetime(2025, 1, 1, tzinfo=dt.timezone.utc)
+    created = []
+    for day in range(5):
+        start = (base + dt.timedelta(days=day // 2)).isoformat()
+        trip = client.post("/trips", json={"device_id": device["id"], "start_time_utc": start}, headers=headers).json()
+        client.post(f"/trips/{trip['id']}/segments", json={"index": 0, "expected_bytes": 1}, headers=headers)
+        client.post(f"/trips/{trip['id']}/segments", json={"index": 1, "expected_bytes": 1}, headers=headers)
+        created.append(trip["id"])
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/trips", params=params, headers=headers).json()
+        for trip in page["trips"]:
+            assert [segment["index"] for segment in trip["segments"]] == [0, 1]
+        seen.extend(trip["id"] for trip in page["trips"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert sorted(seen) == sorted(created)
+    assert len(seen) == len(set(seen))
+    compact = client.get("/trips", params={"include_segments": "false"}, headers=headers).json()
+    assert all(trip["segments"] is None for trip in compact["trips"])
+    assert client.get("/trips", params={"cursor": "???"}, headers=headers).status_code == 400
+
+
+def test_trip_reads_match_schema_and_compress_large_bodies(client: TestClient, monkeypatch):
+    from app.schemas import TripDetail, TripsResponse
+
+    headers = _auth_headers(client)
+    upload = _create_upload(client, headers, b"x")
+    client.patch(f"/trips/{upload['trip_id']}", json={"distance_m": 1234.5}, headers=headers)
+
+    listed = client.get("/trips", headers=headers)
+    assert "content-encoding" not in listed.headers
+    body = listed.json()
+    # The fast path must produce exactly what the documented Pydantic models would.
+    assert TripsResponse.model_validate(body).model_dump(mode="json") == body
+    detail = client.get(f"/trips/{upload['trip_id']}", headers=headers).json()
+    assert TripDetail.model_validate(detail).model_dump(mode="json") == detail
+    assert detail == body["trips"][0]
+    assert detail["distance_m"] == 1234.5
+    assert detail["segments"][0]["id"] == upload["segment_id"]
+
+    monkeypatch.setattr(settings, "response_compression_min_bytes", 100)
+    compressed = client.get("/trips", headers={**headers, "Accept-Encoding": "gzip"})
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert compressed.json() == body
+    refused = client.get("/trips", headers={**headers, "Accept-Encoding": "gzip;q=0, identity"})
+    assert "content-encoding" not in refused.headers
+
+
+def test_authenticated_user_is_cached_until_changed(client: TestClient):
+    from sqlmodel import Session
+
+    from app import database
+    from app.auth import user_cache
+    from app.models import User, UserRole
+
+    headers = _auth_headers(client, "cache@example.com")
+    user_id = client.get("/me", headers=headers).json()["id"]
+    assert user_cache.get(uuid.UUID(user_id)) is not None
+    with Session(database.engine) as session:
+        user = session.get(User, uuid.UUID(user_id))
+        user.role = UserRole.ADMIN
+        session.add(user)
+        session.commit()
+    assert user_cache.get(uuid.UUID(user_id)) is None
+    assert client.get("/me", headers=headers).json()["role"] == "admin"
+
+
+def test_upload_batch_tracks_progress_and_completes_trip(client: TestClient, monkeypatch):
+    monkeypatch.setattr(settings, "upload_checkpoint_bytes", 1)
+    headers = _auth_headers(client)
+    device = client.post(
+        "/devices/register", json={"platform": "ios", "model": "iPhone", "os_version": "17"}, headers=headers
+    ).json()
+    start_time = dt.datetime.now(dt.timezone.utc).isoformat()
+    trip = client.post("/trips", json={"device_id": device["id"], "start_time_utc": start_time}, headers=headers).json()
+    segments = [
+        client.post(f"/trips/{trip['id']}/segments", json={"index": index, "expected_bytes": 20}, headers=headers)
+        for index in range(2)
+    ]
+    segments = [response.json() for response in segments]
+    sample = b'{"ts": "2024-01-01T00:00:00Z", "lat": 1, "lon": 2}\n'
+    contents = [b"first segment video.", b"second segment video", sample]
+    files = [
+        {"segment_id": segments[0]["id"], "filename": "0.mp4", "file_type": "video_mp4"},
+        {"segment_id": segments[1]["id"], "filename": "1.mp4", "file_type": "video_mp4"},
+        {"segment_id": segments[0]["id"], "filename": "0.jsonl", "file_type": "gps_jsonl"},
+    ]
+    for file, content in zip(files, contents):
+        file.update(sha256=hashlib.sha256(content).hexdigest(), upload_length=len(content))
+
+    foreign = {**files[0], "segment_id": str(uuid.uuid4())}
+    response = client.post("/uploads/batches", json={"trip_id": trip["id"], "files": [foreign]}, headers=headers)
+    assert response.status_code == 404
+
+    response = client.post("/uploads/batches", json={"trip_id": trip["id"], "files": files}, headers=headers)
+    assert response.status_code == 201
+    batch = response.json()
+    assert batch["status"] == "open"
+    assert batch["total_bytes"] == sum(map(len, contents))
+    assert batch["file_count"] == 3
+    assert [upload["filename"] for upload in batch["uploads"]] == ["0.mp4", "1.mp4", "0.jsonl"]
+    assert batch["uploads"][0]["upload_url"].endswith(f"/uploads/{batch['uploads'][0]['id']}")
+
+    patch_headers = {**headers, "Content-Type": "application/offset+octet-stream"}
+    first = batch["uploads"][0]
+    response = client.patch(
+        first["upload_url"], content=contents[0][:8], headers={**patch_headers, "Upload-Offset": "0"}
+    )
+    assert response.status_code == 204
+    progress = client.get(f"/uploads/batches/{batch['id']}", headers=headers).json()
+    assert (progress["completed_bytes"], progress["completed_files"], progress["uploads"]) == (8, 0, None)
+
+    response = client.patch(
+        first["upload_url"], content=contents[0][8:], headers={**patch_headers, "Upload-Offset": "8"}
+    )
+    assert response.status_code == 204
+    for upload, content in list(zip(batch["uploads"], contents))[1:]:
+        assert client.get("/trips/" + trip["id"], headers=headers).json()["status"] == "uploading"
+        response = client.patch(upload["upload_url"], content=content, headers={"Upload-Offset": "0", **patch_headers})
+        assert response.status_code == 204
+
+    progress = client.get(f"/uploads/batches/{batch['id']}?include_uploads=true", headers=headers).json()
+    assert progress["status"] == "complete"
+    assert progress["completed_at"] is not None
+    assert (progress["completed_bytes"], progress["completed_files"]) == (batch["total_bytes"], 3)
+    assert {upload["status"] for upload in progress["uploads"]} == {"complete"}
+    assert client.get("/trips/" + trip["id"], headers=headers).json()["status"] == "complete"
+    other = _auth_headers(client, "other@example.com")
+    assert client.get(f"/uploads/batches/{batch['id']}", headers=other).status_code == 404
+
+
+def test_upload_offset_recovers_from_journal_after_crash(client: TestClient):
+    from sqlmodel import Session
+
+    from app import database
+    from app.models import UploadSession
+    from app.services.storage import get_journal_path, get_upload_path
+
+    headers = _auth_headers(client)
+    content = b"0123456789abcdefghijABCDEFGHIJ"
+    upload = _create_upload(client, headers, content)
+    patch_headers = {**headers, "Content-Type": "application/offset+octet-stream"}
+    response = client.patch(
+        f"/uploads/{upload['id']}", content=content[:10], headers={"Upload-Offset": "0", **patch_headers}
+    )
+    assert response.status_code == 204
+    with Session(database.engine) as session:
+        assert session.get(UploadSession, uuid.UUID(upload["id"])).offset == 0
+
+    # Crash after writing more bytes but before their journal record was complete.
+    with get_upload_path(upload["id"]).open("ab") as fp:
+        fp.write(b"garbage")
+    with get_journal_path(upload["id"]).open("ab") as fp:
+        fp.write(b"17 deadbe")
+
+    head = client.head(f"/uploads/{upload['id']}", headers=headers)
+    assert head.headers["Upload-Offset"] == "10"
+    response = client.patch(
+        f"/uploads/{upload['id']}", content=content[10:], headers={"Upload-Offset": "10", **patch_headers}
+    )
+    assert response.status_code == 204
+    trip = client.get("/trips", headers=headers).json()["trips"][0]
+    assert trip["segments"][0]["sha256"] == hashlib.sha256(content).hexdigest()
+    assert not get_journal_path(upload["id"]).exists()
+    with Session(database.engine) as session:
+        assert session.get(UploadSession, uuid.UUID(upload["id"])).offset == len(content)
+
+
+def test_download_supports_ranges_and_conditional_requests(client: TestClient):
+    headers = _auth_headers(client)
+    content = bytes(range(256)) * 4
+    upload = _create_upload(client, headers, content)
+    client.patch(
+        f"/uploads/{upload['id']}",
+        content=content,
+        headers={"Upload-Offset": "0", **headers, "Content-Type": "application/offset+octet-stream"},
+    )
+    from sqlmodel import Session, select
+
+    from app import database
+    from app.models import StoredFile
+
+    with Session(database.engine) as session:
+        file_id = str(session.exec(select(StoredFile)).first().id)
+    token = client.get(f"/files/{file_id}/download", headers=headers).json()["token"]
+    url = f"/files/download?token={token}"
+    etag = f'"{hashlib.sha256(content).hexdigest()}"'
+
+    full = client.get(url)
+    assert full.status_code == 200
+    assert full.content == content
+    assert full.headers["accept-ranges"] == "bytes"
+    assert full.headers["etag"] == etag
+
+    single = client.get(url, headers={"Range": "bytes=10-19"})
+    assert single.status_code == 206
+    assert single.content == content[10:20]
+    assert single.headers["content-range"] == f"bytes 10-19/{len(content)}"
+
+    suffix = client.get(url, headers={"Range": "bytes=-5"})
+    assert suffix.content == content[-5:]
+
+    multi = client.get(url, headers={"Range": "bytes=0-1,100-101"})
+    assert multi.status_code == 206
+    assert multi.headers["content-type"].startswith("multipart/byteranges; boundary=")
+    assert f"Content-Range: bytes 100-101/{len(content)}".encode() in multi.content
+    assert int(multi.headers["content-length"]) == len(multi.content)
+
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(url, headers={"Range": "bytes=0-1", "If-Range": '"stale"'}).status_code == 200
+    assert client.get(url, headers={"Range": "bytes=0-1", "If-Range": etag}).status_code == 206
+    unsatisfiable = client.get(url, headers={"Range": f"bytes={len(content)}-"})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == f"bytes */{len(content)}"
+
+
+def test_metadata_blobs_are_deduplicated_and_migrated(client: TestClient, monkeypatch):
+    from sqlmodel import Session, select
+
+    from app import database
+    from app.models import FileType, StoredFile
+    from app.services.storage import blob_uri, migrate_to_cas, release_stored_file
+    from app.services.sweeper import sweep
+
+    headers = _auth_headers(client)
+    upload = _create_upload(client, headers, b"x")
+    segment_id = upload["segment_id"]
+    other_segment = client.post(
+        f"/trips/{upload['trip_id']}/segments", json={"index": 1, "expected_bytes": 1}, headers=headers
+    ).json()
+    content = '{"ts": "2025-01-01T00:00:00Z", "lat": 1, "lon": 2}\n'
+    sha = hashlib.sha256(content.encode()).hexdigest()
+    sidecar = {"type": "gps_jsonl", "content": content}
+    first = client.post(f"/segments/{segment_id}/metadata", json=sidecar, headers=headers)
+    again = client.post(f"/segments/{segment_id}/metadata", json=sidecar, headers=headers)
+    other = client.post(f"/segments/{other_segment['id']}/metadata", json=sidecar, headers=headers)
+    assert first.json()["id"] == again.json()["id"]
+    assert first.json()["storage_uri"] == other.json()["storage_uri"] == blob_uri(sha)
+
+    legacy_path = settings.storage_dir / "segments" / segment_id / "track.gpx"
+    legacy_path.parent.mkdir(parents=True)
+    legacy_path.write_text("<gpx/>")
+    with Session(database.engine) as session:
+        legacy = StoredFile(
+            segment_id=uuid.UUID(segment_id),
+            type=FileType.GPS_GPX,
+            storage_uri=f"segments/{segment_id}/track.gpx",
+            bytes=6,
+        )
+        session.add(legacy)
+        session.commit()
+        assert migrate_to_cas(session) == 1
+        session.refresh(legacy)
+        gpx_sha = hashlib.sha256(b"<gpx/>").hexdigest()
+        assert legacy.storage_uri == blob_uri(gpx_sha)
+        assert legacy.filename == "track.gpx"
+        assert not legacy_path.exists()
+
+        shared = session.exec(select(StoredFile).where(StoredFile.storage_uri == blob_uri(sha))).all()
+        release_stored_file(session, shared[0])
+        assert (settings.storage_dir / blob_uri(sha)).exists()
+        release_stored_file(session, shared[1])
+        # Deleting the blob is left to the sweeper, which skips it while it is still within the grace period.
+        assert (settings.storage_dir / blob_uri(sha)).exists()
+        assert sweep().released_blobs == 0
+
+    monkeypatch.setattr(settings, "orphan_grace_seconds", 0)
+    reattached = client.post(
+        f"/segments/{segment_id}/metadata", json={"type": "gps_jsonl", "content": content}, headers=headers
+    )
+    assert reattached.json()["storage_uri"] == blob_uri(sha)
+    assert sweep().released_blobs == 0
+    assert (settings.storage_dir / blob_uri(sha)).exists()
+    with Session(database.engine) as session:
+        release_stored_file(session, session.get(StoredFile, uuid.UUID(reattached.json()["id"])))
+    assert sweep().released_blobs == 1
+    assert not (settings.storage_dir / blob_uri(sha)).exists()
+
+
+# The schema as the first release created it, before any of the columns later requests added.
+BASELINE_SCHEMA = """
+CREATE TABLE user (id CHAR(32) NOT NULL PRIMARY KEY, email VARCHAR NOT NULL, name VARCHAR, role VARCHAR(5) NOT NULL,
+    created_at DATETIME NOT NULL);
+CREATE TABLE device (id CHAR(32) NOT NULL PRIMARY KEY, user_id CHAR(32) NOT NULL REFERENCES user (id),
+    platform VARCHAR(7) NOT NULL, model VARCHAR NOT NULL, os_version VARCHAR NOT NULL, app_version VARCHAR,
+    created_at DATETIME NOT NULL);
+CREATE TABLE trip (id CHAR(32) NOT NULL PRIMARY KEY, user_id CHAR(32) NOT NULL REFERENCES user (id),
+    device_id CHAR(32) NOT NULL REFERENCES device (id), start_time_utc DATETIME NOT NULL, end_time_utc DATETIME,
+    duration_s INTEGER, distance_m FLOAT, status VARCHAR(9) NOT NULL, created_at DATETIME NOT NULL);
+CREATE TABLE segment (id CHAR(32) NOT NULL PRIMARY KEY, trip_id CHAR(32) NOT NULL REFERENCES trip (id),
+    "index" INTEGER NOT NULL, video_codec VARCHAR, audio_codec VARCHAR, width INTEGER, height INTEGER, fps FLOAT,
+    file_size_bytes INTEGER, duration_s FLOAT, sha256 VARCHAR, created_at DATETIME NOT NULL, completed_at DATETIME);
+CREATE TABLE storedfile (id CHAR(32) NOT NULL PRIMARY KEY, segment_id CHAR(32) NOT NULL REFERENCES segment (id),
+    type VARCHAR(14) NOT NULL, storage_uri VARCHAR NOT NULL, sha256 VARCHAR, bytes INTEGER NOT NULL,
+    created_at DATETIME NOT NULL);
+CREATE TABLE uploadsession (id CHAR(32) NOT NULL PRIMARY KEY, trip_id CHAR(32) NOT NULL REFERENCES trip (id),
+    segment_id CHAR(32) NOT NULL REFERENCES segment (id), filename VARCHAR NOT NULL, file_type VARCHAR(14) NOT NULL,
+    sha256 VARCHAR NOT NULL, upload_length INTEGER NOT NULL, "offset" INTEGER NOT NULL, status VARCHAR(9) NOT NULL,
+    created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL);
+"""
+
+
+def test_baseline_database_is_upgraded_before_storage_migration(tmp_path: Path, monkeypatch, capsys):
+    import sqlite3
+
+    from sqlmodel import Session, select
+
+    from app import database
+    from app.cli import main as admin
+    from app.models import StoredFile, UploadSession
+    from app.services.storage import blob_uri
+
+    db_path = tmp_path / "baseline.db"
+    monkeypatch.setattr(settings, "storage_dir", tmp_path / "storage")
+    ids = {name: uuid.uuid4() for name in ("user", "device", "trip", "segment", "file")}
+    now = "2025-01-01 12:00:00.000000"
+    legacy_path = settings.storage_dir / "segments" / str(ids["segment"]) / "clip.mp4"
+    legacy_path.parent.mkdir(parents=True)
+    legacy_path.write_bytes(b"legacy video")
+    with sqlite3.connect(db_path) as connection:
+        connection.executescript(BASELINE_SCHEMA)
+        hexes = {name: value.hex for name, value in ids.items()}
+        connection.execute("INSERT INTO user VALUES (?, 'old@example.com', NULL, 'USER', ?)", (hexes["user"], now))
+        connection.execute(
+            "INSERT INTO device VALUES (?, ?, 'ANDROID', 'Pixel', '14', NULL, ?)", (hexes["device"], hexes["user"], now)
+        )
+        connection.execute(
+            "INSERT INTO trip VALUES (?, ?, ?, ?, NULL, NULL, NULL, 'COMPLETE', ?)",
+            (hexes["trip"], hexes["user"], hexes["device"], now, now),
+        )
+        connection.execute(
+            "INSERT INTO segment VALUES (?, ?, 0, NULL, NULL, NULL, NULL, NULL, 12, NULL, NULL, ?, NULL)",
+            (hexes["segment"], hexes["trip"], now),
+        )
+        connection.execute(
+            "INSERT INTO storedfile VALUES (?, ?, 'VIDEO_MP4', ?, NULL, 12, ?)",
+            (hexes["file"], hexes["segment"], legacy_path.relative_to(settings.storage_dir).as_posix(), now),
+        )
+    monkeypatch.setattr(settings, "database_url", f"sqlite:///{db_path}")
+    reset_engine(settings.database_url)
+
+    admin(["migrate-storage"])
+    assert "Migrated 1 stored files" in capsys.readouterr().out
+    with Session(database.engine) as session:
+        stored_file = session.get(StoredFile, ids["file"])
+        assert stored_file.storage_uri == blob_uri(hashlib.sha256(b"legacy video").hexdigest())
+        assert stored_file.filename == "clip.mp4"
+        # Columns added to the upload table since the baseline are there too.
+        assert session.exec(select(UploadSession.final_id, UploadSession.sha256_state)).all() == []
+    columns = {row[1] for row in sqlite3.connect(db_path).execute("PRAGMA table_info(trip)")}
+    assert {"moving_time_s", "elevation_gain_m", "stats_updated_at"} <= columns
+
+
+def test_usage_tally_follows_uploads_and_releases(client: TestClient):
+    from sqlmodel import Session, select
+
+    from app import database
+    from app.models import StoredFile
+    from app.services.storage import release_stored_file
+
+    headers = _auth_headers(client)
+    assert client.get("/me/usage", headers=headers).json()["stored_bytes"] == 0
+    content = b"counted video bytes"
+    upload = _create_upload(client, headers, content)
+    patch_headers = {**headers, "Content-Type": "application/offset+octet-stream", "Upload-Offset": "0"}
+    assert client.patch(f"/uploads/{upload['id']}", content=content, headers=patch_headers).status_code == 204
+    usage = client.get("/me/usage", headers=headers).json()
+    assert (usage["stored_files"], usage["stored_bytes"]) == (1, len(content))
+    with Session(database.engine) as session:
+        release_stored_file(session, session.exec(select(StoredFile)).one())
+    usage = client.get("/me/usage", headers=headers).json()
+    assert (usage["stored_files"], usage["stored_bytes"]) == (0, 0)
+
+
+def test_sweeper_expires_idle_uploads_and_removes_orphans(client: TestClient, capsys):
+    import os
+
+    from sqlmodel import Session
+
+    from app import database
+    from app.cli import main as admin
+    from app.models import StoredFile, UploadSession
+    from app.services.storage import blob_uri, get_journal_path, get_upload_path
+    from app.services.sweeper import sweep
+
+    headers = _auth_headers(client)
+    patch_headers = {**headers, "Content-Type": "application/offset+octet-stream", "Upload-Offset": "0"}
+    idle = _create_upload(client, headers, b"0123456789")
+    client.patch(f"/uploads/{idle['id']}", content=b"01234", headers=patch_headers)
+    active = _create_upload(client, headers, b"abcdefghij")
+    client.patch(f"/uploads/{active['id']}", content=b"abc", headers=patch_headers)
+    old = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=30)
+    with Session(database.engine) as session:
+        for upload_id in (idle["id"], active["id"]):
+            row = session.get(UploadSession, uuid.UUID(upload_id))
+            row.updated_at = old
+            session.add(row)
+        session.commit()
+    stale = old.timestamp()
+    # The active upload's row is just as old, but its journal shows a recent chunk.
+    for path in (get_upload_path(idle["id"]), get_journal_path(idle["id"]), get_upload_path(active["id"])):
+        os.utime(path, (stale, stale))
+
+    orphans = [settings.storage_dir / "uploads" / str(uuid.uuid4()), settings.storage_dir / "tmp" / "crashed"]
+    orphans.append(settings.storage_dir / blob_uri("ab" * 32))
+    for path in orphans:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"orphan")
+        os.utime(path, (stale, stale))
+    fresh = settings.storage_dir / "tmp" / "in-flight"
+    fresh.write_bytes(b"new")
+    with Session(database.engine) as session:
+        session.add(
+            StoredFile(segment_id=uuid.UUID(idle["segment_id"]), type="video_mp4", storage_uri=blob_uri("cd" * 32))
+        )
+        session.commit()
+
+    admin(["sweep-storage", "--dry-run"])
+    preview = json.loads(capsys.readouterr().out)
+    assert (preview["expired_uploads"], preview["orphan_files"]) == (1, 3)
+    assert get_upload_path(idle["id"]).exists()
+
+    report = sweep()
+    assert report.expired_uploads == 1
+    assert report.expired_bytes > 5
+    assert (report.orphan_files, report.orphan_bytes) == (3, 18)
+    assert report.missing_blobs == [blob_uri("cd" * 32)]
+    assert not any(path.exists() for path in orphans)
+    assert fresh.exists()
+    assert not get_upload_path(idle["id"]).exists()
+    assert not get_journal_path(idle["id"]).exists()
+    assert client.head(f"/uploads/{idle['id']}", headers=headers).status_code == 404
+    assert client.head(f"/uploads/{active['id']}", headers=headers).headers["Upload-Offset"] == "3"
+    usage = client.get("/me/usage", headers=headers).json()
+    assert (usage["pending_uploads"], usage["stored_files"]) == (1, 1)
+    assert usage["reconciled_at"] is not None
+
+
+def test_concatenation_assembles_partial_uploads(client: TestClient, monkeypatch):
+    from app.services.storage import FilesystemStorage, blob_uri, get_upload_path
+
+    headers = _auth_headers(client)
+    content = bytes(range(256)) * 40
+    pieces = [content[:4000], content[4000:7000], content[7000:]]
+    template = _create_upload(client, headers, content)
+    patch_headers = {**headers, "Content-Type": "application/offset+octet-stream"}
+    fields = {key: template[key] for key in ("trip_id", "segment_id", "filename", "file_type")}
+
+    def create(length: int, sha: str, concat: str):
+        return client.post(
+            "/uploads",
+            json={**fields, "sha256": sha, "upload_length": length},
+            headers={**headers, "Upload-Concat": concat},
+        )
+
+    parts = [create(len(piece), hashlib.sha256(piece).hexdigest(), "partial").json() for piece in pieces]
+    # Parts upload independently and in any order; each is checked against its own SHA-256 when it finishes.
+    for part, piece in reversed(list(zip(parts, pieces))):
+        half = len(piece) // 2
+        for offset, data in ((0, piece[:half]), (half, piece[half:])):
+            response = client.patch(
+                f"/uploads/{part['id']}", content=data, headers={**patch_headers, "Upload-Offset": str(offset)}
+            )
+            assert response.status_code == 204
+        assert client.head(f"/uploads/{part['id']}", headers=headers).headers["Upload-Concat"] == "partial"
+    assert client.get("/trips", headers=headers).json()["trips"][0]["segments"][0]["sha256"] is None
+
+    sha = hashlib.sha256(content).hexdigest()
+    urls = " ".join(f"/uploads/{part['id']}" for part in parts)
+    assert create(len(content) + 1, sha, f"final;{urls}").status_code == 400
+    assert create(len(content), sha, "final;not-an-upload").status_code == 400
+
+    # A failed assembly leaves the parts staged and free for another final upload.
+    def broken_concat(*args):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(FilesystemStorage, "concat_uploads", broken_concat)
+        with pytest.raises(OSError):
+            create(len(content), sha, f"final;{urls}")
+    assert all(get_upload_path(part["id"]).exists() for part in parts)
+
+    final = create(len(content), sha, f"final;{urls}")
+    assert final.status_code == 201
+    assert (final.json()["status"], final.json()["offset"]) == ("complete", len(content))
+    assert not any(get_upload_path(part["id"]).exists() for part in parts)
+    # The whole file's digest is checked by the verify_checksum job, which then moves it into the blob store.
+    assert not (settings.storage_dir / blob_uri(sha)).exists()
+    _run_jobs()
+    assert (settings.storage_dir / blob_uri(sha)).read_bytes() == content
+    assert not get_upload_path(final.json()["id"]).exists()
+    assert client.get("/trips", headers=headers).json()["trips"][0]["segments"][0]["sha256"] == sha
+
+    head = client.head(f"/uploads/{final.json()['id']}", headers=headers)
+    assert head.headers["Upload-Concat"] == f"final;{urls}"
+    patch_headers["Upload-Offset"] = "0"
+    response = client.patch(f"/uploads/{final.json()['id']}", content=b"x", headers=patch_headers)
+    assert response.status_code == 403
+    assert create(len(content), sha, f"final;{urls}").status_code == 409
+
+    corrupt = create(3, hashlib.sha256(b"abc").hexdigest(), "partial").json()
+    response = client.patch(f"/uploads/{corrupt['id']}", content=b"abd", headers=patch_headers)
+    assert response.status_code == 422
+
+    # A final whose assembled bytes do not match its digest fails in the job and never reaches the blob store.
+    part = create(3, hashlib.sha256(b"abc").hexdigest(), "partial").json()
+    client.patch(f"/uploads/{part['id']}", content=b"abc", headers=patch_headers)
+    wrong = hashlib.sha256(b"abd").hexdigest()
+    assert create(3, wrong, f"final;/uploads/{part['id']}").status_code == 201
+    _run_jobs()
+    jobs = client.get("/jobs", params={"segment_id": fields["segment_id"]}, headers=headers).json()
+    assert [job["status"] for job in jobs if job["kind"] == "verify_checksum"].count("failed") == 1
+    assert not (settings.storage_dir / blob_uri(wrong)).exists()
+    assert client.get("/me/usage", headers=headers).json()["stored_files"] == 1
+
+
+def test_upload_flow_on_s3_backend(client: TestClient, monkeypatch):
+    pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+    from moto import mock_aws
+
+    from app.services import hashing
+    from app.services.s3 import S3Storage
+    from app.services.storage import reset_storage
+
+    with mock_aws():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="bike-recorder")
+        reset_storage(S3Storage("bike-recorder", s3))
+        try:
+            headers = _auth_headers(client)
+            content = b"v" * settings.s3_min_part_bytes + b"end"
+            upload = _create_upload(client, headers, content)
+            patch_headers = {**headers, "Content-Type": "application/offset+octet-stream"}
+            short = client.patch(
+                f"/uploads/{upload['id']}", content=b"v" * 10, headers={"Upload-Offset": "0", **patch_headers}
+            )
+            assert short.status_code == 400
+            first = client.patch(
+                f"/uploads/{upload['id']}",
+                content=content[: settings.s3_min_part_bytes],
+                headers={"Upload-Offset": "0", **patch_headers},
+            )
+            assert first.headers["Upload-Offset"] == str(settings.s3_min_part_bytes)
+            last = client.patch(
+                f"/uploads/{upload['id']}",
+                content=b"end",
+                headers={"Upload-Offset": str(settings.s3_min_part_bytes), **patch_headers},
+            )
+            assert last.status_code == 204
+            metadata = client.post(
+                f"/segments/{upload['segment_id']}/metadata",
+                json={"type": "gps_jsonl", "content": "{}\n"},
+                headers=headers,
+            ).json()
+            token = client.get(f"/files/{metadata['id']}/download", headers=headers).json()["token"]
+            download = client.get(f"/files/download?token={token}", follow_redirects=False)
+            assert download.status_code == 307
+            assert metadata["storage_uri"] in download.headers["location"]
+            sha = hashlib.sha256(content).hexdigest()
+            assert s3.head_object(Bucket="bike-recorder", Key=f"blobs/{sha[:2]}/{sha[2:4]}/{sha}")
+
+            # Without saved hash state the prefix would have to be read back from unfinished parts.
+            stateless = _create_upload(client, headers, content)
+            client.patch(
+                f"/uploads/{stateless['id']}",
+                content=content[: settings.s3_min_part_bytes],
+                headers={"Upload-Offset": "0", **patch_headers},
+            )
+            monkeypatch.setattr(hashing, "_libcrypto", None)
+            resumed = client.patch(
+                f"/uploads/{stateless['id']}",
+                content=b"end",
+                headers={"Upload-Offset": str(settings.s3_min_part_bytes), **patch_headers},
+            )
+            assert resumed.status_code == 409
+            monkeypatch.setattr(settings, "s3_bucket", "bike-recorder")
+            with pytest.raises(RuntimeError, match="libcrypto"):
+                S3Storage.from_settings()
+        finally:
+            reset_storage()
+
+
+def test_gps_sidecar_is_ingested_into_track_store(client: TestClient):
+    from app.services.gps import load_track
+
+    headers = _auth_headers(client)
+    upload = _create_upload(client, headers, b"x")
+    segment_id = upload["segment_id"]
+    start = dt.datetime(2025, 1, 1, 12, tzinfo=dt.timezone.utc)
+    lines = []
+    for i in range(3000):
+        ts = start + dt.timedelta(seconds=i * 0.2 + (30 if i >= 2000 else 0))
+        lines.append(json.dumps({"ts": ts.isoformat(), "lat": 49.0 + i * 1e-5, "lon": 11.0, "spd": 5.0, "acc": 3.0}))
+    lines[10], lines[11] = lines[11], lines[10]
+    lines.insert(500, "not json")
+    response = client.post(
+        f"/segments/{segment_id}/metadata",
+        json={"type": "gps_jsonl", "content": "\n".join(lines) + "\n"},
+        headers=headers,
+    )
+    assert response.status_code == 201
+    assert _run_jobs() == 1
+
+    summary = client.get(f"/segments/{segment_id}/track", headers=headers).json()
+    assert summary["sample_count"] == 3000
+    assert summary["skipped_count"] == 1
+    assert summary["gap_count"] == 1
+    assert summary["sample_rate_hz"] == pytest.approx(5.0)
+    assert summary["min_lat"] == pytest.approx(49.0)
+    assert dt.datetime.fromisoformat(summary["start_time_utc"]).replace(tzinfo=dt.timezone.utc) == start
+
+    track = load_track(uuid.UUID(segment_id))
+    assert (track["ts"][1:] >= track["ts"][:-1]).all()
+    assert track["spd"][0] == pytest.approx(5.0)
+
+
+def test_gps_sidecar_can_be_streamed_compressed(client: TestClient):
+    import gzip
+
+    headers = _auth_headers(client)
+    upload = _create_upload(client, headers, b"x")
+    segment_id = upload["segment_id"]
+    lines = b"".join(
+        json.dumps({"ts": 1735732800 + i * 0.2, "lat": 49.0 + i * 1e-5, "lon": 11.0}).encode() + b"\n"
+        for i in range(5000)
+    )
+    body = gzip.compress(lines)
+
+    def chunks():
+        for start in range(0, len(body), 4096):
+            yield body[start : start + 4096]
+
+    stream_headers = {**headers, "Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+    response = client.put(
+        f"/segments/{segment_id}/metadata", params={"validate": "true"}, content=chunks(), headers=stream_headers
+    )
+    assert response.status_code == 201
+    stored = response.json()
+    assert stored["type"] == "gps_jsonl"
+    assert stored["bytes"] == len(lines)
+    assert stored["sha256"] == hashlib.sha256(lines).hexdigest()
+    assert _run_jobs() == 1
+    track = client.get(f"/segments/{segment_id}/track", headers=headers).json()
+    assert track["sample_count"] == 5000
+
+    invalid = b'{"ts": 1735732800, "lat": 1, "lon": 2}\n{"lat": 1}\n'
+    rejected = client.put(
+        f"/segments/{segment_id}/metadata",
+        params={"validate": "true"},
+        content=invalid,
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert rejected.status_code == 422
+    assert rejected.json()["detail"]["errors"] == ["line 2: not a GPS sample with ts, lat and lon"]
+    assert client.put(
+        f"/segments/{segment_id}/metadata", content=invalid, headers={**headers, "Content-Type": "application/x-ndjson"}
+    ).status_code == 201
+
+    truncated = client.put(f"/segments/{segment_id}/metadata", content=body[:-20], headers=stream_headers)
+    assert truncated.status_code == 400
+    unsupported = client.put(
+        f"/segments/{segment_id}/metadata", content=b"x", headers={**headers, "Content-Type": "video/mp4"}
+    )
+    assert unsupported.status_code == 415
+    encoding = client.put(
+        f"/segments/{segment_id}/metadata",
+        content=b"x",
+        headers={**headers, "Content-Type": "application/gpx+xml", "Content-Encoding": "br"},
+    )
+    assert encoding.status_code == 415
+    assert not list((settings.storage_dir / "tmp").iterdir())
+
+
+def test_trip_stats_are_computed_from_gps_sidecars(client: TestClient):
+    headers = _auth_headers(client)
+    upload = _create_upload(client, headers, b"x")
+    trip_id = upload["trip_id"]
+    second = client.post(f"/trips/{trip_id}/segments", json={"index": 1, "expected_bytes": 1}, headers=headers).json()
+    start = dt.datetime(2025, 1, 1, 12, tzinfo=dt.timezone.utc)
+
+    def sidecar(first_second: int) -> str:
+        lines = []
+        for i in range(61):
+            ts = start + dt.timedelta(seconds=first_second + i)
+            lines.append(json.dumps({"ts": ts.isoformat(), "lat": 49.0 + i * 1e-4, "lon": 11.0, "alt": 300 + i}))
+        return "\n".join(lines)
+
+    client.post(
+        f"/segments/{upload['segment_id']}/metadata",
+        json={"type": "gps_jsonl", "content": sidecar(0)},
+        headers=headers,
+    )
+    _run_jobs()
+    trip = client.get(f"/trips/{trip_id}", headers=headers).json()
+    assert trip["distance_m"] == pytest.approx(60 * 11.12, rel=1e-3)
+    assert trip["duration_s"] == 60
+
+    second_sidecar = {"type": "gps_jsonl", "content": sidecar(120)}
+    client.post(f"/segments/{second['id']}/metadata", json=second_sidecar, headers=headers)
+    _run_jobs()
+    client.patch(f"/trips/{trip_id}", json={"distance_m": 1.0, "duration_s": 5}, headers=headers)
+    trip = client.get(f"/trips/{trip_id}", headers=headers).json()
+    assert trip["distance_m"] == pytest.approx(120 * 11.12, rel=1e-3)
+    assert trip["moving_time_s"] == 120
+    assert trip["duration_s"] == 180
+    assert trip["elevation_gain_m"] == 120
+    assert trip["avg_speed_mps"] == pytest.approx(11.12, rel=1e-3)
+
+
+def test_search_trips_by_bbox_and_radius(client: TestClient, monkeypatch: pytest.MonkeyPatch):
+    from sqlmodel import Session, select
+
+    from app import database
+    from app.models import TrackCell
+
+    headers = _auth_headers(client)
+    start = dt.datetime(2025, 1, 1, 12, tzinfo=dt.timezone.utc)
+
+    def record_trip(lat: float, lon: float) -> dict:
+        upload = _create_upload(client, headers, b"x")
+        lines = [
+            json.dumps({"ts": (start + dt.timedelta(seconds=i)).isoformat(), "lat": lat + i * 1e-4, "lon": lon})
+            for i in range(100)
+        ]
+        client.post(
+            f"/segments/{upload['segment_id']}/metadata",
+            json={"type": "gps_jsonl", "content": "\n".join(lines)},
+            headers=headers,
+        )
+        _run_jobs()
+        return upload
+
+    erlangen = [record_trip(49.59, 11.0), record_trip(49.60, 11.0)]
+    record_trip(52.52, 13.4)
+
+    response = client.get(
+        "/trips/search",
+        params={"min_lat": 49.5, "min_lon": 10.9, "max_lat": 49.7, "max_lon": 11.1, "limit": 1},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    page = response.json()
+    assert len(page["trips"]) == 1 and page["next_cursor"]
+    rest = client.get(
+        "/trips/search",
+        params={"min_lat": 49.5, "min_lon": 10.9, "max_lat": 49.7, "max_lon": 11.1, "cursor": page["next_cursor"]},
+        headers=headers,
+    ).json()
+    assert {trip["id"] for trip in page["trips"] + rest["trips"]} == {upload["trip_id"] for upload in erlangen}
+    assert rest["next_cursor"] is None
+    hit = rest["trips"][0]["segments"][0]
+    assert hit["segment_id"] in {upload["segment_id"] for upload in erlangen}
+
+    # A 500 m circle just south of the first trip only reaches its start.
+    nearby = client.get("/trips/search", params={"lat": 49.587, "lon": 11.0, "radius_m": 500}, headers=headers).json()
+    assert [trip["id"] for trip in nearby["trips"]] == [erlangen[0]["trip_id"]]
+    segment = nearby["trips"][0]["segments"][0]
+    assert dt.datetime.fromisoformat(segment["start_time_utc"]).replace(tzinfo=dt.timezone.utc) == start
+
+    # This circle covers most of the first trip's grid cells, but every fix is about 650 m from its centre.
+    near_miss = {"lat": 49.595, "lon": 11.009, "radius_m": 300}
+    assert client.get("/trips/search", params=near_miss, headers=headers).json()["trips"] == []
+
+    # Each cell row records the fixes it holds, so only those are checked against the exact area.
+    with Session(database.engine) as session:
+        cells = session.exec(
+            select(TrackCell).where(TrackCell.segment_id == uuid.UUID(erlangen[0]["segment_id"]))
+        ).all()
+    assert sorted((cell.first_index, cell.last_index) for cell in cells) == [(0, 99)]
+
+    # Both Erlangen trips share grid cells with this box but have no fix in it. The scan stops after the
+    # capped number of candidates and hands back a cursor instead of reading every older trip.
+    empty_strip = {"min_lat": 49.5, "min_lon": 11.001, "max_lat": 49.7, "max_lon": 11.009, "limit": 1}
+    monkeypatch.setattr(settings, "search_max_scanned_trips", 1)
+    cut_short = client.get("/trips/search", params=empty_strip, headers=headers).json()
+    assert cut_short["trips"] == [] and cut_short["next_cursor"]
+    finished = client.get(
+        "/trips/search", params={**empty_strip, "cursor": cut_short["next_cursor"]}, headers=headers
+    ).json()
+    assert finished == {"trips": [], "next_cursor": None}
+
+    assert client.get("/trips/search", params={"lat": 49.5}, headers=headers).status_code == 400
+
+
+def test_trip_track_serves_precomputed_polylines(client: TestClient):
+    import numpy as np
+
+    from app.services.polyline import encode_polyline, get_polyline_path
+
+    headers = _auth_headers(client)
+    upload = _create_upload(client, headers, b"x")
+    start = dt.datetime(2025, 1, 1, 12, tzinfo=dt.timezone.utc)
+    lines = [
+        json.dumps({"ts": (start + dt.timedelta(seconds=i * 0.2)).isoformat(), "lat": 49.0 + i * 1e-5, "lon": 11.0})
+        for i in range(18000)
+    ]
+    client.post(
+        f"/segments/{upload['segment_id']}/metadata",
+        json={"type": "gps_jsonl", "content": "\n".join(lines)},
+        headers=headers,
+    )
+    _run_jobs()
+    assert get_polyline_path(uuid.UUID(upload["segment_id"])).exists()
+
+    response = client.get(f"/trips/{upload['trip_id']}/track", params={"zoom": 13}, headers=headers)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["zoom"] == 14
+    [segment] = body["segments"]
+    assert segment["segment_id"] == upload["segment_id"]
+    # A straight line collapses to its two endpoints.
+    assert segment["polyline"] == encode_polyline(np.array([49.0, 49.17999]), np.array([11.0, 11.0]))
+
+
+def test_background_jobs_are_idempotent_and_retry_with_backoff(client: TestClient, monkeypatch):
+    from sqlmodel import Session
+
+    from app import database
+    from app.models import Job, JobKind
+    from app.services import jobs
+
+    headers = _auth_headers(client)
+    content = b"segment bytes"
+    upload = _create_upload(client, headers, content)
+    patch_headers = {"Upload-Offset": "0", **headers, "Content-Type": "application/offset+octet-stream"}
+    assert client.patch(f"/uploads/{upload['id']}", content=content, headers=patch_headers).status_code == 204
+    verify, extract = client.get("/jobs", params={"segment_id": upload["segment_id"]}, headers=headers).json()
+    assert verify["kind"] == "verify_checksum" and verify["status"] == "queued"
+    assert _run_jobs() == 2
+    assert client.get(f"/jobs/{verify['id']}", headers=headers).json()["status"] == "succeeded"
+    # The payload is not an MP4, so extraction fails without retrying.
+    extract = client.get(f"/jobs/{extract['id']}", headers=headers).json()
+    assert extract["status"] == "failed" and extract["attempts"] == 1
+
+    sidecar = {"type": "gps_jsonl", "content": '{"ts": 1735732800, "lat": 1, "lon": 2}\n'}
+    client.post(f"/segments/{upload['segment_id']}/metadata", json=sidecar, headers=headers)
+    client.post(f"/segments/{upload['segment_id']}/metadata", json=sidecar, headers=headers)
+    listed = client.get("/jobs", params={"segment_id": upload["segment_id"]}, headers=headers).json()
+    assert [job["kind"] for job in listed] == ["verify_checksum", "extract_metadata", "ingest_gps"]
+
+    calls = []
+
+    def flaky(session, payload):
+        calls.append(payload)
+        raise RuntimeError("disk on fire")
+
+    monkeypatch.setitem(jobs.HANDLERS, JobKind.INGEST_GPS, flaky)
+    monkeypatch.setattr(settings, "job_backoff_seconds", 60)
+    assert _run_jobs() == 1
+    ingest = client.get(f"/jobs/{listed[2]['id']}", headers=headers).json()
+    assert ingest["status"] == "queued" and ingest["attempts"] == 1
+    assert "disk on fire" in ingest["last_error"]
+    assert _run_jobs() == 0  # backing off
+
+    with Session(database.engine) as session:
+        job = session.get(Job, uuid.UUID(ingest["id"]))
+        job.run_after = dt.datetime.now(dt.timezone.utc)
+        job.max_attempts = 2
+        session.add(job)
+        session.commit()
+    assert _run_jobs() == 1
+    assert client.get(f"/jobs/{ingest['id']}", headers=headers).json()["status"] == "failed"
+    assert len(calls) == 2
+    other = _auth_headers(client, "other@example.com")
+    assert client.get(f"/jobs/{ingest['id']}", headers=other).status_code == 403
+
+
+def test_segment_metadata_is_extracted_from_uploaded_mp4(client: TestClient):
+    from test_mp4 import sample_mp4
+
+    headers = _auth_headers(client)
+    content = sample_mp4()
+    upload = _create_upload(client, headers, content)
+    patch_headers = {"Upload-Offset": "0", **headers, "Content-Type": "application/offset+octet-stream"}
+    assert client.patch(f"/uploads/{upload['id']}", content=content, headers=patch_headers).status_code == 204
+    client.patch(
+        f"/trips/{upload['trip_id']}/segments/{upload['segment_id']}",
+        json={"duration_s": 99.0},
+        headers=headers,
+    )
+    assert _run_jobs() == 3
+    trip = client.get(f"/trips/{upload['trip_id']}", headers=headers).json()
+    [segment] = trip["segments"]
+    assert segment["video_codec"] == "h264"
+    assert segment["audio_codec"] == "aac"
+    assert (segment["width"], segment["height"]) == (1920, 1080)
+    assert segment["fps"] == pytest.approx(29.97, abs=0.01)
+    assert segment["duration_s"] == pytest.approx(10.01)
+    assert segment["media_error"] is None
+
+    client.patch(
+        f"/trips/{upload['trip_id']}/segments/{upload['segment_id']}",
+        json={"duration_s": 99.0},
+        headers=headers,
+    )
+    trip = client.get(f"/trips/{upload['trip_id']}", headers=headers).json()
+    assert trip["segments"][0]["duration_s"] == pytest.approx(10.01)
+
+
+def test_thumbnail_job_fails_cleanly_without_ffmpeg(client: TestClient, monkeypatch):
+    from test_mp4 import sample_mp4
+
+    monkeypatch.setattr(settings, "ffmpeg_binary", "ffmpeg-not-installed")
+    headers = _auth_headers(client)
+    content = sample_mp4()
+    upload = _create_upload(client, headers, content)
+    patch_headers = {"Upload-Offset": "0", **headers, "Content-Type": "application/offset+octet-stream"}
+    client.patch(f"/uploads/{upload['id']}", content=content, headers=patch_headers)
+    assert _run_jobs() == 3
+    listed = client.get("/jobs", params={"segment_id": upload["segment_id"]}, headers=headers).json()
+    [thumbnails] = [job for job in listed if job["kind"] == "generate_thumbnails"]
+    assert thumbnails["status"] == "failed" and thumbnails["attempts"] == 1
+    assert "ffmpeg-not-installed not found" in thumbnails["last_error"]
+    assert client.get(f"/segments/{upload['segment_id']}/sprite", headers=headers).status_code == 404
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_thumbnails_and_sprite_are_generated(client: TestClient, tmp_path: Path):
+    source = tmp_path / "clip.mp4"
+    subprocess.run(
+        ["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=duration=25:size=320x240:rate=10", str(source)],
+        check=True,
+    )
+    headers = _auth_headers(client)
+    content = source.read_bytes()
+    upload = _create_upload(client, headers, content)
+    patch_headers = {"Upload-Offset": "0", **headers, "Content-Type": "application/offset+octet-stream"}
+    client.patch(f"/uploads/{upload['id']}", content=content, headers=patch_headers)
+    assert _run_jobs() == 3
+    [segment] = client.get(f"/trips/{upload['trip_id']}", headers=headers).json()["segments"]
+    assert segment["thumbnail_count"] == 3
+    assert segment["thumbnail_interval_s"] == 10.0
+
+    sprite = client.get(f"/segments/{upload['segment_id']}/sprite", headers=headers)
+    assert sprite.status_code == 200
+    assert sprite.headers["content-type"] == "image/jpeg"
+    assert sprite.content[:2] == b"\xff\xd8"
+    assert "immutable" in sprite.headers["cache-control"]
+    assert sprite.headers["x-sprite-columns"] == "3"
+    cached = client.get(
+        f"/segments/{upload['segment_id']}/sprite",
+        headers={**headers, "If-None-Match": sprite.headers["etag"]},
+    )
+    assert cached.status_code == 304
+
+
+def test_segment_positions_are_aligned_to_video_time(client: TestClient):
+    from test_mp4 import CREATED, sample_mp4
+
+    headers = _auth_headers(client)
+    content = sample_mp4()
+    upload = _create_upload(client, headers, content)
+    patch_headers = {"Upload-Offset": "0", **headers, "Content-Type": "application/offset+octet-stream"}
+    client.patch(f"/uploads/{upload['id']}", content=content, headers=patch_headers)
+    lines = [
+        json.dumps({"ts": (CREATED + dt.timedelta(seconds=i - 2)).isoformat(), "lat": 49.0 + i * 1e-4, "lon": 11.0})
+        for i in range(20)
+    ]
+    client.post(
+        f"/segments/{upload['segment_id']}/metadata",
+        json={"type": "gps_jsonl", "content": "\n".join(lines)},
+        headers=headers,
+    )
+    assert _run_jobs() == 4
+
+    position = client.get(f"/segments/{upload['segment_id']}/position", params={"t": 2.5}, headers=headers).json()
+    assert position["lat"] == pytest.approx(49.0 + 4.5e-4)
+    assert dt.datetime.fromisoformat(position["ts_utc"]) == CREATED + dt.timedelta(seconds=2.5)
+    missing = client.get(f"/segments/{upload['segment_id']}/position", params={"t": 500}, headers=headers)
+    assert missing.status_code == 404
+
+    bulk = client.post(
+        f"/segments/{upload['segment_id']}/positions", json={"t": [0, 1.25, 500]}, headers=headers
+    ).json()
+    assert bulk["lat"][0] == pytest.approx(49.0002)
+    assert bulk["lat"][1] == pytest.approx(49.000325)
+    assert bulk["lat"][2] is None
@@ -0,0 +1,190 @@
+import gzip
+import io
+import math
+
+import pytest
+
+from app.services import gps, sidecar
+
+
+def test_gpx_samples_are_streamed_with_namespaces():
+    gpx = b"""<?xml version="1.0"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg>
+<trkpt lat="49.5" lon="11.1"><ele>300.5</ele><time>2025-01-01T12:00:00Z</time></trkpt>
+<trkpt lat="91" lon="11.1"><time>2025-01-01T12:00:01Z</time></trkpt>
+<trkpt lat="49.6" lon="11.2"><time>2025-01-01T12:00:02Z</time></trkpt>
+</trkseg></trk>"""
+    samples = list(gps.iter_gpx_samples(io.BytesIO(gpx)))
+    assert samples[1] is None
+    assert samples[-1] is None  # truncated document
+    first = samples[0]
+    assert first[1:3] == (49.5, 11.1)
+    assert first[3] == 300.5
+    assert math.isnan(first[4])
+
+
+def test_write_track_spans_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(gps, "BLOCK_SAMPLES", 4)
+    samples = [(float(i), 1.0, 2.0, 0.0, 0.0, 0.0, 0.0) for i in range(10)]
+    path = tmp_path / "track.bin"
+    assert gps.write_track(samples + [None], path) == (10, 1)
+    assert path.stat().st_size == 10 * gps.SAMPLE_DTYPE.itemsize
+
+
+def test_track_stats_skip_gaps_and_inaccurate_fixes(monkeypatch):
+    import numpy as np
+
+    from app.config import settings
+    from app.services.stats import compute_track_stats
+
+    monkeypatch.setattr(settings, "gps_smoothing_window_seconds", 0.0)
+
+    # 0.0001 deg of latitude ~= 11.12 m; one fix per second.
+    track = np.zeros(6, dtype=gps.SAMPLE_DTYPE)
+    track["ts"] = [0, 1, 2, 3, 100, 101]
+    track["lat"] = [0, 0.0001, 0.0002, 0.0003, 0.0004, 0.0005]
+    track["alt"] = [10, 12, 11, 15, 30, 31]
+    track["spd"] = np.nan
+    track["acc"] = [3, 3, 500, 3, 3, 3]
+    stats = compute_track_stats(track)
+    # Fix 2 is dropped and 3 -> 100 s is a gap, leaving 0->1, 1->3 and 100->101.
+    assert stats["distance_m"] == pytest.approx(4 * 11.12, rel=1e-3)
+    assert stats["moving_time_s"] == 4.0
+    assert stats["max_speed_mps"] == pytest.approx(11.12, rel=1e-3)
+    # 10 -> 15 is one climb through the 3 m dead band; the dip to 11 stays inside it.
+    assert stats["elevation_gain_m"] == 5.0
+
+
+def test_elevation_gain_counts_climbs_between_confirmed_turning_points():
+    import numpy as np
+
+    from app.services.stats import elevation_gain
+
+    usable = np.ones(9, dtype=bool)
+    # The climb tops out at 9.5 m; the drop to 6 m confirms that peak, and the wobble to 7 m stays in the band.
+    assert elevation_gain(np.array([0, 2, 4, 6, 8, 9.5, 6, 7, 6, 6.5]), usable, 3.0) == 9.5
+    usable[6] = False
+    assert elevation_gain(np.array([0, 2, 4, 6, 8, 9.5, np.nan, 7, 10, 12]), usable, 3.0) == 9.5 + 5
+    usable[6] = True
+    assert elevation_gain(np.array([0, 1.5, -1.5, 1.5, -1.5, 1.5, -1.5, 1.5, -1.5, 1.5]), usable, 3.0) == 0.0
+
+
+def test_max_speed_ignores_implausible_reported_speeds():
+    import numpy as np
+
+    from app.services.stats import compute_track_stats
+
+    track = np.zeros(4, dtype=gps.SAMPLE_DTYPE)
+    track["ts"] = [0, 1, 2, 3]
+    track["lat"] = [0, 0.0001, 0.0002, 0.0003]
+    track["spd"] = [5, 5, 80, 6]
+    track["acc"] = 5.0
+    stats = compute_track_stats(track)
+    assert stats["max_speed_mps"] == 6.0
+    assert stats["distance_m"] == pytest.approx(3 * 11.12, rel=1e-3)
+
+
+def test_track_stats_ignore_jitter_while_parked():
+    import numpy as np
+
+    from app.services.stats import compute_track_stats
+
+    # One hour parked at 1 Hz with ~1 m position and altitude noise.
+    rng = np.random.default_rng(7)
+    track = np.zeros(3600, dtype=gps.SAMPLE_DTYPE)
+    track["ts"] = np.arange(3600)
+    track["lat"] = 49.5 + rng.normal(0, 1e-5, 3600)
+    track["lon"] = 11.1 + rng.normal(0, 1e-5, 3600)
+    track["alt"] = 300 + rng.normal(0, 1, 3600)
+    track["spd"] = 0.0
+    track["acc"] = 5.0
+    stats = compute_track_stats(track)
+    assert stats["distance_m"] == 0.0
+    assert stats["moving_time_s"] == 0.0
+    assert stats["elevation_gain_m"] < 10.0
+    # GPX has no speed field, so parking is detected from the net displacement over the smoothing window.
+    track["spd"] = np.nan
+    assert compute_track_stats(track)["distance_m"] < 100.0
+
+
+def test_polyline_encoding_and_simplification():
+    import numpy as np
+
+    from app.services.polyline import encode_polyline, simplify
+
+    encoded = encode_polyline(np.array([38.5, 40.7, 43.252]), np.array([-120.2, -120.95, -126.453]))
+    assert encoded == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+    x = np.arange(11, dtype=float)
+    y = np.zeros(11)
+    y[5] = 3.0
+    assert simplify(x, y, 2.5).tolist() == [0, 5, 10]
+    assert simplify(x, y, 5.0).tolist() == [0, 10]
+
+
+def test_alignment_lookup_interpolates_and_respects_gaps():
+    import numpy as np
+
+    from app.services.alignment import ALIGNMENT_DTYPE, lookup_positions
+
+    index = np.zeros(4, dtype=ALIGNMENT_DTYPE)
+    index["pts"] = [0.0, 1.0, 2.0, 20.0]
+    index["lat"] = [10.0, 11.0, 12.0, 13.0]
+    index["brg"] = [350.0, 10.0, 10.0, 10.0]
+    positions = lookup_positions(index, np.array([-1.0, 0.5, 2.0, 10.0, 20.0, 21.0]))
+    lat = positions["lat"]
+    assert math.isnan(lat[0]) and math.isnan(lat[3]) and math.isnan(lat[5])
+    assert lat[1] == pytest.approx(10.5)
+    assert lat[2] == 12.0 and lat[4] == 13.0
+    assert positions["brg"][1] == pytest.approx(0.0)
+
+
+def test_sidecar_validators_work_across_chunk_boundaries():
+    body = b'{"ts": 1735732800, "lat": 1, "lon": 2}\nnot json\n{"ts": 1735732801, "lat": 95, "lon": 2}\n{"ts": 1'
+    validator = sidecar.JsonlValidator()
+    for start in range(0, len(body), 7):
+        validator.feed(body[start : start + 7])
+    validator.feed(b'735732802, "lat": 1, "lon": 2}')
+    validator.close()
+    assert validator.records == 4
+    assert [error.split(":")[0] for error in validator.errors] == ["line 2", "line 3"]
+
+    gpx = sidecar.GpxValidator()
+    gpx.feed(b'<gpx><trk><trkseg><trkpt lat="1" lon="2"/><trkpt lat="x"')
+    gpx.feed(b' lon="2"/></trkseg></trk>')
+    gpx.close()
+    assert gpx.records == 2
+    assert gpx.error_count == 2  # the bad trkpt and the unclosed <gpx>
+
+
+def test_gzip_decoder_bounds_each_output_slice():
+    raw = b"0" * (5 * sidecar.DECODE_SLICE_BYTES)
+    body = gzip.compress(raw) + gzip.compress(b"tail")
+    decoder = sidecar.GzipDecoder()
+    slices = [chunk for start in range(0, len(body), 1024) for chunk in decoder.decode(body[start : start + 1024])]
+    slices += list(decoder.finish())
+    assert max(len(chunk) for chunk in slices) <= sidecar.DECODE_SLICE_BYTES
+    assert b"".join(slices) == raw + b"tail"
+    with pytest.raises(sidecar.SidecarDecodeError):
+        list(sidecar.GzipDecoder().finish())
+
+
+def test_zstd_decoder_bounds_each_output_slice_and_rejects_truncated_frames():
+    zstandard = pytest.importorskip("zstandard")
+    raw = b"0" * (5 * sidecar.DECODE_SLICE_BYTES)
+    body = zstandard.ZstdCompressor().compress(raw) + zstandard.ZstdCompressor().compress(b"tail")
+    decoder = sidecar.ZstdDecoder()
+    slices = [chunk for start in range(0, len(body), 64) for chunk in decoder.decode(body[start : start + 64])]
+    slices += list(decoder.finish())
+    assert max(len(chunk) for chunk in slices) <= sidecar.DECODE_SLICE_BYTES
+    assert b"".join(slices) == raw + b"tail"
+    whole = sidecar.ZstdDecoder()
+    slices = list(whole.decode(body)) + list(whole.finish())
+    assert max(len(chunk) for chunk in slices) <= sidecar.DECODE_SLICE_BYTES
+    assert b"".join(slices) == raw + b"tail"
+    truncated = sidecar.ZstdDecoder()
+    list(truncated.decode(body[:-3]))
+    with pytest.raises(sidecar.SidecarDecodeError):
+        list(truncated.finish())
+    with pytest.raises(sidecar.SidecarDecodeError):
+        list(sidecar.ZstdDecoder().decode(body + b"junk"))
@@ -0,0 +1,128 @@
+import datetime as dt
+import io
+import struct
+import time
+
+import pytest
+
+from app.services.mp4 import MP4_EPOCH_OFFSET, Mp4Error, parse_mp4
+
+CREATED = dt.datetime(2025, 1, 1, 12, tzinfo=dt.timezone.utc)
+
+
+def box(kind: bytes, payload: bytes = b"") -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def full_box(kind: bytes, version: int, payload: bytes) -> bytes:
+    return box(kind, bytes([version, 0, 0, 0]) + payload)
+
+
+def mvhd(timescale: int, duration: int, version: int = 0) -> bytes:
+    created = int(CREATED.timestamp()) + MP4_EPOCH_OFFSET
+    if version == 1:
+        return full_box(b"mvhd", 1, struct.pack(">QQIQ", created, created, timescale, duration) + bytes(80))
+    return full_box(b"mvhd", 0, struct.pack(">IIII", created, created, timescale, duration) + bytes(80))
+
+
+def trak(
+    track_id: int,
+    handler: bytes,
+    entry: bytes,
+    timescale: int,
+    stts: list[tuple[int, int]],
+    version: int = 0,
+) -> bytes:
+    duration = sum(count * delta for count, delta in stts)
+    if version == 1:
+        tkhd = full_box(b"tkhd", 1, struct.pack(">QQIIQ", 0, 0, track_id, 0, duration) + bytes(60))
+        mdhd = full_box(b"mdhd", 1, struct.pack(">QQIQ", 0, 0, timescale, duration) + bytes(4))
+    else:
+        tkhd = full_box(b"tkhd", 0, struct.pack(">IIIII", 0, 0, track_id, 0, duration) + bytes(60))
+        mdhd = full_box(b"mdhd", 0, struct.pack(">IIII", 0, 0, timescale, duration) + bytes(4))
+    hdlr = full_box(b"hdlr", 0, struct.pack(">I4s", 0, handler) + bytes(13))
+    stsd = full_box(b"stsd", 0, struct.pack(">I", 1) + entry)
+    stts_box = full_box(b"stts", 0, struct.pack(">I", len(stts)) + b"".join(struct.pack(">II", *e) for e in stts))
+    stbl = box(b"stbl", stsd + stts_box)
+    return box(b"trak", tkhd + box(b"mdia", mdhd + hdlr + box(b"minf", stbl)))
+
+
+def visual_entry(fourcc: bytes, width: int, height: int) -> bytes:
+    return box(fourcc, bytes(6) + struct.pack(">H", 1) + bytes(16) + struct.pack(">HH", width, height) + bytes(50))
+
+
+def sample_entry(fourcc: bytes) -> bytes:
+    return box(fourcc, bytes(6) + struct.pack(">H", 1) + bytes(20))
+
+
+def sample_moov(version: int = 0) -> bytes:
+    video = trak(1, b"vide", visual_entry(b"avc1", 1920, 1080), 30000, [(300, 1001)], version)
+    audio = trak(2, b"soun", sample_entry(b"mp4a"), 48000, [(470, 1024)], version)
+    gps = trak(3, b"meta", sample_entry(b"camm"), 1000, [(50, 200)], version)
+    return box(b"moov", mvhd(1000, 10010, version) + video + audio + gps)
+
+
+def sample_mp4(moov_first: bool = False) -> bytes:
+    ftyp = box(b"ftyp", b"isom" + struct.pack(">I", 512) + b"isomavc1")
+    mdat = box(b"mdat", bytes(1024))
+    moov = sample_moov()
+    return ftyp + (moov + mdat if moov_first else mdat + moov)
+
+
+@pytest.mark.parametrize("moov_first", [False, True])
+def test_parse_mp4_reads_tracks(moov_first):
+    info = parse_mp4(io.BytesIO(sample_mp4(moov_first)))
+    assert info.brand == "isom"
+    assert info.duration_s == pytest.approx(10.01)
+    assert info.created_at == CREATED
+    video = info.first("vide")
+    assert (video.codec, video.width, video.height) == ("avc1", 1920, 1080)
+    assert video.fps == pytest.approx(29.97, abs=0.01)
+    assert info.first("soun").codec == "mp4a"
+    assert [track.codec for track in info.metadata_tracks] == ["camm"]
+
+
+def test_parse_mp4_large_file_only_touches_moov(tmp_path):
+    path = tmp_path / "large.mp4"
+    media_bytes = 4 * 1024**3
+    with path.open("wb") as fp:
+        fp.write(box(b"ftyp", b"mp42" + bytes(4)))
+        fp.write(struct.pack(">I4sQ", 1, b"mdat", 16 + media_bytes))
+        fp.seek(media_bytes, io.SEEK_CUR)
+        fp.write(sample_moov(version=1))
+    timings = []
+    for _ in range(3):
+        started = time.perf_counter()
+        with path.open("rb") as fp:
+            info = parse_mp4(fp)
+        timings.append(time.perf_counter() - started)
+    assert info.first("vide").width == 1920
+    assert min(timings) < 0.05
+
+
+def test_parse_fragmented_mp4_uses_mehd_duration():
+    mehd = full_box(b"mehd", 0, struct.pack(">I", 60_000))
+    video = trak(1, b"vide", visual_entry(b"hvc1", 1280, 720), 90000, [])
+    moov = box(b"moov", mvhd(1000, 0) + video + box(b"mvex", mehd))
+    info = parse_mp4(io.BytesIO(box(b"ftyp", b"iso6" + bytes(4)) + moov + box(b"moof") + box(b"mdat")))
+    assert info.duration_s == 60.0
+    assert info.first("vide").codec == "hvc1"
+    assert info.first("vide").fps is None
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"not an mp4 at all",
+        box(b"ftyp", b"isom") + box(b"mdat", bytes(16)),
+        box(b"ftyp", b"isom") + struct.pack(">I4s", 4096, b"moov") + bytes(32),
+        box(b"ftyp", b"isom") + box(b"moov", struct.pack(">I4s", 400, b"trak") + bytes(8)),
+        box(b"ftyp", b"isom") + box(b"moov", mvhd(0, 100)),
+        box(b"ftyp", b"isom") + box(b"moov", full_box(b"mvhd", 7, bytes(96))),
+        box(b"ftyp", b"isom") + box(b"moov", trak(1, b"vide", visual_entry(b"avc1", 1, 1), 1, [(1, 1)])),
+    ],
+)
+def test_parse_mp4_rejects_corrupt_files(data):
+    with pytest.raises(Mp4Error):
+        parse_mp4(io.BytesIO(data))
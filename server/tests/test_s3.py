@@ -0,0 +1,104 @@
+import hashlib
+
+import pytest
+
+pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+from moto import mock_aws  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.services.hashing import ResumableSha256  # noqa: E402
+from app.services.s3 import S3Storage  # noqa: E402
+from app.services.storage import ChunkTooSmall, blob_uri  # noqa: E402
+
+
+@pytest.fixture()
+def storage(monkeypatch):
+    monkeypatch.setattr(settings, "upload_buffer_bytes", 64 * 1024)
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="bike-recorder")
+        yield S3Storage("bike-recorder", client)
+
+
+def _send(storage: S3Storage, upload_id: str, handle: str, offset: int, data: bytes, total: int, hasher=None) -> int:
+    writer = storage.open_chunk(upload_id, handle, offset, limit=total - offset, total=total, hasher=hasher)
+    for start in range(0, len(data), 100_000):
+        writer.write(data[start : start + 100_000])
+    writer.close()
+    return writer.written
+
+
+def test_s3_chunks_map_onto_multipart_parts(storage: S3Storage):
+    content = b"a" * settings.s3_min_part_bytes + b"tail"
+    sha = hashlib.sha256(content).hexdigest()
+    handle = storage.begin_upload("up-1", sha)
+    hasher = ResumableSha256()
+    first = content[: settings.s3_min_part_bytes]
+    assert _send(storage, "up-1", handle, 0, first, len(content), hasher) == len(first)
+    assert _send(storage, "up-1", handle, len(first), b"tail", len(content), hasher) == 4
+    assert hasher.hexdigest() == sha
+
+    uri, size = storage.commit_upload("up-1", handle, sha, len(content))
+    assert (uri, size) == (blob_uri(sha), len(content))
+    assert storage.exists(uri)
+    assert not storage.exists("uploads/up-1")
+    with storage.open(uri) as fp:
+        fp.seek(len(content) - 6)
+        assert fp.read() == b"aatail"
+    assert "Signature=" in storage.presign(uri, 60, "segment.mp4")
+
+    # A second upload of the same content is discarded at finalize instead of completing over the blob.
+    again = storage.begin_upload("up-2", sha)
+    _send(storage, "up-2", again, 0, first, len(content))
+    _send(storage, "up-2", again, len(first), b"tail", len(content))
+    assert storage.commit_upload("up-2", again, sha, len(content)) == (uri, len(content))
+    assert not storage.client.list_multipart_uploads(Bucket="bike-recorder").get("Uploads")
+    storage.abort_upload("up-2", again)
+    assert storage.exists(uri)
+    storage.delete(uri)
+    assert not storage.exists(uri)
+
+
+def test_s3_rejects_short_intermediate_parts(storage: S3Storage):
+    handle = storage.begin_upload("up-3")
+    with pytest.raises(ChunkTooSmall):
+        _send(storage, "up-3", handle, 0, b"short", settings.s3_min_part_bytes * 2)
+    storage.abort_upload("up-3", handle)
+
+
+def test_s3_concatenates_sealed_partials_with_part_copy(storage: S3Storage):
+    first = b"p" * settings.s3_min_part_bytes
+    content = first + b"rest"
+    handles = {}
+    for upload_id, data in (("part-1", first), ("part-2", b"rest")):
+        handles[upload_id] = storage.begin_upload(upload_id)
+        _send(storage, upload_id, handles[upload_id], 0, data, len(data))
+        storage.seal_upload(upload_id, handles[upload_id], len(data))
+    with storage.open_upload("part-2", handles["part-2"]) as fp:
+        assert fp.read() == b"rest"
+
+    small = storage.begin_upload("final-small")
+    with pytest.raises(ChunkTooSmall):
+        storage.concat_uploads("final-small", small, [("part-2", handles["part-2"], 4), ("part-1", None, 0)])
+    storage.abort_upload("final-small", small)
+
+    handle = storage.begin_upload("final")
+    parts = [("part-1", handles["part-1"], len(first)), ("part-2", handles["part-2"], 4)]
+    storage.concat_uploads("final", handle, parts)
+    # The parts stay readable until the final upload has been assembled and committed.
+    assert storage.exists("uploads/part-1")
+    for upload_id, part_handle, _ in parts:
+        storage.abort_upload(upload_id, part_handle)
+    assert not storage.exists("uploads/part-1")
+    # The sealed final is readable at its staging key for the checksum job, which then moves it to its blob.
+    storage.seal_upload("final", handle, len(content))
+    with storage.open("uploads/final") as fp:
+        sha = hashlib.sha256(fp.read()).hexdigest()
+    assert sha == hashlib.sha256(content).hexdigest()
+    uri, size = storage.commit_staged("final", sha, len(content))
+    assert size == len(content)
+    assert not storage.exists("uploads/final")
+    with storage.open(uri) as fp:
+        fp.seek(len(content) - 6)
+        assert fp.read() == b"pprest"
@@ -0,0 +1,132 @@
+import hashlib
+
+import pytest
+
+from app.services.hashing import ResumableSha256
+from app.services.storage import ChunkTooLarge, ChunkWriter, copy_range, resume_sha256
+
+
+def test_chunk_writer_flushes_bounded_buffers(tmp_path):
+    path = tmp_path / "uploads" / "abc"
+    writer = ChunkWriter(path, 0, limit=10, buffer_size=4)
+    writer.write(b"abc")
+    assert writer.received == 0
+    writer.write(b"def")
+    assert writer.received == 6
+    with pytest.raises(ChunkTooLarge):
+        writer.write(b"ghijk")
+    writer.write(b"gh")
+    writer.close()
+    assert writer.written == 8
+    assert path.read_bytes() == b"abcdefgh"
+
+
+def test_resumable_sha256_continues_from_saved_state():
+    first = ResumableSha256()
+    first.update(b"x" * 1000)
+    if first.state is None:
+        pytest.skip("libcrypto not available")
+    resumed = ResumableSha256(first.state)
+    assert resumed.length == 1000
+    resumed.update(b"y" * 333)
+    assert resumed.hexdigest() == hashlib.sha256(b"x" * 1000 + b"y" * 333).hexdigest()
+
+
+def test_resume_sha256_rehashes_prefix_when_state_is_stale(tmp_path):
+    path = tmp_path / "upload"
+    path.write_bytes(b"0123456789")
+    stale = ResumableSha256()
+    stale.update(b"0123")
+    hasher = resume_sha256(lambda: path.open("rb"), 6, stale.state)
+    hasher.update(b"6789")
+    assert hasher.hexdigest() == hashlib.sha256(b"0123456789").hexdigest()
+
+
+def test_resumable_sha256_state_is_portable(tmp_path):
+    import struct
+
+    first = ResumableSha256()
+    first.update(b"abc")
+    if first.state is None:
+        pytest.skip("libcrypto not available")
+    # Format byte, the initial SHA-256 chaining words, the byte count and the unfinished block; nothing from OpenSSL.
+    initial = (0x6A09E667, 0xBB67AE85, 0x3C6EF372, 0xA54FF53A, 0x510E527F, 0x9B05688C, 0x1F83D9AB, 0x5BE0CD19)
+    assert first.state == struct.pack(">B8IQ", 1, *initial, 3) + b"abc"
+    corrupt = b"\x09" + first.state[1:]
+    with pytest.raises(ValueError):
+        ResumableSha256(corrupt)
+    path = tmp_path / "upload"
+    path.write_bytes(b"abcdef")
+    hasher = resume_sha256(lambda: path.open("rb"), 3, corrupt)
+    hasher.update(b"def")
+    assert hasher.hexdigest() == hashlib.sha256(b"abcdef").hexdigest()
+
+
+def test_resume_sha256_defers_to_completion_without_libcrypto(tmp_path, monkeypatch):
+    from app.services import hashing
+
+    monkeypatch.setattr(hashing, "_libcrypto", None)
+
+    def fail():
+        raise AssertionError("the prefix must not be re-read")
+
+    assert resume_sha256(fail, 4, None) is None
+    assert resume_sha256(fail, 0, None).state is None
+
+
+def test_store_blob_deduplicates_identical_content(tmp_path, monkeypatch):
+    from app.config import settings
+    from app.services.storage import blob_uri, store_blob
+
+    monkeypatch.setattr(settings, "storage_dir", tmp_path)
+    sha = hashlib.sha256(b"same bytes").hexdigest()
+    first = tmp_path / "first"
+    second = tmp_path / "second"
+    first.write_bytes(b"same bytes")
+    second.write_bytes(b"same bytes")
+    assert store_blob(first, sha) == (blob_uri(sha), 10)
+    assert store_blob(second, sha) == (blob_uri(sha), 10)
+    assert not first.exists() and not second.exists()
+    assert blob_uri(sha) == f"blobs/{sha[:2]}/{sha[2:4]}/{sha}"
+    assert (tmp_path / blob_uri(sha)).read_bytes() == b"same bytes"
+
+
+def test_store_blob_refreshes_mtime_on_dedupe_and_sweep_tolerates_vanished_files(tmp_path, monkeypatch):
+    import os
+
+    from app.config import settings
+    from app.services.storage import blob_uri, store_blob
+    from app.services.sweeper import SweepReport, _remove
+
+    monkeypatch.setattr(settings, "storage_dir", tmp_path)
+    sha = hashlib.sha256(b"same bytes").hexdigest()
+    (tmp_path / "first").write_bytes(b"same bytes")
+    store_blob(tmp_path / "first", sha)
+    blob = tmp_path / blob_uri(sha)
+    os.utime(blob, (0, 0))
+    (tmp_path / "second").write_bytes(b"same bytes")
+    store_blob(tmp_path / "second", sha)
+    # The orphan sweep judges unreferenced blobs by age, so a fresh reference must make the blob young again.
+    assert blob.stat().st_mtime > 0
+
+    report = SweepReport()
+    _remove(tmp_path / "gone", report)
+    assert (report.orphan_files, report.orphan_bytes) == (0, 0)
+
+
+@pytest.mark.parametrize("kernel_copy", [True, False])
+def test_copy_range_appends_with_or_without_copy_file_range(tmp_path, monkeypatch, kernel_copy):
+    import os
+
+    if not kernel_copy:
+        monkeypatch.delattr(os, "copy_file_range", raising=False)
+    source = tmp_path / "part"
+    dest = tmp_path / "final"
+    source.write_bytes(b"0123456789" * 1000)
+    dest.write_bytes(b"head")
+    with source.open("rb", buffering=0) as src, dest.open("r+b", buffering=0) as out:
+        out.seek(4)
+        copy_range(src, out, 10_000)
+        with pytest.raises(ValueError):
+            copy_range(src, out, 1)
+    assert dest.read_bytes() == b"head" + b"0123456789" * 1000